@@ -23,10 +23,13 @@ from layman.config          import BareConfig
 from layman.dbbase          import UnknownOverlayException, UnknownOverlayMessage
 from layman.db              import DB
 from layman.remotedb        import RemoteDB
+from layman.module          import Modules
+from layman.overlays.overlay import MOD_PATH
 from layman.overlays.source import require_supported
 #from layman.utils import path, delete_empty_directory
 from layman.compatibility   import encode
-from layman.utils           import get_ans, verify_overlay_src
+from layman.utils           import get_ans, get_jobs, pool_map, \
+                                   terminal_width, verify_overlay_src
 from layman.mounter         import Mounter
 
 if sys.hexversion >= 0x30200f0:
@@ -81,7 +84,7 @@ class LaymanAPI(object):
         @type ovl: str
         @rtype boolean
         """
-        return ovl in self.get_available()
+        return ovl in self._get_remote_db()
 
 
     def is_installed(self, ovl):
@@ -91,7 +94,7 @@ class LaymanAPI(object):
         @type ovl: str
         @rtype boolean
         """
-        return ovl in self.get_installed()
+        return ovl in self._get_installed_db()
 
 
     @staticmethod
@@ -116,20 +119,22 @@ class LaymanAPI(object):
         """
         repos = self._check_repo_type(repos, "delete_repo")
         results = []
-        for ovl in repos:
-            if not self.is_installed(ovl):
-                self.output.error("Repository '"+ovl+"' was not installed")
-                results.append(False)
-                continue
-            success = False
-            try:
-                success = self._get_installed_db().delete(
-                    self._get_installed_db().select(ovl))
-            except Exception as e:
-                self._error('Exception caught removing repository "%(repo)s":\n'
-                            '%(err)s' % {'repo': ovl, 'err': e})
-            results.append(success)
-            self.get_installed(dbreload=True)
+        db = self._get_installed_db()
+        with db.batch():
+            for ovl in repos:
+                if not self.is_installed(ovl):
+                    self.output.error("Repository '"+ovl+"' was not installed")
+                    results.append(False)
+                    continue
+                success = False
+                try:
+                    success = db.delete(db.select(ovl))
+                except Exception as e:
+                    self._error('Exception caught removing repository '
+                                '"%(repo)s":\n%(err)s'
+                                % {'repo': ovl, 'err': e})
+                results.append(success)
+                self._installed_ids = db.list_ids()
         if False in results:
             return False
         return True
@@ -145,24 +150,30 @@ class LaymanAPI(object):
         """
         repos = self._check_repo_type(repos, "add_repo")
         results = []
-        for ovl in repos:
-            if self.is_installed(ovl):
-                self.output.error("Repository '"+ovl+"' was already installed")
-                results.append(False)
-                continue
-            if not self.is_repo(ovl):
-                self.output.error(UnknownOverlayMessage(ovl))
-                results.append(False)
-                continue
-            success = False
-            try:
-                success = self._get_installed_db().add(
-                    self._get_remote_db().select(ovl))
-            except Exception as e:
-                self._error('Exception caught installing repository "%(repo)s":'
-                            '\n%(err)s' % {'repo': ovl, 'err': e})
-            results.append(success)
-            self.get_installed(dbreload=True)
+        db = self._get_installed_db()
+        with db.batch():
+            for ovl in repos:
+                if self.is_installed(ovl):
+                    self.output.error("Repository '"+ovl+"' was already installed")
+                    results.append(False)
+                    continue
+                if not self.is_repo(ovl):
+                    self.output.error(UnknownOverlayMessage(ovl))
+                    results.append(False)
+                    continue
+                success = False
+                rdb = self._get_remote_db()
+                try:
+                    success = db.add(rdb.select(ovl))
+                    # The overlay object is shared with the remote db and
+                    # got its priority set.
+                    rdb.overlays.touch()
+                except Exception as e:
+                    self._error('Exception caught installing repository '
+                                '"%(repo)s":\n%(err)s'
+                                % {'repo': ovl, 'err': e})
+                results.append(success)
+                self._installed_ids = db.list_ids()
         if (True in results) and update_news:
             self.update_news(repos)
 
@@ -190,20 +201,21 @@ class LaymanAPI(object):
     def disable_repos(self, repos, update_news=False):
         repos = self._check_repo_type(repos, "disable_repo")
         results = []
-        for ovl in repos:
-            if not self.is_repo(ovl):
-                self.output.error(UnknownOverlayMessage(ovl))
-                results.append(False)
-                continue
-            success = False
-            try:
-                success = self._get_installed_db().disable(
-                    self._get_installed_db().select(ovl))
-            except Exception as e:
-                self._error('Exception caught disabling repository "%(repo)s"'\
-                            ':\n%(err)s' % {'repo': ovl, 'err': e})
-            results.append(success)
-            self.get_installed(dbreload=True)
+        db = self._get_installed_db()
+        with db.batch():
+            for ovl in repos:
+                if not self.is_repo(ovl):
+                    self.output.error(UnknownOverlayMessage(ovl))
+                    results.append(False)
+                    continue
+                success = False
+                try:
+                    success = db.disable(db.select(ovl))
+                except Exception as e:
+                    self._error('Exception caught disabling repository '
+                                '"%(repo)s":\n%(err)s'
+                                % {'repo': ovl, 'err': e})
+                results.append(success)
         if (True in results) and update_news:
             self.update_news(repos)
 
@@ -215,20 +227,21 @@ class LaymanAPI(object):
     def enable_repos(self, repos, update_news=False):
         repos = self._check_repo_type(repos, "enable_repo")
         results = []
-        for ovl in repos:
-            if not self.is_repo(ovl):
-                self.output.error(UnknownOverlayMessage(ovl))
-                results.append(False)
-                continue
-            success = False
-            try:
-                success = self._get_installed_db().enable(
-                    self._get_installed_db().select(ovl))
-            except Exception as e:
-                self._error('Exception caught enabling repository "%(repo)s"'\
-                            ':\n%(err)s' % {'repo': ovl, 'err': e})
-            results.append(success)
-            self.get_installed(dbreload=True)
+        db = self._get_installed_db()
+        with db.batch():
+            for ovl in repos:
+                if not self.is_repo(ovl):
+                    self.output.error(UnknownOverlayMessage(ovl))
+                    results.append(False)
+                    continue
+                success = False
+                try:
+                    success = db.enable(db.select(ovl))
+                except Exception as e:
+                    self._error('Exception caught enabling repository '
+                                '"%(repo)s":\n%(err)s'
+                                % {'repo': ovl, 'err': e})
+                results.append(success)
         if (True in results) and update_news:
             self.update_news(repos)
 
@@ -253,6 +266,8 @@ class LaymanAPI(object):
             db = self._get_installed_db()
         else:
             db = self._get_remote_db()
+        if not width and not verbose:
+            width = terminal_width() - 1
 
         for ovl in repos:
             if not self.is_repo(ovl):
@@ -289,11 +304,65 @@ class LaymanAPI(object):
         @rtype list of tuples [(str, bool, bool),...]
         @return: list  [(info string, official, supported),...]
         """
+        return list(self.iter_info_list(local, verbose, width))
 
+
+    def iter_info_list(self, local=True, verbose=False, width=0):
+        """like get_info_list(), but formats each repo only when the
+        caller gets to it, for printing long lists as they are rendered
+
+        @rtype generator of tuples (str, bool, bool)
+        """
+        if local:
+            return self._get_installed_db().iter_list(verbose=verbose,
+                                                      width=width)
+        return self._get_remote_db().iter_list(verbose=verbose, width=width)
+
+
+    def query(self, local=True, sort='name', reverse=False, info=False,
+              verbose=False, width=0, **criteria):
+        """finds the repos matching all criteria, see
+        layman.catalog.Catalog.select(), e.g.
+
+            query(local=False, type='git', official=True, supported=True)
+
+        @param local: bool (defaults to True)
+        @param sort: catalog field to sort by (defaults to 'name')
+        @param info: bool, return the info strings instead of the ids
+        @rtype list of strings or list of tuples [(str, bool, bool),...]
+        @return: ['repo-id', ...] or, as get_info_list(),
+            [(info string, supported, official),...]
+        """
         if local:
-            return self._get_installed_db().list(verbose=verbose, width=width)
+            db = self._get_installed_db()
         else:
-            return self._get_remote_db().list(verbose=verbose, width=width)
+            db = self._get_remote_db()
+        catalog = db.catalog()
+        rows = catalog.select(sort, reverse, **criteria)
+        if not info:
+            return [catalog.names[row] for row in rows]
+        # Only the returned rows get formatted
+        return db.list(verbose=verbose, width=width, rows=rows)
+
+
+    def search(self, text, info=False, verbose=False, width=0):
+        """finds the available repos whose name, descriptions, owners,
+        homepage or feeds contain words starting with every word of text
+
+        @type text: string
+        @param info: bool, return the info strings instead of the ids
+        @rtype list of strings or list of tuples [(str, bool, bool),...]
+        @return: ['repo-id', ...] best matches first or, as
+            get_info_list(), [(info string, supported, official),...]
+        """
+        db = self._get_remote_db()
+        found = db.search_index().search(text)
+        self.output.debug('LaymanAPI.search(); "%s": %d found'
+            % (text, len(found)), 5)
+        if not info:
+            return found
+        return db.list(verbose=verbose, width=width,
+                       rows=db.catalog().rows(found))
 
 
     def _verify_overlay_type(self, odb, ordb):
@@ -384,6 +453,14 @@ class LaymanAPI(object):
         success  = []
         repos = self._check_repo_type(repos, "sync")
         db = self._get_installed_db()
+        remote = self._get_remote_db()
+        # The overlays whose type or source may differ from the remote
+        # lists, found in one pass; the others need no per overlay checks.
+        drift = db.catalog().drift(remote.catalog())
+        self.output.debug("API.sync(); drift = %s" % str(drift), 5)
+        renamed = None
+        # overlays that passed the type/url checks, synced in one batch
+        to_sync = []
 
         self.output.debug("API.sync(); starting ovl loop", 5)
         for ovl in repos:
@@ -404,17 +481,23 @@ class LaymanAPI(object):
                     % {'repo': ovl}, 5)
                 continue
 
-            try:
-                self.output.debug("API.sync(); try: self._get_remote_db().select(ovl)", 5)
-                ordb = self._get_remote_db().select(ovl)
-            except UnknownOverlayException:
-                message = 'Overlay "%(repo)s" could not be found in the remote '\
-                        'lists.\nPlease check if it has been renamed and '\
-                        're-add if necessary.' % {'repo': ovl}
+            if odb.name not in remote:
+                if renamed is None:
+                    changes = remote.last_changes() or {}
+                    renamed = changes.get('changes', {}).get('renamed', {})
+                if odb.name in renamed:
+                    message = 'Overlay "%(repo)s" could not be found in the '\
+                            'remote lists.\nIt seems to have been renamed '\
+                            'to "%(new)s", please re-add it under that name.'\
+                            % {'repo': ovl, 'new': renamed[odb.name]}
+                else:
+                    message = 'Overlay "%(repo)s" could not be found in the '\
+                            'remote lists.\nPlease check if it has been '\
+                            'renamed and re-add if necessary.' % {'repo': ovl}
                 warnings.append((ovl, message))
-                (diff_type, update_url) = (False, False)
-            else:
-                self.output.debug("API.sync(); else: self._get_remote_db().select(ovl)", 5)
+            elif odb.name in drift:
+                self.output.debug("API.sync(); %s drifted, checking it" % ovl, 5)
+                ordb = remote.select(odb.name)
 
                 (diff_type, type_msg) = self._verify_overlay_type(odb, ordb)
                 (update_url, url_msg, available_srcs) = self._verify_overlay_source(odb, ordb)
@@ -442,11 +525,12 @@ class LaymanAPI(object):
                     self.output.warn('    Error was: %s' % str(error))
                     continue
 
-            try:
-                    self.output.debug("API.sync(); starting db.sync(ovl)", 5)
-                    db.sync(ovl)
-                    success.append((ovl,'Successfully synchronized overlay "' + ovl + '".'))
-            except Exception as error:
+            to_sync.append(ovl)
+
+        for ovl, error in self._sync_overlays(db, to_sync):
+            if error is None:
+                success.append((ovl,'Successfully synchronized overlay "' + ovl + '".'))
+            else:
                 fatals.append((ovl,
                     'Failed to sync overlay "%(repo)s".\nError was: %(err)s'
                     % {'repo': ovl, 'err': error}))
@@ -478,6 +562,32 @@ class LaymanAPI(object):
         return fatals == []
 
 
+    def _sync_overlays(self, db, repos):
+        """syncs the given installed repos, running up to "sync_jobs"
+        of them concurrently.  Only the VCS/archive operations run in
+        parallel, every change to the installed db or the repo configs
+        has already been made serially by the caller.
+
+        @param db: the installed layman.db.DB instance
+        @param repos: list of repo ids to sync
+        @rtype list of tuples [(repo-id, error or None),...] in the order
+        of repos
+        """
+        def sync_one(ovl):
+            self.output.debug("API.sync(); starting db.sync(%s)" % ovl, 5)
+            try:
+                db.sync(ovl)
+            except Exception as error:
+                return (ovl, error)
+            return (ovl, None)
+
+        jobs = min(get_jobs(self.config, 'sync_jobs'), len(repos))
+        if jobs > 1:
+            self.output.debug("API.sync(); syncing %d overlays using %d jobs"
+                % (len(repos), jobs), 5)
+        return list(pool_map(sync_one, repos, jobs))
+
+
     def fetch_remote_list(self):
         """
         Fetches the latest remote overlay list.
@@ -486,7 +596,10 @@ class LaymanAPI(object):
         """
 
         try:
-            dbreload, succeeded = self._get_remote_db().cache()
+            remote = self._get_remote_db()
+            # what the lists looked like before, for the change report
+            previous = remote.catalog()
+            dbreload, succeeded = remote.cache()
             self.output.debug(
                 'LaymanAPI.fetch_remote_list(); cache updated = %s'
                 % str(dbreload),8)
@@ -495,9 +608,32 @@ class LaymanAPI(object):
                               ' was:\n%(err)s' % {'err': error})
             return False
         self.get_available(dbreload)
+        if dbreload:
+            remote = self._get_remote_db()
+            changes = previous.diff(remote.catalog())
+            remote.save_changes(changes)
+            self.output.info('Remote lists updated: %d added, %d removed, '
+                '%d renamed, %d with new sources, %d with new types'
+                % tuple(len(changes[key]) for key in ('added', 'removed',
+                    'renamed', 'source_changed', 'type_changed')), 3)
+            remote.update_search_index()
         return succeeded
 
 
+    def get_remote_changes(self):
+        """returns what the last fetch of the remote lists changed
+
+        @rtype dict or None
+        @return: {'time': seconds since the epoch, 'changes':
+            {'added': ['repo-id', ...], 'removed': ['repo-id', ...],
+             'renamed': {'old-id': 'new-id', ...},
+             'source_changed': {'repo-id': [old sources, new sources]},
+             'type_changed': {'repo-id': [old types, new types]}}}
+            or None if no fetch changed the lists yet.
+        """
+        return self._get_remote_db().last_changes()
+
+
     def get_available(self, dbreload=False):
         """returns the list of available overlays"""
         self.output.debug('LaymanAPI.get_available() dbreload = %s'
@@ -518,8 +654,10 @@ class LaymanAPI(object):
         """returns the list of installed overlays"""
         if not self._installed_db or dbreload:
             self._installed_db = DB(self.config)
-        self.output.debug("API._get_installed_db; len(installed) = %s, %s"
-            %(len(self._installed_db.list_ids()), self._installed_db.list_ids()), 5)
+        if self.output.debug_lev >= 5:
+            installed = self._installed_db.list_ids()
+            self.output.debug("API._get_installed_db; len(installed) = %s, %s"
+                %(len(installed), installed), 5)
         return self._installed_db
 
 
@@ -565,21 +703,18 @@ class LaymanAPI(object):
     def supported_types(self):
         """returns a dictionary of all repository types,
         with boolean values"""
-        here = os.path.dirname(os.path.realpath(__file__))
-        modpath = os.path.join('overlays', 'modules')
-        modules = os.listdir(os.path.join(here, modpath))
+        # The overlay type modules are scanned once per process.
+        modules = Modules(path=MOD_PATH, namepath='layman.overlays.modules',
+                          output=self.output).module_names
 
         cmds = [x for x in self.config.keys() if '_command' in x]
         supported = {}
         for cmd in cmds:
             type_key = cmd.split('_')[0]
-            # The module dir might be named differently from the type_key.
-            # ex.) g-common and g-sorcery are named g_common and g_sorcery.
-            module = type_key.replace('-', '_')
 
             # Don't bother executing require_supported() if the user didn't
             # bring in support for the overlay type in the first place.
-            if module in modules:
+            if type_key in modules:
                 supported[type_key] = require_supported(
                     [(self.config[cmd],type_key, '')], self.output.warn)
             else:
@@ -44,7 +44,8 @@ _USAGE = """
   # it also supports multiple actions
   layman (-a|-d|-r|-s|-i) (OVERLAY|ALL) [ [(-a|-d|-r|-s|-i) (OVERLAY)] ...]
   layman -f [-o URL]
-  layman (-l|-L|-S)"""
+  layman (-l|-L|-S)
+  layman --search WORD [WORD ...]"""
 
 
 class ArgsParser(BareConfig):
@@ -150,6 +151,12 @@ class ArgsParser(BareConfig):
                              ' remote list to your locally installed overlays... Specify'
                              ' "ALL" to re-add all local overlays.')
 
+        actions.add_argument('--search',
+                             nargs = '+',
+                             help = 'List the overlays of the remote list whose'
+                             ' name, description, owner, homepage or feed contain'
+                             ' words starting with all the given words.')
+
         actions.add_argument('-s',
                              '--sync',
                              nargs = '+',
@@ -271,6 +278,14 @@ class ArgsParser(BareConfig):
                               'which protocols will be used when adding '
                               'overlays or updating their source URLs.')
 
+        etc_opts.add_argument('-j',
+                              '--sync-jobs',
+                              action = 'store',
+                              type = int,
+                              help = 'Sets the number of overlays that are '
+                              'synchronized at the same time [default: '
+                              + self.defaults['sync_jobs'] + '].')
+
         #-----------------------------------------------------------------
         # Debug Options
 
@@ -369,6 +384,14 @@ class ArgsParser(BareConfig):
                     protocol_filter = [e.strip() for e in protocol_filter.split(',')]
                 return protocol_filter
 
+        if key == 'sync_jobs':
+            if (key in self.options.keys()
+                and not self.options[key] is None):
+                return self.options[key]
+            if self.config.has_option('MAIN', 'sync_jobs'):
+                return self.config.get('MAIN', 'sync_jobs')
+            return self.defaults[key]
+
         if key == 'overlays':
             overlays = ''
             if (key in self.options.keys()
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#################################################################################
+# LAYMAN ASYNCIO UTILITIES
+#################################################################################
+# File:       asyncutils.py
+#
+#             Runs the external commands of the overlay types from an
+#             asyncio event loop (python 3.7+).
+#
+# Copyright:
+#             Distributed under the terms of the GNU General Public License v2
+#
+'''Asyncio counterparts of utils.run_command() and its callers.'''
+
+from __future__ import unicode_literals
+
+#===============================================================================
+#
+# Dependencies
+#
+#-------------------------------------------------------------------------------
+
+import asyncio
+import concurrent.futures
+import subprocess
+import threading
+
+from  layman.utils          import prepare_command, set_command_runner
+
+#===============================================================================
+#
+# Class CommandResult
+#
+#-------------------------------------------------------------------------------
+
+class CommandResult(object):
+    '''
+    The outcome of a command run by async_run_command().  stdout and stderr
+    hold bytes when captured, None otherwise.
+    '''
+
+    def __init__(self, args, returncode, stdout=None, stderr=None,
+                 timed_out=False):
+        self.args = args
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timed_out = timed_out
+
+
+    def __bool__(self):
+        return self.returncode == 0
+
+
+    def __repr__(self):
+        return 'CommandResult(%r, returncode=%r, timed_out=%r)' \
+            % (self.args, self.returncode, self.timed_out)
+
+
+#===============================================================================
+#
+# Helper functions
+#
+#-------------------------------------------------------------------------------
+
+async def _stop(proc):
+    '''Kills the child process if it still runs and reaps it.'''
+    if proc.returncode is None:
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+    await proc.wait()
+
+
+async def async_run_command(config, command, args, timeout=None,
+                            capture=False, **kwargs):
+    '''
+    Runs a command like utils.run_command() without blocking the event
+    loop.
+
+    @param timeout: seconds after which the command is killed, or None.
+    @param capture: collect stdout and stderr instead of passing them on.
+    @rtype CommandResult
+    The child is killed as well when the calling task is cancelled.
+    '''
+    output = config['output']
+    output.debug("Asyncutils.async_run_command(): " + command, 6)
+
+    args, cwd, env, command_repr = prepare_command(config, command, args,
+                                                   **kwargs)
+
+    cmd = kwargs.get('cmd', '')
+    output.info('Running %s... # %s' % (cmd, command_repr), 2)
+
+    if config['quiet']:
+        # Make child non-interactive
+        input_source = subprocess.DEVNULL
+        output_target = subprocess.DEVNULL
+    else:
+        # Re-use parent file descriptors
+        input_source = None
+        output_target = None
+    error_target = config['stderr']
+    if capture:
+        output_target = error_target = subprocess.PIPE
+
+    try:
+        proc = await asyncio.create_subprocess_exec(*args,
+            stdin=input_source,
+            stdout=output_target,
+            stderr=error_target,
+            cwd=cwd,
+            env=env)
+    except (OSError, ValueError) as err:
+        output.error(
+            'Unknown exception running command: %s' % command_repr)
+        output.error('Original error was: %s' % str(err))
+        return CommandResult(args, 1)
+
+    timed_out = False
+    stdout = stderr = None
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        output.error('Command timed out after %s seconds: %s'
+            % (timeout, command_repr))
+        timed_out = True
+        await _stop(proc)
+    except asyncio.CancelledError:
+        output.info('Cancelled %s' % cmd, 2)
+        await _stop(proc)
+        raise
+
+    result = CommandResult(args, proc.returncode, stdout, stderr, timed_out)
+    if result.returncode:
+        output.info('Failure result returned from %s' % cmd , 2)
+
+    return result
+
+
+async def run_with_commands(func, *args, timeout=None, **kwargs):
+    '''
+    Calls func in a worker thread with its run_command() calls sent to
+    async_run_command() on the running loop, each limited to timeout
+    seconds.  Cancelling the awaiting task kills the running command and
+    makes the following ones fail straight away.
+
+    @rtype the result of func
+    '''
+    loop = asyncio.get_running_loop()
+    cancelled = threading.Event()
+    current = []
+
+    def runner(config, command, cmd_args, **cmd_kwargs):
+        if cancelled.is_set():
+            return 1
+        future = asyncio.run_coroutine_threadsafe(
+            async_run_command(config, command, cmd_args, timeout=timeout,
+                              **cmd_kwargs), loop)
+        current[:] = [future]
+        if cancelled.is_set():
+            future.cancel()
+        try:
+            return future.result().returncode
+        except concurrent.futures.CancelledError:
+            return 1
+        finally:
+            current[:] = []
+
+    def call():
+        set_command_runner(runner)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            set_command_runner(None)
+
+    worker = loop.run_in_executor(None, call)
+    try:
+        return await asyncio.shield(worker)
+    except asyncio.CancelledError:
+        cancelled.set()
+        for future in list(current):
+            future.cancel()
+        raise
@@ -0,0 +1,291 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#################################################################################
+# LAYMAN OVERLAY CATALOG
+#################################################################################
+# File:       catalog.py
+#
+#             Column oriented view of an overlay database for fast
+#             filtering and sorting.
+#
+# Copyright:
+#             Distributed under the terms of the GNU General Public License v2
+#
+'''Column oriented view of an overlay database.'''
+
+from __future__ import unicode_literals
+
+#===============================================================================
+#
+# Dependencies
+#
+#-------------------------------------------------------------------------------
+
+from  layman.compatibility     import encode
+from  layman.overlays.overlay  import QUALITY_LEVELS
+
+#===============================================================================
+#
+# Class Catalog
+#
+#-------------------------------------------------------------------------------
+
+class Catalog(object):
+    '''
+    Keeps the searchable fields of a set of overlays as parallel lists,
+    one entry per overlay in name order:
+
+      names, types (tuple of source type keys), statuses, qualities,
+      priorities, sources (tuple of source URLs) and official.
+
+    The supported column is only filled in when first used.  Overlays
+    which have not been built yet (see dbbase.LazyOverlay) are read from
+    their raw definition when possible, so querying does not construct
+    them.
+
+    >>> catalog = Catalog({})
+    >>> catalog.select(type='git')
+    []
+    '''
+
+    FIELDS = ('name', 'type', 'status', 'quality', 'priority', 'source',
+              'official', 'supported')
+    _COLUMNS = {'name': 'names', 'type': 'types', 'status': 'statuses',
+                'quality': 'qualities', 'priority': 'priorities',
+                'source': 'sources', 'official': 'official',
+                'supported': 'supported'}
+
+    def __init__(self, overlays):
+        if hasattr(overlays, 'sorted_names'):
+            names = overlays.sorted_names()[:]
+        else:
+            names = sorted(overlays)
+        self.overlays = overlays
+        self.names = names
+        self.types = []
+        self.statuses = []
+        self.qualities = []
+        self.priorities = []
+        self.sources = []
+        for name in names:
+            ovl_type, status, quality, priority, sources = \
+                self._row(overlays[name])
+            self.types.append(ovl_type)
+            self.statuses.append(status)
+            self.qualities.append(quality)
+            self.priorities.append(priority)
+            self.sources.append(sources)
+        self.official = [status == 'official' for status in self.statuses]
+        self._rows = None
+        # {source type keys: supported}
+        self._supported_types = {}
+
+
+    def __len__(self):
+        return len(self.names)
+
+
+    @staticmethod
+    def _row(overlay):
+        '''
+        Returns (types, status, quality, priority, sources) of an overlay.
+        '''
+        definition = overlay.__dict__.get('_definition')
+        record = definition and definition.get('ovl_dict')
+        if record is not None:
+            # Same defaults as Overlay.from_dict()
+            quality = record.get('quality')
+            if quality not in QUALITY_LEVELS:
+                quality = 'experimental'
+            status = record.get('status')
+            if status is not None:
+                status = encode(status)
+            return (tuple(s[1] for s in record['source']), status,
+                    encode(quality), int(record.get('priority', 50)),
+                    tuple(encode(s[0]) for s in record['source']))
+        return (tuple(s.type_key for s in overlay.sources), overlay.status,
+                overlay.quality, overlay.priority,
+                tuple(overlay.source_uris()))
+
+
+    def _is_supported(self, row):
+        '''
+        Whether any source type of the overlay in row is supported.  Only
+        one overlay per combination of source types gets checked.
+        '''
+        types = self.types[row]
+        if types not in self._supported_types:
+            self._supported_types[types] = \
+                self.overlays[self.names[row]].is_supported()
+        return self._supported_types[types]
+
+
+    @property
+    def supported(self):
+        '''
+        Whether any source type of each overlay is supported.
+        '''
+        return [self._is_supported(i) for i in range(len(self.names))]
+
+
+    def _check_field(self, field):
+        if field not in self.FIELDS:
+            raise ValueError('Unknown catalog field "%s", expected one of: '
+                '%s' % (field, ', '.join(self.FIELDS)))
+
+
+    def column(self, field):
+        '''
+        Returns the list of values of field, one of FIELDS.
+        '''
+        self._check_field(field)
+        return getattr(self, self._COLUMNS[field])
+
+
+    @staticmethod
+    def _matcher(wanted):
+        if callable(wanted):
+            return wanted
+        if isinstance(wanted, (list, tuple, set, frozenset)):
+            wanted = set(wanted)
+            return lambda value: value in wanted
+        return lambda value: value == wanted
+
+
+    def select(self, sort='name', reverse=False, **criteria):
+        '''
+        Returns the row numbers of the overlays matching all criteria,
+        sorted by the sort field (the name breaks ties).
+
+        Criteria are given as field=wanted, where wanted is a value, a
+        list, tuple or set of accepted values, or a function returning
+        whether a value is accepted.  None skips the criterion.  The type
+        and source fields match if any of the sources of an overlay
+        matches.
+
+        @rtype list of ints
+        '''
+        rows = range(len(self.names))
+        # Cheap columns first, supported may have to build overlays.
+        for field in sorted(criteria, key=lambda f: f == 'supported'):
+            wanted = criteria[field]
+            if wanted is None:
+                continue
+            self._check_field(field)
+            match = self._matcher(wanted)
+            if field == 'supported':
+                rows = [i for i in rows if match(self._is_supported(i))]
+                continue
+            column = self.column(field)
+            if field in ('type', 'source'):
+                rows = [i for i in rows if any(match(v) for v in column[i])]
+            else:
+                rows = [i for i in rows if match(column[i])]
+
+        names = self.names
+        if sort == 'name':
+            return sorted(rows, key=lambda i: names[i].lower(),
+                          reverse=reverse)
+        column = self.column(sort)
+        # Overlays without a status sort first
+        return sorted(rows, key=lambda i: (column[i] is not None,
+            column[i] if column[i] is not None else 0, names[i].lower()),
+            reverse=reverse)
+
+
+    def rows(self, names):
+        '''
+        Returns the row numbers of names in the given order, skipping
+        unknown ones.
+        '''
+        rows = self._row_map()
+        return [rows[name] for name in names if name in rows]
+
+
+    def select_names(self, sort='name', reverse=False, **criteria):
+        '''
+        Like select() but returns the overlay names.
+        '''
+        return [self.names[i] for i in self.select(sort, reverse, **criteria)]
+
+
+    def _row_map(self):
+        if self._rows is None:
+            self._rows = dict((name, i) for i, name in enumerate(self.names))
+        return self._rows
+
+
+    def diff(self, new):
+        '''
+        Compares this catalog with the newer catalog new in one pass.
+        An overlay which disappeared while one with the same sources
+        appeared counts as renamed.
+
+        @rtype dict: {'added': [names], 'removed': [names],
+            'renamed': {old name: new name},
+            'source_changed': {name: [old sources, new sources]},
+            'type_changed': {name: [old types, new types]}}
+        '''
+        old_rows = self._row_map()
+        new_rows = new._row_map()
+        added = [name for name in new.names if name not in old_rows]
+        removed = []
+        source_changed = {}
+        type_changed = {}
+        for name in self.names:
+            row = new_rows.get(name)
+            if row is None:
+                removed.append(name)
+                continue
+            old_row = old_rows[name]
+            if self.sources[old_row] != new.sources[row]:
+                source_changed[name] = [list(self.sources[old_row]),
+                                        list(new.sources[row])]
+            if self.types[old_row] != new.types[row]:
+                type_changed[name] = [list(self.types[old_row]),
+                                      list(new.types[row])]
+
+        renamed = {}
+        if added and removed:
+            by_sources = {}
+            for name in added:
+                by_sources.setdefault(
+                    frozenset(new.sources[new_rows[name]]), []).append(name)
+            for name in removed:
+                candidates = by_sources.get(
+                    frozenset(self.sources[old_rows[name]]), [])
+                if len(candidates) == 1:
+                    renamed[name] = candidates.pop()
+            new_names = set(renamed.values())
+            added = [name for name in added if name not in new_names]
+            removed = [name for name in removed if name not in renamed]
+
+        return {'added': added, 'removed': removed, 'renamed': renamed,
+                'source_changed': source_changed,
+                'type_changed': type_changed}
+
+
+    def drift(self, remote):
+        '''
+        Finds the overlays of this (installed) catalog whose first source
+        type or first source URL is not reported by the remote catalog
+        any more, the checks LaymanAPI.sync() otherwise makes per overlay.
+
+        @rtype dict: {name: (type changed, source changed)}
+        '''
+        remote_rows = remote._row_map()
+        drift = {}
+        for row, name in enumerate(self.names):
+            remote_row = remote_rows.get(name)
+            if remote_row is None:
+                continue
+            types = self.types[row]
+            sources = self.sources[row]
+            remote_types = remote.types[remote_row]
+            type_changed = bool(types and remote_types and
+                                types[0] != remote_types[0])
+            source_changed = bool(sources and
+                                  sources[0] not in remote.sources[remote_row])
+            if type_changed or source_changed:
+                drift[name] = (type_changed, source_changed)
+        return drift
@@ -47,7 +47,9 @@ class ListPrinter(object):
             self.width = self.config['width']
         self.srclen = self.width - 43
         self._encoding_ = get_encoding(self.output)
-        if config['verbose']:
+        # looked up once instead of for every printed overlay
+        self.verbose = config['verbose']
+        if self.verbose:
             self.my_lister = self.short_list # self.long_list
         else:
             self.my_lister = self.short_list
@@ -63,8 +65,19 @@ class ListPrinter(object):
             self.print_overlay(summary, supported, official, complain)
 
     def print_shortlist(self, info, complain):
+        '''
+        Prints each (summary, supported, official) of info as soon as it
+        is produced, so a generator like LaymanAPI.iter_info_list()
+        streams long listings.
+
+        @rtype int: the number of overlays.
+        '''
+        count = 0
+        print_overlay = self.print_overlay
         for summary, supported, official in info:
-            self.print_overlay(summary, supported, official, complain)
+            print_overlay(summary, supported, official, complain)
+            count += 1
+        return count
 
 
     def print_fulldict(self, info, complain):
@@ -90,7 +103,7 @@ class ListPrinter(object):
             elif complain:
                 # Give a reason why this is marked yellow if it is a verbose
                 # listing
-                if self.config['verbose']:
+                if self.verbose:
                     self.output.warn(NOT_OFFICIAL_MSG, 1)
                 self.output.warn(summary, 1)
         # Unsupported overlays will only be listed if we are not checking
@@ -100,7 +113,7 @@ class ListPrinter(object):
             # listing
             prev_state = self.output.block_callback
             self.output.block_callback = True
-            if self.config['verbose']:
+            if self.verbose:
                 self.output.error(NOT_SUPPORTED_MSG)
             self.output.error(summary)
             self.output.block_callback = prev_state
@@ -142,6 +155,7 @@ class Main(object):
                         ('add',        'Add'),
                         ('sync',       'Sync'),
                         ('info',       'Info'),
+                        ('search',     'Search'),
                         ('sync_all',   'Sync'),
                         ('readd',      'Readd'),
                         ('delete',     'Delete'),
@@ -357,6 +371,24 @@ class Main(object):
         return info != {}
 
 
+    def Search(self):
+        ''' Lists the available overlays matching the search words.
+        '''
+        text = ' '.join(self.config['search'])
+        self.output.debug('Searching remote overlays for "%s".' % text, 6)
+        list_printer = ListPrinter(self.config)
+
+        info = self.api.search(text, info=True,
+            verbose=list_printer.verbose, width=list_printer.width)
+        if not info:
+            self.output.warn('No overlays found matching "%s".' % text)
+        list_printer.print_shortlist(info, complain=True)
+        # blank newline  -- no " *"
+        self.output.notice('')
+
+        return info != []
+
+
     def ListRemote(self):
         ''' Lists the available overlays.
         '''
@@ -364,14 +396,14 @@ class Main(object):
         self.output.debug('Printing remote overlays.', 6)
         list_printer = ListPrinter(self.config)
 
-        _complain = self.config['nocheck'] or self.config['verbose']
-        info = self.api.get_info_list(local=False,
-            verbose=self.config['verbose'], width=list_printer.width)
+        _complain = self.config['nocheck'] or list_printer.verbose
+        info = self.api.iter_info_list(local=False,
+            verbose=list_printer.verbose, width=list_printer.width)
         list_printer.print_shortlist(info, complain=_complain)
         # blank newline  -- no " *"
         self.output.notice('')
 
-        return info != {}
+        return True
 
 
     def ListLocal(self):
@@ -381,12 +413,11 @@ class Main(object):
         self.output.debug('Printing installed overlays.', 6)
         list_printer = ListPrinter(self.config)
 
-        info = self.api.get_info_list(verbose=self.config['verbose'],
-                                      width=list_printer.width)
-        #self.output.debug('CLI: ListLocal() info = %s' % len(info), 4)
-        #self.output.debug('\n'.join([ str(x) for x in info]), 4)
-        list_printer.print_shortlist(info, complain=True)
+        info = self.api.iter_info_list(verbose=list_printer.verbose,
+                                       width=list_printer.width)
+        count = list_printer.print_shortlist(info, complain=True)
+        self.output.debug('CLI: ListLocal() listed %d overlays' % count, 4)
 
         # blank newline  -- no " *"
         self.output.notice('')
-        return info != {}
+        return True
@@ -103,13 +103,17 @@ class BareConfig(object):
             'db_type': 'xml',
             'require_repoconfig': 'Yes',
             'clean_archive': 'yes',
+            'incremental_archive_sync': 'yes',
             'make_conf' : '%(storage)s/make.conf',
+            'mount_state': '%(storage)s/mount_state.json',
             'repos_conf': path([self.root, EPREFIX,'/etc/portage/repos.conf/layman.conf']),
             'conf_module': ['make_conf', 'repos_conf'],
             'nocheck'   : 'yes',
             'http_proxy'     : '',
             'https_proxy'     : '',
             'umask'     : '0022',
+            'sync_jobs' : '1',
+            'fetch_jobs': '4',
             'news_reporter': 'portage',
             'custom_news_pkg': '',
             'gpg_detached_lists':
@@ -130,7 +134,9 @@ class BareConfig(object):
             'rsync_command': path([self.root, EPREFIX,'/usr/bin/rsync']),
             'svn_command': path([self.root, EPREFIX,'/usr/bin/svn']),
             'tar_command': path([self.root, EPREFIX,'/bin/tar']),
-            't/f_options': ['check_official', 'clean_archive', 'nocheck', 'require_repoconfig'],
+            't/f_options': ['check_official', 'clean_archive',
+                'git_single_branch', 'incremental_archive_sync', 'nocheck',
+                'require_repoconfig'],
             'bzr_addopts' : '',
             'bzr_syncopts' : '',
             'cvs_addopts' : '',
@@ -139,6 +145,10 @@ class BareConfig(object):
             'darcs_syncopts' : '',
             'git_addopts' : '',
             'git_syncopts' : '',
+            'git_clone_depth' : '',
+            'git_clone_filter' : '',
+            'git_single_branch' : 'no',
+            'git_mirror_dir' : '',
             'mercurial_addopts' : '',
             'mercurial_syncopts' : '',
             'rsync_syncopts' : '',
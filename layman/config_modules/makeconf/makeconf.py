@@ -21,7 +21,7 @@ import os
 import codecs
 import re
 
-from layman.utils import path
+from layman.utils import atomic_open, path
 from layman.compatibility import cmp_to_key, fileopen
 
 #===============================================================================
@@ -87,6 +87,10 @@ class ConfigHandler:
         self.disabled = []
         self.extra = []
         self.output = config['output']
+        # While batching write() only keeps the new content in
+        # self.pending, flush() writes it out.
+        self.defer_write = False
+        self.pending = None
 
         self.read(True)
 
@@ -363,8 +367,34 @@ class ConfigHandler:
                 '%(path)s! Did not overwrite the file.' % ({'path': self.path}))
             return False
 
+        if self.defer_write:
+            self.pending = content
+            return True
+
+        return self._write_content(content)
+
+
+    def flush(self):
+        '''
+        Writes out the content deferred while batching.
+
+        @rtype bool: represents success or failure to write to make.conf.
+        '''
+        self.defer_write = False
+        if self.pending is None:
+            return True
+        content, self.pending = self.pending, None
+        return self._write_content(content)
+
+
+    def _write_content(self, content):
+        '''
+        Replaces the make.conf with content.
+
+        @rtype bool: represents success or failure to write to make.conf.
+        '''
         try:
-             with fileopen(self.path, 'w') as make_conf:
+             with atomic_open(self.path, 'w') as make_conf:
                 make_conf.write(content)
 
         except Exception as error:
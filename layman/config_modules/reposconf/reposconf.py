@@ -21,9 +21,11 @@ import sys
 if sys.hexversion >= 0x3000000:
     # Import for Python3
     import configparser as ConfigParser
+    from io import StringIO
 else:
     # Import for Python2
     import ConfigParser
+    from StringIO import StringIO
 
 try:
     from portage.sync.modules import laymansync
@@ -33,7 +35,7 @@ except ImportError:
     SYNC_TYPE = None
 
 from   layman.compatibility  import fileopen
-from   layman.utils          import path
+from   layman.utils          import atomic_open, path
 
 def check_conf_path(conf_path):
     dirname = os.path.dirname(conf_path)
@@ -53,6 +55,10 @@ def check_conf_path(conf_path):
 
 class ConfigHandler:
 
+    # RepoConfManager keeps one handler per DB instead of re-reading the
+    # file for every change, see refresh().
+    cacheable = True
+
     def __init__(self, config, overlays):
 
         self.config = config
@@ -62,6 +68,15 @@ class ConfigHandler:
         self.storage = config['storage']
         self.repo_config = None
         self.rebuild = False
+        # While batching write() only flags the pending changes and
+        # remembers the deleted overlays, flush() writes them out.
+        self.defer_write = False
+        self.pending = False
+        self.deleted = set()
+        # The file content last read or written and its stat() key,
+        # used to skip unchanged writes and to notice outside edits.
+        self.content = None
+        self.stat = None
 
         self.read()
 
@@ -73,11 +88,13 @@ class ConfigHandler:
         @param config: ConfigParser.ConfigParser instance.
         '''
         try:
-            read_files = config.read(self.path)
-
-            if not read_files:
-                self.output.warn("Warning, not able to parse config file: %(path)s"\
-                    % ({'path':self.path}))
+            with fileopen(self.path, 'r') as conf_file:
+                content = conf_file.read()
+            if hasattr(config, 'read_file'):
+                config.read_file(StringIO(content), self.path)
+            else:
+                config.readfp(StringIO(content), self.path)
+            self.content = content
         except IOError as error:
             self.output.error('ReposConf: ConfigHandler.read(); Failed to read "'\
                 '%(path)s".\nError was:\n%(error)s'\
@@ -90,6 +107,8 @@ class ConfigHandler:
         /etc/portage/repos.conf/layman.conf
         '''
         self.repo_conf = ConfigParser.ConfigParser()
+        self.content = None
+        self.stat = self._stat()
         if os.path.isfile(self.path):
             self._read_config(self.repo_conf)
         else:
@@ -105,6 +124,29 @@ class ConfigHandler:
                     raise
 
 
+    def _stat(self):
+        '''
+        Returns a key which changes whenever the config file gets replaced
+        or modified, None if it does not exist.
+        '''
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime)
+
+
+    def refresh(self):
+        '''
+        Re-reads the config file if somebody else changed it since it was
+        last read or written, unless there are deferred changes.
+        '''
+        if not self.pending and self._stat() != self.stat:
+            self.output.debug('ReposConf: ConfigHandler.refresh(); '
+                're-reading "%s"' % self.path, 6)
+            self.read()
+
+
     def add(self, overlay, no_write=False):
         '''
         Adds overlay information to the specified config file.
@@ -186,23 +228,54 @@ class ConfigHandler:
         @params delete: overlay name to be delete from the config.
         @return boolean: represents a successful write.
         '''
-        try:
-            with fileopen(self.path, 'w') as laymanconf:
-                # If the repos.conf is empty check to see if we can write
-                # all the overlays to the file.
-                if self.rebuild:
-                    # start over with a fresh instance
-                    self.repo_conf = ConfigParser.ConfigParser()
-                if not self.repo_conf.sections():
-                    if ('disable' in self.config.keys() and not
-                        self.config['disable'][0].lower() == 'all'):
-                        for i in sorted(self.overlays):
-                            if not i == delete:
-                                self.add(self.overlays[i], no_write=True)
-                self.repo_conf.write(laymanconf)
-                self.rebuild = False
+        if self.defer_write:
+            if delete:
+                self.deleted.add(delete)
+            self.pending = True
             return True
-        except IOError as error:
-            self.output.error('ReposConf: ConfigHandler.write(); Failed to write "'\
-                '%(path)s".\nError was:\n%(error)s'\
-                % ({'path': self.path, 'error': str(error)}))
+
+        # If the repos.conf is empty check to see if we can write
+        # all the overlays to the file.
+        if self.rebuild:
+            # start over with a fresh instance
+            self.repo_conf = ConfigParser.ConfigParser()
+        if not self.repo_conf.sections():
+            if ('disable' in self.config.keys() and not
+                self.config['disable'][0].lower() == 'all'):
+                for i in sorted(self.overlays):
+                    if not i == delete and not i in self.deleted:
+                        self.add(self.overlays[i], no_write=True)
+        rendered = StringIO()
+        self.repo_conf.write(rendered)
+        content = rendered.getvalue()
+
+        if content == self.content:
+            self.output.debug('ReposConf: ConfigHandler.write(); "%s" is '
+                'unchanged, not writing it' % self.path, 6)
+        else:
+            try:
+                with atomic_open(self.path, 'w') as laymanconf:
+                    laymanconf.write(content)
+            except IOError as error:
+                self.output.error('ReposConf: ConfigHandler.write(); Failed to write "'\
+                    '%(path)s".\nError was:\n%(error)s'\
+                    % ({'path': self.path, 'error': str(error)}))
+                return False
+            self.content = content
+            self.stat = self._stat()
+        self.rebuild = False
+        self.deleted = set()
+        return True
+
+
+    def flush(self):
+        '''
+        Writes out the changes deferred while batching.
+
+        @return boolean: represents a successful write.
+        '''
+        self.defer_write = False
+        if not self.pending:
+            return True
+        self.pending = False
+        return self.write()
@@ -29,6 +29,7 @@ __version__ = "$Id: db.py 309 2007-04-09 16:23:38Z wrobel $"
 
 import os, os.path
 
+from   contextlib               import contextmanager
 from   layman.utils             import path, delete_empty_directory, get_ans
 from   layman.dbbase            import DbBase
 from   layman.repoconfmanager   import RepoConfManager
@@ -46,6 +47,8 @@ class DB(DbBase):
 
         self.config = config
         self.output = config['output']
+        # pending writes while batching, see batch()
+        self._batch = None
 
         self.path = config['installed']
         self.output.debug("DB.__init__(): config['installed'] = %s" % self.path, 3)
@@ -79,6 +82,48 @@ class DB(DbBase):
         return ''
 
 
+    @contextmanager
+    def batch(self):
+        '''
+        Context manager deferring the installed db and repo config writes
+        of add(), delete(), enable(), disable() and update() to the end of
+        the block, where every file is written once.  Nested batches are
+        part of the outermost one.
+        '''
+        if self._batch is not None:
+            yield self
+            return
+
+        self._batch = {'write': False, 'remove': False}
+        self.repo_conf.begin_batch()
+        try:
+            yield self
+        finally:
+            pending, self._batch = self._batch, None
+            repo_ok = self.repo_conf.commit_batch()
+            if pending['write']:
+                DbBase.write(self, self.path)
+            elif pending['remove']:
+                DbBase.write(self, self.path, remove=True)
+            if False in repo_ok:
+                self.output.error('DB.batch(); Failed to write the repo '
+                    'config(s).')
+
+
+    def write(self, path, remove=False, migrate_type=None):
+        '''
+        Write the list of overlays to a file, unless batching.
+        '''
+        if (self._batch is not None and path == self.path and
+            migrate_type is None):
+            if remove:
+                self._batch['remove'] = True
+            else:
+                self._batch['write'] = True
+            return
+        DbBase.write(self, path, remove=remove, migrate_type=migrate_type)
+
+
     def _check_official(self, overlay):
         '''
         Prompt user to see if they want to install unofficial overlays.
@@ -200,6 +245,7 @@ class DB(DbBase):
                                                     available_srcs)
         result = [result]
         self.overlays[overlay.name].sources = source
+        self.overlays.touch()
         result.extend(self.repo_conf.update(self.overlays[overlay.name]))
         self.write(self.path)
 
@@ -30,6 +30,8 @@ import json
 import sys
 
 from   layman.compatibility      import fileopen
+from   layman.utils              import atomic_open
+from   layman.dbbase             import LazyOverlay
 from   layman.overlays.overlay   import Overlay
 
 
@@ -53,7 +55,7 @@ class DBHandler(object):
     '''
 
     def __init__(self, config, overlays, paths=None, ignore=0,
-                 ignore_init_read_errors=False):
+                 ignore_init_read_errors=False, lazy=False):
 
         self.config = config
         self.ignore = ignore
@@ -61,6 +63,7 @@ class DBHandler(object):
         self.paths = paths
         self.output = config['output']
         self.ignore_init_read_errors = ignore_init_read_errors
+        self.overlay_class = LazyOverlay if lazy else Overlay
 
         self.output.debug('Initializing JSON overlay list handler', 8)
 
@@ -103,7 +106,8 @@ class DBHandler(object):
         load = json.loads(document)['repo']
 
         for ovl in load:
-            overlay = Overlay(self.config, json=ovl, ignore=self.ignore)
+            overlay = self.overlay_class(self.config, json=ovl,
+                                         ignore=self.ignore)
             self.overlays[overlay.name] = overlay
 
         return True
@@ -124,7 +128,7 @@ class DBHandler(object):
         try:
             repo = {'@encoding': 'unicode', '@version': '1.0', 'repo': []}
             repo['repo'] = [self.overlays[key].to_json() for key in self.overlays]
-            with fileopen(path, 'w') as df:
+            with atomic_open(path, 'w') as df:
                 df.write(json.dumps(repo, sort_keys=True, indent=2))
         except Exception as err:
             msg = 'Failed to write to local overlays file: %(path)s\nError was'\
@@ -30,6 +30,7 @@ import os
 import sys
 import sqlite3
 
+from   layman.dbbase             import LazyOverlay
 from   layman.overlays.overlay   import Overlay
 
 #py3.2+
@@ -51,7 +52,7 @@ class DBHandler(object):
     '''
 
     def __init__(self, config, overlays, paths=None, ignore=0,
-                 ignore_init_read_errors=False):
+                 ignore_init_read_errors=False, lazy=False):
 
         self.config = config
         self.ignore = ignore
@@ -59,6 +60,7 @@ class DBHandler(object):
         self.paths = paths
         self.output = config['output']
         self.ignore_init_read_errors = ignore_init_read_errors
+        self.overlay_class = LazyOverlay if lazy else Overlay
 
         self.output.debug('Initializing SQLite overlay list handler', 8)
 
@@ -88,72 +90,159 @@ class DBHandler(object):
 
             raise Exception(msg)
 
-        self.__create_database__(path)
+        connection = sqlite3.connect(path)
+        try:
+            # Write-ahead logging lets readers carry on during a write and
+            # only needs the log synced at checkpoints.
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+        except sqlite3.DatabaseError as err:
+            msg = 'SQLite DBHandler; could not enable WAL mode: %(err)s'\
+                  % {'err': err}
+            self.output.debug(msg, 4)
+
+        try:
+            self.__create_database__(connection)
+        except Exception:
+            connection.close()
+            raise
 
-        return sqlite3.connect(path)
+        return connection
 
 
-    def __create_database__(self, path):
+    def __create_database__(self, connection):
         '''
         Create the LaymanOverlays database if it doesn't exist.
         '''
-        with sqlite3.connect(path) as connection:
-            cursor = connection.cursor()
-            try:
-                cursor.execute('''CREATE TABLE IF NOT EXISTS Overlay
-                ( Overlay_ID INTEGER PRIMARY KEY AUTOINCREMENT, Name TEXT, 
-                Priority TEXT, Status TEXT, Quality TEXT, Homepage 
-                TEXT, IRC TEXT, License TEXT, UNIQUE (Name) ON CONFLICT IGNORE )
-                ''')
-                cursor.execute('''CREATE TABLE IF NOT EXISTS Owner ( Owner_ID
-                INTEGER PRIMARY KEY AUTOINCREMENT, Owner_Name TEXT, 
-                Owner_Email TEXT, UNIQUE (Owner_Name, Owner_Email) ON 
-                CONFLICT IGNORE )''')
-                cursor.execute('''CREATE TABLE IF NOT EXISTS Source ( Source_ID
-                INTEGER PRIMARY KEY AUTOINCREMENT, Type TEXT, Branch TEXT, 
-                URL TEXT, UNIQUE (Type, URL) ON CONFLICT IGNORE )''')
-                cursor.execute('''CREATE TABLE IF NOT EXISTS Description 
-                ( Description_ID INTEGER PRIMARY KEY AUTOINCREMENT, 
-                Overlay_ID INTEGER, Description TEXT, FOREIGN 
-                KEY(Overlay_ID) REFERENCES Overlay(Overlay_ID), 
-                UNIQUE (Overlay_ID, Description) ON CONFLICT IGNORE )''')
-                cursor.execute('''CREATE TABLE IF NOT EXISTS Feed ( Feed_ID 
-                INTEGER PRIMARY KEY AUTOINCREMENT, Overlay_ID INTEGER, 
-                Feed TEXT, FOREIGN KEY(Overlay_ID) REFERENCES 
-                Overlay(Overlay_ID), UNIQUE (Overlay_ID, Feed) ON CONFLICT 
-                IGNORE )''')
-                cursor.execute('''CREATE TABLE IF NOT EXISTS Overlay_Source
-                ( Overlay_Source_ID INTEGER PRIMARY KEY AUTOINCREMENT, 
-                Overlay_ID INTEGER, Source_ID INTEGER, FOREIGN KEY(Overlay_ID) 
-                REFERENCES Overlay(Overlay_ID), FOREIGN KEY(Source_ID) 
-                REFERENCES Source(SourceID), UNIQUE (Overlay_ID, Source_ID) ON 
-                CONFLICT IGNORE )''')
-                cursor.execute('''CREATE TABLE IF NOT EXISTS Overlay_Owner
-                ( Overlay_Owner_ID INTEGER PRIMARY KEY AUTOINCREMENT, 
-                Overlay_ID INTEGER, Owner_ID INTEGER, FOREIGN KEY(Overlay_ID) 
-                REFERENCES Overlay(Overlay_ID), FOREIGN KEY(Owner_ID) 
-                REFERENCES Owner(Owner_ID), UNIQUE (Overlay_ID, Owner_ID) ON 
-                CONFLICT IGNORE )''')
-
-                connection.commit()
-            except sqlite3.DatabaseError as err:
-                raise err
-            except Exception as err:
-                msg = 'SQLite DBHandler error; failed to create database.\n'\
-                      'Error was: %(msg)s' % {'msg': err}
-                self.output.error(msg)
-
-                raise err
+        cursor = connection.cursor()
+        try:
+            cursor.execute('''CREATE TABLE IF NOT EXISTS Overlay
+            ( Overlay_ID INTEGER PRIMARY KEY AUTOINCREMENT, Name TEXT, 
+            Priority TEXT, Status TEXT, Quality TEXT, Homepage 
+            TEXT, IRC TEXT, License TEXT, UNIQUE (Name) ON CONFLICT IGNORE )
+            ''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS Owner ( Owner_ID
+            INTEGER PRIMARY KEY AUTOINCREMENT, Owner_Name TEXT, 
+            Owner_Email TEXT, UNIQUE (Owner_Name, Owner_Email) ON 
+            CONFLICT IGNORE )''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS Source ( Source_ID
+            INTEGER PRIMARY KEY AUTOINCREMENT, Type TEXT, Branch TEXT, 
+            URL TEXT, UNIQUE (Type, URL) ON CONFLICT IGNORE )''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS Description 
+            ( Description_ID INTEGER PRIMARY KEY AUTOINCREMENT, 
+            Overlay_ID INTEGER, Description TEXT, FOREIGN 
+            KEY(Overlay_ID) REFERENCES Overlay(Overlay_ID), 
+            UNIQUE (Overlay_ID, Description) ON CONFLICT IGNORE )''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS Feed ( Feed_ID 
+            INTEGER PRIMARY KEY AUTOINCREMENT, Overlay_ID INTEGER, 
+            Feed TEXT, FOREIGN KEY(Overlay_ID) REFERENCES 
+            Overlay(Overlay_ID), UNIQUE (Overlay_ID, Feed) ON CONFLICT 
+            IGNORE )''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS Overlay_Source
+            ( Overlay_Source_ID INTEGER PRIMARY KEY AUTOINCREMENT, 
+            Overlay_ID INTEGER, Source_ID INTEGER, FOREIGN KEY(Overlay_ID) 
+            REFERENCES Overlay(Overlay_ID), FOREIGN KEY(Source_ID) 
+            REFERENCES Source(SourceID), UNIQUE (Overlay_ID, Source_ID) ON 
+            CONFLICT IGNORE )''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS Overlay_Owner
+            ( Overlay_Owner_ID INTEGER PRIMARY KEY AUTOINCREMENT, 
+            Overlay_ID INTEGER, Owner_ID INTEGER, FOREIGN KEY(Overlay_ID) 
+            REFERENCES Overlay(Overlay_ID), FOREIGN KEY(Owner_ID) 
+            REFERENCES Owner(Owner_ID), UNIQUE (Overlay_ID, Owner_ID) ON 
+            CONFLICT IGNORE )''')
+            # The UNIQUE constraints above already index Name and every
+            # Overlay_ID column, these cover the reverse lookups used when
+            # collecting unused sources and owners.
+            cursor.execute('''CREATE INDEX IF NOT EXISTS Overlay_Source_Source
+            ON Overlay_Source (Source_ID)''')
+            cursor.execute('''CREATE INDEX IF NOT EXISTS Overlay_Owner_Owner
+            ON Overlay_Owner (Owner_ID)''')
+
+            connection.commit()
+        except sqlite3.DatabaseError as err:
+            raise err
+        except Exception as err:
+            msg = 'SQLite DBHandler error; failed to create database.\n'\
+                  'Error was: %(msg)s' % {'msg': err}
+            self.output.error(msg)
+
+            raise err
+
+
+    def _load_dicts(self, cursor):
+        '''
+        Reads every overlay with one query per table.
+
+        @rtype dict: overlay name -> (Overlay_ID, from_dict() dictionary)
+        '''
+        overlays = {}
+        by_id = {}
+
+        cursor.execute('''SELECT Overlay_ID, Name, Priority, Status,
+        Quality, Homepage, IRC, License FROM Overlay''')
+        for row in cursor.fetchall():
+            overlay = {'name': row[1], 'source': [], 'owner': [],
+                       'description': [], 'feed': []}
+            if row[2] != None:
+                overlay['priority'] = int(row[2])
+            for key, value in (('status', row[3]), ('quality', row[4]),
+                               ('homepage', row[5]), ('irc', row[6]),
+                               ('license', row[7])):
+                if value != None:
+                    overlay[key] = value
+            by_id[row[0]] = overlay
+            overlays[row[1]] = (row[0], overlay)
+
+        cursor.execute('''SELECT Overlay_ID, URL, Type, Branch FROM
+        Overlay_Source JOIN Source USING (Source_ID)
+        ORDER BY Overlay_Source_ID''')
+        for row in cursor.fetchall():
+            if row[0] in by_id:
+                by_id[row[0]]['source'].append((row[1], row[2], row[3]))
+
+        cursor.execute('''SELECT Overlay_ID, Owner_Email, Owner_Name FROM
+        Overlay_Owner JOIN Owner USING (Owner_ID)
+        ORDER BY Overlay_Owner_ID''')
+        for row in cursor.fetchall():
+            if row[0] in by_id:
+                owner = {}
+                if row[1] != None:
+                    owner['email'] = row[1]
+                if row[2] != None:
+                    owner['name'] = row[2]
+                by_id[row[0]]['owner'].append(owner)
+
+        cursor.execute('''SELECT Overlay_ID, Description FROM Description
+        ORDER BY Description_ID''')
+        for row in cursor.fetchall():
+            if row[0] in by_id:
+                by_id[row[0]]['description'].append(row[1])
+
+        cursor.execute('''SELECT Overlay_ID, Feed FROM Feed
+        ORDER BY Feed_ID''')
+        for row in cursor.fetchall():
+            if row[0] in by_id:
+                by_id[row[0]]['feed'].append(row[1])
+
+        return overlays
+
+
+    @staticmethod
+    def _overlay_dict(overlay):
+        '''
+        Returns the overlay as _load_dicts() would read it back.
+        '''
+        ovl_dict = overlay.to_dict()
+        ovl_dict['feed'] = ovl_dict.get('feed') or []
+        # The database has no place for the optional source attributes.
+        ovl_dict['source'] = [i[:3] for i in ovl_dict['source']]
+        return ovl_dict
 
 
     def read_db(self, path, text=None):
         '''
         Read the overlay definitions from the database and generate overlays.
         '''
-        cursor = None
-        overlay_id = None
-        overlay = {}
-
         try:
             connection = self.__connect__(path)
         except sqlite3.DatabaseError as err:
@@ -161,63 +250,15 @@ class DBHandler(object):
             self.output.error(msg)
             return False
 
-        cursor = connection.cursor()
-        cursor.execute('''SELECT Overlay_ID, Name, Priority, Status,
-        Quality, Homepage, IRC, License FROM Overlay''')
-        overlays_info = cursor.fetchall()
-        connection.commit()
-
-        for overlay_info in overlays_info:
-            overlay = {}
-            overlay_id = overlay_info[0]
-            overlay['name'] = overlay_info[1]
-
-            cursor.execute('''SELECT URL, Type, Branch FROM Overlay_Source
-            JOIN Overlay USING (Overlay_ID) JOIN Source USING (Source_ID)
-            WHERE Overlay_ID = ?''', (overlay_id,))
-            overlay['source'] = cursor.fetchall()
-
-            cursor.execute('''SELECT Owner_Email, Owner_Name FROM Overlay_Owner
-            JOIN Overlay USING (Overlay_ID) JOIN Owner USING (Owner_ID)
-            WHERE Overlay_ID = ?''', (overlay_id,))
-            owner_info = cursor.fetchall()
-            overlay['owner'] = []
-            for _owner in owner_info:
-                owner = {}
-                if _owner[0]:
-                    owner['email'] = _owner[0]
-                else:
-                    owner['email'] = None
-                if len(_owner) > 1:
-                    if _owner[1]:
-                        owner['name'] = _owner[1]
-                    else:
-                        owner['name'] = None
-                overlay['owner'].append(owner)
-
-            cursor.execute('''SELECT Description FROM Description
-            JOIN Overlay USING (Overlay_ID) WHERE Overlay_ID = ?''',
-            (overlay_id,))
-            overlay['description'] = cursor.fetchall()[0]
-
-            overlay['status'] = overlay_info[3]
-            overlay['quality'] = overlay_info[4]
-            overlay['priority'] = overlay_info[2]
-            overlay['license'] = overlay_info[7]
-            overlay['homepage'] = overlay_info[5]
-            overlay['IRC'] = overlay_info[6]
-
-            cursor.execute('''SELECT Feed FROM Feed JOIN Overlay USING
-            (Overlay_ID) WHERE Overlay_ID = ?''', (overlay_id,))
-            overlay['feed'] = cursor.fetchall()
-
-            if len(overlay['feed']):
-                overlay['feed'] = overlay['feed'][0]
-
-            self.overlays[overlay_info[1]] = Overlay(self.config,
+        try:
+            overlays = self._load_dicts(connection.cursor())
+        finally:
+            connection.close()
+
+        for name, (overlay_id, overlay) in overlays.items():
+            self.overlays[name] = self.overlay_class(self.config,
                                                      ovl_dict=overlay,
                                                      ignore=self.ignore)
-        connection.close()
         return True
 
 
@@ -239,130 +280,159 @@ class DBHandler(object):
 
     def add_ovl(self, overlay, connection):
         '''
-        Adds an overlay to the database.
+        Adds an overlay to the database, replacing a stored overlay of the
+        same name.
         '''
-        overlay_id = None
-        owner_id = None
-        source_id = None
-        cursor = None
-
-        cursor = connection.cursor()
-        cursor.execute('''INSERT INTO Overlay ( Name, Priority, Status, 
-        Quality, Homepage, IRC, License ) VALUES ( ?, ?, ?, ?, ?, ?, ? )''',
-        (overlay.name, overlay.priority, overlay.status, overlay.quality,
-        overlay.homepage, overlay.irc, overlay.license,))
-        connection.commit()
-
-        cursor.execute('''SELECT Overlay_ID FROM Overlay WHERE Name = ?''',
-        (overlay.name,))
-        overlay_id = cursor.fetchone()[0]
-
-        for owner in overlay.owners:
-            _name = owner['name']
-            _email = owner['email']
-
-            cursor.execute('''INSERT INTO Owner ( Owner_Name, Owner_Email ) 
-            VALUES ( ?, ? )''', (owner['name'], owner['email'],))
-            connection.commit()
-
-            if _name != None:
-                cursor.execute('''SELECT Owner_ID from Owner WHERE 
-                Owner_Email = ? AND Owner_Name = ?''', (_email, _name,))
-            else:
-                cursor.execute('''SELECT Owner_ID from Owner WHERE 
-                Owner_Email = ?''', (_email,))
-            owner_id = cursor.fetchone()[0]
+        with connection:
+            cursor = connection.cursor()
+            cursor.execute('''SELECT Overlay_ID FROM Overlay WHERE Name = ?''',
+            (overlay.name,))
+            row = cursor.fetchone()
+            self._store_ovl(cursor, self._overlay_dict(overlay),
+                            row and row[0])
 
-            cursor.execute('''INSERT INTO Overlay_Owner ( Overlay_ID, 
-            Owner_ID ) VALUES ( ?, ? )''', (overlay_id, owner_id,))
 
-        for source in overlay.sources:
+    def _store_ovl(self, cursor, overlay, overlay_id=None):
+        '''
+        Inserts an overlay dictionary, or replaces the overlay stored under
+        overlay_id.  Does not commit.
+        '''
+        values = (overlay['name'], overlay.get('priority'),
+                  overlay.get('status'), overlay.get('quality'),
+                  overlay.get('homepage'), overlay.get('irc'),
+                  overlay.get('license'))
+
+        if overlay_id is None:
+            cursor.execute('''INSERT INTO Overlay ( Name, Priority, Status,
+            Quality, Homepage, IRC, License ) VALUES ( ?, ?, ?, ?, ?, ?, ?
+            )''', values)
+            overlay_id = cursor.lastrowid
+        else:
+            cursor.execute('''UPDATE Overlay SET Name = ?, Priority = ?,
+            Status = ?, Quality = ?, Homepage = ?, IRC = ?, License = ?
+            WHERE Overlay_ID = ?''', values + (overlay_id,))
+            self._delete_children(cursor, overlay_id)
+
+        for owner in overlay['owner']:
+            _name = owner.get('name')
+            _email = owner.get('email')
+
+            cursor.execute('''INSERT INTO Owner ( Owner_Name, Owner_Email )
+            VALUES ( ?, ? )''', (_name, _email,))
+            cursor.execute('''SELECT Owner_ID FROM Owner WHERE
+            Owner_Name IS ? AND Owner_Email IS ?''', (_name, _email,))
+            cursor.execute('''INSERT INTO Overlay_Owner ( Overlay_ID,
+            Owner_ID ) VALUES ( ?, ? )''', (overlay_id, cursor.fetchone()[0],))
+
+        for _src, _type, _branch in overlay['source']:
             cursor.execute('''INSERT INTO Source ( Type, Branch, URL )
-            VALUES ( ?, ?, ? )''', (source.type_key, source.branch,
-            source.src,))
-            connection.commit()
+            VALUES ( ?, ?, ? )''', (_type, _branch, _src,))
+            cursor.execute('''SELECT Source_ID, Branch FROM Source WHERE
+            Type = ? AND URL = ?''', (_type, _src,))
+            source_id, branch = cursor.fetchone()
+            if branch != _branch:
+                cursor.execute('''UPDATE Source SET Branch = ? WHERE
+                Source_ID = ?''', (_branch, source_id,))
+
+            cursor.execute('''INSERT INTO Overlay_Source ( Overlay_ID,
+            Source_ID ) VALUES ( ?, ? )''', (overlay_id, source_id, ))
 
-            cursor.execute('''SELECT Source_ID FROM Source WHERE URL = ?;''',
-            (source.src,))
-            source_id = cursor.fetchone()[0]
+        cursor.executemany('''INSERT INTO Description ( Overlay_ID,
+        Description ) VALUES ( ?, ? )''',
+        [(overlay_id, d) for d in overlay['description']])
+
+        cursor.executemany('''INSERT INTO Feed ( Overlay_ID, Feed ) VALUES
+        ( ?, ? )''', [(overlay_id, f) for f in overlay['feed']])
 
-            cursor.execute('''INSERT INTO Overlay_Source ( Overlay_ID, 
-            Source_ID ) VALUES ( ?, ? )''', (overlay_id, source_id, ))
 
-        for description in overlay.descriptions:
-            cursor.execute('''INSERT INTO Description ( Overlay_ID, 
-            Description ) VALUES ( ?, ? )''', (overlay_id, description,))
+    @staticmethod
+    def _delete_children(cursor, overlay_id):
+        '''
+        Deletes the rows hanging off an overlay, but not the overlay itself.
+        '''
+        for table in ('Feed', 'Description', 'Overlay_Source',
+                      'Overlay_Owner'):
+            cursor.execute('DELETE FROM %s WHERE Overlay_ID = ?' % table,
+                           (overlay_id,))
 
-        for feed in overlay.feeds:
-            cursor.execute('''INSERT INTO Feed ( Overlay_ID, Feed ) VALUES ( ?,
-             ? )''', (overlay_id, feed,))
 
-        connection.commit()
+    @staticmethod
+    def _delete_unused(cursor):
+        '''
+        Deletes the sources and owners no overlay refers to any more.
+        '''
+        cursor.execute('''DELETE FROM Source WHERE Source_ID NOT IN
+        ( SELECT Source_ID FROM Overlay_Source )''')
+        cursor.execute('''DELETE FROM Owner WHERE Owner_ID NOT IN
+        ( SELECT Owner_ID FROM Overlay_Owner )''')
 
 
     def remove(self, overlay, path):
         '''
         Remove an overlay from the database.
         '''
-        cursor = None
-        overlay_id = 0
-        owner_ids = []
-        source_ids = []
-
         if overlay.name in self.overlays:
             del self.overlays[overlay.name]
 
-        with self.__connect__(path) as connection:
-            cursor = connection.cursor()
-            
-            cursor.execute('''SELECT Overlay_ID FROM Overlay WHERE Name = 
-            ?''', (overlay.name,))
-            overlay_id = cursor.fetchone()[0]
-
-            cursor.execute('''SELECT Owner_ID FROM Overlay_Owner WHERE 
-            Overlay_ID = ?''', (overlay_id,))
-            owner_ids = cursor.fetchall()[0]
-
-            cursor.execute('''SELECT Source_ID FROM Overlay_Source WHERE 
-            Overlay_ID = ?''', (overlay_id,))
-            source_ids = cursor.fetchall()[0]
-
-            cursor.execute('''DELETE FROM Feed WHERE Overlay_ID = ?''',
-            (overlay_id,))
-            cursor.execute('''DELETE FROM Description WHERE Overlay_ID = ?''',
-            (overlay_id,))
-            cursor.execute('''DELETE FROM Overlay_Source WHERE Overlay_ID = 
-            ?''', (overlay_id,))
-            cursor.execute('''DELETE FROM Overlay_Owner WHERE Overlay_ID = 
-            ?''', (overlay_id,))
-
-            for source_id in source_ids:
-               cursor.execute('''DELETE FROM Source WHERE Source_ID = ?''', 
-               (source_id,))
-
-            for owner_id in owner_ids:
-                cursor.execute('''DELETE FROM Owner WHERE Owner_ID = ?''',
-                (owner_id,))
-
-            cursor.execute('''DELETE FROM Overlay WHERE Overlay_ID = ?''',
-            (overlay_id,))
-
-            connection.commit()
+        connection = self.__connect__(path)
+        try:
+            with connection:
+                cursor = connection.cursor()
+                cursor.execute('''SELECT Overlay_ID FROM Overlay WHERE Name =
+                ?''', (overlay.name,))
+                row = cursor.fetchone()
+                if row:
+                    self._delete_children(cursor, row[0])
+                    cursor.execute('''DELETE FROM Overlay WHERE Overlay_ID =
+                    ?''', (row[0],))
+                    # Sources and owners may be shared with other overlays.
+                    self._delete_unused(cursor)
+        finally:
+            connection.close()
 
 
     def write(self, path, remove=False):
         '''
         Write the list of overlays to the database.
-        '''
-        if remove:
-            return
 
+        Only overlays which differ from the stored ones are rewritten and
+        stored overlays missing from the list are deleted, all in a single
+        transaction.
+        '''
         try:
-            with self.__connect__(path) as connection:
-                for overlay in self.overlays:
-                    self.add_ovl(self.overlays[overlay], connection)
+            connection = self.__connect__(path)
+            try:
+                with connection:
+                    cursor = connection.cursor()
+                    stored = self._load_dicts(cursor)
+                    changed = 0
+
+                    for name in set(stored) - set(self.overlays):
+                        self._delete_children(cursor, stored[name][0])
+                        cursor.execute('''DELETE FROM Overlay WHERE
+                        Overlay_ID = ?''', (stored[name][0],))
+                        changed += 1
+
+                    for name, overlay in self.overlays.items():
+                        ovl_dict = self._overlay_dict(overlay)
+                        overlay_id = None
+                        if name in stored:
+                            overlay_id, old = stored[name]
+                            if old == ovl_dict:
+                                continue
+                        self._store_ovl(cursor, ovl_dict, overlay_id)
+                        changed += 1
+
+                    if changed:
+                        self._delete_unused(cursor)
+            finally:
+                connection.close()
         except Exception as err:
             msg = 'Failed to write to overlays database: %(path)s\nError was'\
                   ': %(err)s' % {'path': path, 'err': err}
             self.output.error(msg)
             raise err
+
+        msg = 'SQLite DBHandler.write(); %(num)d overlay(s) changed in '\
+              '%(path)s' % {'num': changed, 'path': path}
+        self.output.debug(msg, 5)
@@ -30,8 +30,8 @@ import sys
 import xml
 import xml.etree.ElementTree as ET # Python 2.5
 
-from   layman.utils              import indent
-from   layman.compatibility      import fileopen
+from   layman.utils              import atomic_open, indent
+from   layman.dbbase             import LazyOverlay
 from   layman.overlays.overlay   import Overlay
 
 
@@ -74,7 +74,7 @@ class DBHandler(object):
     '''
 
     def __init__(self, config, overlays, paths=None, ignore=0,
-                 ignore_init_read_errors=False):
+                 ignore_init_read_errors=False, lazy=False):
 
         self.config = config
         self.ignore = ignore
@@ -82,6 +82,7 @@ class DBHandler(object):
         self.paths = paths
         self.output = config['output']
         self.ignore_init_read_errors = ignore_init_read_errors
+        self.overlay_class = LazyOverlay if lazy else Overlay
 
         self.output.debug('Initializing XML overlay list handler', 8)
 
@@ -100,23 +101,75 @@ class DBHandler(object):
         '''
         Read the overlay definition file.
         '''
-        document = text
-
-        if not document:
-            try:
-                with fileopen(path, 'r') as df:
-                    document = df.read()
-            except Exception as error:
-                if not self.ignore_init_read_errors:
-                    msg = 'XML DBHandler - Failed to read the overlay list at '\
-                      '"%(path)s"' % {'path': path}
+        if text:
+            return self.read(text, origin=path)
+
+        try:
+            df = open(path, 'rb')
+        except Exception as error:
+            msg = 'XML DBHandler - Failed to read the overlay list at '\
+                  '"%(path)s"' % {'path': path}
+            if not self.ignore_init_read_errors:
                 self.output.error(msg)
-                return False
+            return False
 
-        success = self.read(document, origin=path)
+        with df:
+            success = self.read_file(df, origin=path)
         return success
 
 
+    def read_file(self, source, origin):
+        '''
+        Incrementally read an xml list of overlays from a file object
+        (adding to and potentially overwriting existing entries).
+
+        Every overlay is built as soon as its element has been parsed and
+        the element is dropped from the tree afterwards, so the whole
+        document is never held in memory.  The overlays are only added
+        once the whole document parsed.
+        '''
+        overlays = {}
+        root = None
+        depth = 0
+        try:
+            for event, elem in ET.iterparse(source, events=('start', 'end')):
+                if event == 'start':
+                    if root is None:
+                        root = elem
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth != 1:
+                    continue
+                if elem.tag in ('overlay', 'repo'):
+                    self._add_overlay(elem, overlays)
+                    if self.overlay_class is Overlay:
+                        elem.clear()
+                # LazyOverlay still holds on to its own element
+                root.clear()
+        except ET.ParseError as error:
+            msg = 'XML DBHandler - ET.ParseError: %(err)s' % {'err': error}
+            self.output.error(msg)
+            return False
+
+        self.overlays.update(overlays)
+        return True
+
+
+    def _add_overlay(self, overlay, overlays=None):
+        '''
+        Builds the overlay defined by an <overlay>/<repo> element and adds it
+        to overlays, by default to the db.
+        '''
+        if overlays is None:
+            overlays = self.overlays
+        msg = 'XML DBHandler - Parsing overlay: %(ovl)s' % {'ovl': overlay}
+        self.output.debug(msg, 9)
+        ovl = self.overlay_class(config=self.config, xml=overlay,
+                                 ignore=self.ignore)
+        overlays[ovl.name] = ovl
+
+
     def read(self, text, origin):
         '''
         Read an xml list of overlays (adding to and potentially overwriting
@@ -132,10 +185,7 @@ class DBHandler(object):
         overlays = document.findall('overlay') + document.findall('repo')
 
         for overlay in overlays:
-            msg = 'XML DBHandler - Parsing overlay: %(ovl)s' % {'ovl': overlay}
-            self.output.debug(msg, 9)
-            ovl = Overlay(config=self.config, xml=overlay, ignore=self.ignore)
-            self.overlays[ovl.name] = ovl
+            self._add_overlay(overlay)
 
         return True
 
@@ -171,7 +221,7 @@ class DBHandler(object):
         indent(tree)
         tree = ET.ElementTree(tree)
         try:
-            with fileopen(path, 'w') as f:
+            with atomic_open(path, 'w') as f:
                 tree.write(f, encoding=_UNICODE)
 
         except Exception as err:
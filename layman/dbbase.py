@@ -32,10 +32,16 @@ __version__ = "$Id: dbbase.py 273 2015-07-09 11:35:55Z twitch153 $"
 #
 #-------------------------------------------------------------------------------
 
+import hashlib
+import json
 import os
 import os.path
 import sys
+import tempfile
 
+from   layman.catalog            import Catalog
+from   layman.compatibility      import encode
+from   layman.utils              import terminal_width
 from   layman.module             import Modules, InvalidModuleName
 from   layman.overlays.overlay   import Overlay
 
@@ -51,6 +57,9 @@ else:
 
 MOD_PATH = os.path.join(os.path.dirname(__file__), 'db_modules')
 
+# Bump whenever the layout of the snapshot or of Overlay.to_dict() changes
+SNAPSHOT_VERSION = 3
+
 #===============================================================================
 #
 # Class UnknownOverlayException
@@ -67,6 +76,158 @@ class UnknownOverlayException(Exception):
         return UnknownOverlayMessage(self.repo_name)
 
 
+#===============================================================================
+#
+# Class OverlayDict
+#
+#-------------------------------------------------------------------------------
+
+class OverlayDict(dict):
+    '''
+    Dictionary of overlays by name which counts its modifications in
+    "revision" and keeps the sorted list of names until the next one.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.revision = 0
+        self._sorted_names = None
+
+
+    def _changed(self):
+        self.revision += 1
+        self._sorted_names = None
+
+
+    def touch(self):
+        '''
+        Counts a change made to one of the overlays in place, e.g. to its
+        sources or priority.
+        '''
+        self._changed()
+
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._changed()
+
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._changed()
+
+
+    def clear(self):
+        dict.clear(self)
+        self._changed()
+
+
+    def pop(self, *args):
+        value = dict.pop(self, *args)
+        self._changed()
+        return value
+
+
+    def popitem(self):
+        item = dict.popitem(self)
+        self._changed()
+        return item
+
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self._changed()
+
+
+    def sorted_names(self):
+        '''
+        Returns the sorted overlay names, shared until the next change so
+        it must not be modified.
+        '''
+        if self._sorted_names is None:
+            self._sorted_names = sorted(self)
+        return self._sorted_names
+
+
+#===============================================================================
+#
+# Class LazyOverlay
+#
+#-------------------------------------------------------------------------------
+
+class LazyOverlay(object):
+    '''
+    Stand-in for an Overlay which only knows the overlay name and keeps
+    the raw definition around. The real Overlay is built on the first
+    access to any other attribute, everything is then delegated to it.
+    Takes the same arguments as Overlay.
+    '''
+
+    def __init__(self, config, json=None, ovl_dict=None, xml=None, ignore=0):
+        name = None
+        if xml is not None:
+            _name = xml.find('name')
+            if _name != None:
+                name = (_name.text or '').strip()
+            elif 'name' in xml.attrib:
+                name = xml.attrib['name']
+        elif ovl_dict is not None:
+            name = ovl_dict.get('name')
+        elif json is not None:
+            name = json.get('name')
+
+        self.__dict__['_definition'] = {'config': config, 'json': json,
+                                        'ovl_dict': ovl_dict, 'xml': xml,
+                                        'ignore': ignore}
+        self.__dict__['_overlay'] = None
+        if name is None:
+            # Let Overlay raise the proper error right away
+            self._materialize()
+        else:
+            self.__dict__['name'] = encode(name)
+
+
+    def _materialize(self):
+        '''
+        Returns the real Overlay, building it if needed.
+        '''
+        overlay = self.__dict__['_overlay']
+        if overlay is None:
+            overlay = Overlay(**self.__dict__['_definition'])
+            self.__dict__['_overlay'] = overlay
+            self.__dict__['_definition'] = None
+            self.__dict__['name'] = overlay.name
+        return overlay
+
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        return getattr(self._materialize(), attr)
+
+
+    def __setattr__(self, attr, value):
+        setattr(self._materialize(), attr, value)
+        if attr == 'name':
+            self.__dict__['name'] = value
+
+
+    def __eq__(self, other):
+        if isinstance(other, LazyOverlay):
+            other = other._materialize()
+        return self._materialize() == other
+
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
 #===============================================================================
 #
 # Class DbBase
@@ -79,17 +240,22 @@ class DbBase(object):
     '''
 
     def __init__(self, config, paths=None, ignore=0,
-           ignore_init_read_errors=False, allow_missing=False):
+           ignore_init_read_errors=False, allow_missing=False, lazy=False):
 
         self.config = config
         self.db_type = config['db_type']
         self.ignore = ignore
         self.ignore_init_read_errors = ignore_init_read_errors
+        # build Overlay objects only when they are actually used
+        self.lazy = lazy
+        self.overlay_class = LazyOverlay if lazy else Overlay
         self.mod_ctl = Modules(path=MOD_PATH,
                                namepath='layman.db_modules',
                                output=config['output'])
         self.output = config['output']
-        self.overlays = {}
+        self.overlays = OverlayDict()
+        # (overlays revision, Catalog), see catalog()
+        self._catalog = None
         self.paths = paths
 
         path_found = False
@@ -141,6 +307,10 @@ class DbBase(object):
         return not self.__eq__(other)
 
 
+    def __contains__(self, overlay):
+        return overlay in self.overlays
+
+
     def _add_from_dict(self, overlays=None):
         '''
         Add a new overlay from a list of dictionary values
@@ -149,8 +319,8 @@ class DbBase(object):
 
         for overlay in overlays:
             self.output.debug('Parsing overlay entry', 8)
-            ovl = Overlay(self.config, ovl_dict=overlay,
-                          ignore=self.ignore)
+            ovl = self.overlay_class(self.config, ovl_dict=overlay,
+                                     ignore=self.ignore)
             self.overlays[ovl.name] = ovl
 
         return
@@ -165,16 +335,22 @@ class DbBase(object):
         raise NotImplementedError(msg)
 
 
-    def _get_dbctl(self, db_type):
+    def _get_dbctl(self, db_type, overlays=None):
         '''
         Returns database module controller for class or dies trying.
+
+        @param overlays: optional dict the controller reads into and
+        writes from instead of self.overlays.
         '''
+        if overlays is None:
+            overlays = self.overlays
         try:
             db_ctl = self.mod_ctl.get_class(db_type)(self.config,
-                        self.overlays,
+                        overlays,
                         self.paths,
                         self.ignore,
-                        self.ignore_init_read_errors)
+                        self.ignore_init_read_errors,
+                        lazy=self.lazy)
         except InvalidModuleName:
             msg = 'DbBase._get_dbctl() error:\nDatabase module name '\
                   '"%(name)s" is invalid or not found.\nPlease set db_type '\
@@ -217,11 +393,131 @@ class DbBase(object):
         #Added to keep xml functionality for cached overlay XML definitions
         if 'cache' in path and '.xml' in path:
             db_type = 'xml_db'
+            if text is None:
+                return self._read_cached_db(path)
 
         db_ctl = self._get_dbctl(db_type)
         return db_ctl.read_db(path, text=text)
 
 
+    @staticmethod
+    def _snapshot_path(path):
+        '''
+        Returns the path of the pre-parsed snapshot of a cached overlay list.
+        '''
+        return os.path.splitext(path)[0] + '.snapshot.json'
+
+
+    @staticmethod
+    def _file_hash(path):
+        '''
+        Returns the md5 hex digest of the file contents.
+        '''
+        md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                md5.update(chunk)
+        return md5.hexdigest()
+
+
+    def _read_cached_db(self, path):
+        '''
+        Reads a cached remote overlay list, using its snapshot when the list
+        has not changed since the snapshot was taken.  Otherwise the XML is
+        parsed and the snapshot regenerated.
+        '''
+        records = self._read_snapshot(path)
+        if records is not None:
+            overlays = {}
+            try:
+                for record in records:
+                    ovl = self.overlay_class(self.config, ovl_dict=record,
+                                             ignore=self.ignore)
+                    overlays[ovl.name] = ovl
+            except Exception as error:
+                msg = 'DbBase._read_cached_db(); ignoring snapshot of '\
+                      '"%(path)s": %(err)s' % {'path': path, 'err': error}
+                self.output.debug(msg, 4)
+            else:
+                self.overlays.update(overlays)
+                return True
+
+        overlays = {}
+        db_ctl = self._get_dbctl('xml_db', overlays)
+        success = db_ctl.read_db(path)
+        if success:
+            self.overlays.update(overlays)
+            self._write_snapshot(path,
+                                 [ovl.to_dict() for ovl in overlays.values()])
+        return success
+
+
+    def _read_snapshot(self, path):
+        '''
+        Loads the snapshot of the overlay list at path.
+
+        @rtype list of overlay dicts or None if there is no valid snapshot.
+        '''
+        snapshot_path = self._snapshot_path(path)
+        if not os.path.exists(snapshot_path):
+            return None
+        try:
+            with open(snapshot_path, 'rb') as f:
+                snapshot = json.loads(f.read().decode('UTF-8'))
+            stat = os.stat(path)
+            if (snapshot['version'] != SNAPSHOT_VERSION or
+                snapshot['size'] != stat.st_size):
+                return None
+            if snapshot['mtime'] != stat.st_mtime:
+                # Touched but possibly unchanged, compare the contents
+                if snapshot['md5'] != self._file_hash(path):
+                    return None
+                self._write_snapshot(path, snapshot['overlays'])
+        except Exception as error:
+            msg = 'DbBase._read_snapshot(); ignoring snapshot "%(path)s": '\
+                  '%(err)s' % {'path': snapshot_path, 'err': error}
+            self.output.debug(msg, 4)
+            return None
+
+        msg = 'DbBase._read_snapshot(); using snapshot "%(path)s"'\
+              % {'path': snapshot_path}
+        self.output.debug(msg, 6)
+        return snapshot['overlays']
+
+
+    def _write_snapshot(self, path, records):
+        '''
+        Atomically (re)writes the snapshot of the overlay list at path.
+        Failures are not fatal, the list will simply be parsed again.
+        '''
+        snapshot_path = self._snapshot_path(path)
+        tmp_path = None
+        try:
+            stat = os.stat(path)
+            snapshot = {'version': SNAPSHOT_VERSION,
+                        'mtime': stat.st_mtime,
+                        'size': stat.st_size,
+                        'md5': self._file_hash(path),
+                        'overlays': records,
+                       }
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(snapshot_path) or '.',
+                prefix='.snapshot_')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(json.dumps(snapshot).encode('UTF-8'))
+            os.rename(tmp_path, snapshot_path)
+            # Pickled snapshots of older versions are not loaded any more
+            legacy_path = os.path.splitext(path)[0] + '.pickle'
+            if os.path.exists(legacy_path):
+                os.unlink(legacy_path)
+        except Exception as error:
+            msg = 'DbBase._write_snapshot(); failed to write "%(path)s": '\
+                  '%(err)s' % {'path': snapshot_path, 'err': error}
+            self.output.debug(msg, 4)
+            if tmp_path and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+
     def write(self, path, remove=False, migrate_type=None):
         '''
         Write the list of overlays to a file.
@@ -251,42 +547,66 @@ class DbBase(object):
         msg = 'DbBase.select(), overlay = %(ovl)s' % ovl
         self.output.debug(msg, 5)
 
-        if not overlay in self.overlays.keys():
+        if not overlay in self.overlays:
             msg = 'DbBase.select(), unknown overlay = %(ovl)s' % ovl
             self.output.debug(msg, 4)
-            ovls = {'ovls': ', '.join(self.overlays.keys())}
-            msg = 'DbBase.select(), known overlays = %(ovls)s' % ovls
-            self.output.debug(ovls, 4)
+            # only build the list of all names when it will be shown
+            if self.output.debug_lev >= 4:
+                ovls = {'ovls': ', '.join(self.list_ids())}
+                msg = 'DbBase.select(), known overlays = %(ovls)s' % ovls
+                self.output.debug(msg, 4)
             raise UnknownOverlayException(overlay)
         return self.overlays[overlay]
 
 
-    def list(self, repos=None, verbose=False, width=0):
+    def catalog(self):
         '''
-        List all overlays.
+        Returns the layman.catalog.Catalog of the overlays, which is only
+        rebuilt after overlays were added, removed or touched (see
+        OverlayDict.touch()).
         '''
-        result = []
+        revision = self.overlays.revision
+        if self._catalog is None or self._catalog[0] != revision:
+            self._catalog = (revision, Catalog(self.overlays))
+        return self._catalog[1]
 
-        selection = [overlay for (a, overlay) in self.overlays.items()]
-        if repos is not None:
-            selection = [ovl for ovl in selection if ovl.name in repos]
 
-        for overlay in selection:
+    def iter_list(self, repos=None, verbose=False, width=0, rows=None):
+        '''
+        Yields the listing of all overlays, or those in repos, sorted by
+        name, formatting each one only when it is asked for.
+
+        @param rows: optional list of catalog() rows to list instead, in
+            the given order.
+        @rtype generator of tuples (str, bool, bool): the summary and
+            whether the overlay is supported and official.
+        '''
+        catalog = self.catalog()
+        if rows is None:
+            rows = catalog.select(name=set(repos) if repos is not None
+                                  else None)
+        if not width and not verbose:
+            width = terminal_width() - 1
+
+        for row in rows:
+            overlay = self.overlays[catalog.names[row]]
             if verbose:
-                result.append((overlay.get_infostr(), overlay.is_supported(),
-                               overlay.is_official()))
+                summary = overlay.get_infostr()
             else:
-                result.append((overlay.short_list(width),
-                               overlay.is_supported(), overlay.is_official()))
+                summary = overlay.short_list(width)
+            yield (summary, overlay.is_supported(), catalog.official[row])
 
-        result = sorted(result, key=lambda summary_supported_official:\
-                                summary_supported_official[0].lower())
 
-        return result
+    def list(self, repos=None, verbose=False, width=0, rows=None):
+        '''
+        List all overlays, or those in repos, sorted by name.  See
+        iter_list().
+        '''
+        return list(self.iter_list(repos, verbose, width, rows))
 
 
     def list_ids(self):
         '''
-        Returns a list of the overlay names
+        Returns a sorted list of the overlay names
         '''
-        return sorted(self.overlays)
+        return self.overlays.sorted_names()[:]
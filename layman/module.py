@@ -4,9 +4,19 @@
 from __future__ import print_function
 
 import os
+import threading
 
 from layman.output import Message
 
+# Process wide registry of the scanned plug-in directories, so the many
+# Modules instances (one per Overlay, db, config handler...) share a
+# single scan and import of each plug-in package.
+# {(module_path, namepath): {kid-name: kid-dict}}
+_registry = {}
+# Modules get created from several threads at once (see utils.pool_map()),
+# reentrant as scanning imports plug-ins which may create Modules as well.
+_registry_lock = threading.RLock()
+
 class InvalidModuleName(Exception):
     '''An invalid or unknown module name.'''
 
@@ -107,7 +117,11 @@ class Modules(object):
             self.output = output
         else:
             self.output = Message()
-        self._modules = self._get_all_modules()
+        key = (os.path.realpath(self._module_path), self._namepath)
+        with _registry_lock:
+            if key not in _registry:
+                _registry[key] = self._get_all_modules()
+            self._modules = _registry[key]
         self.module_names = sorted(self._modules)
 
 
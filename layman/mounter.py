@@ -26,11 +26,15 @@ from __future__ import unicode_literals
 
 import argparse
 import copy
+import json
 import os
+import re
 import sys
+import threading
+import time
 
 from  layman.constants  import MOUNT_TYPES
-from  layman.utils      import path, run_command
+from  layman.utils      import atomic_open, path, pool_map, run_command
 from  layman.version    import VERSION
 
 
@@ -40,8 +44,11 @@ else:
     STR = basestring
 
 MOUNT_ARGS = {'Squashfs': ['-o', 'loop', '-t', 'squashfs']}
+MOUNTINFO = '/proc/self/mountinfo'
+# mountinfo escapes blanks and backslashes in paths as octal
+_OCTAL_ESCAPE = re.compile(r'\\([0-7]{3})')
 _USAGE = 'layman-mounter [-h] [-l] [-L] [-m MOUNT [MOUNT ...]]\n'\
-         '                      [-u UMOUNT [UMOUNT ...]] [-V]'
+         '                      [-u UMOUNT [UMOUNT ...]] [-r] [-j JOBS] [-V]'
 
 def is_mounted(mdir):
     '''
@@ -53,6 +60,27 @@ def is_mounted(mdir):
     return os.path.ismount(mdir)
 
 
+def read_mount_points(mountinfo=MOUNTINFO):
+    '''
+    Reads all mount points from the kernel's mount table.
+
+    @rtype set of str, or None if the table cannot be read.
+    '''
+    try:
+        with open(mountinfo, 'rb') as table:
+            lines = table.read().decode('UTF-8', 'replace').splitlines()
+    except (IOError, OSError):
+        return None
+
+    points = set()
+    for line in lines:
+        fields = line.split(' ')
+        if len(fields) > 4:
+            points.add(_OCTAL_ESCAPE.sub(lambda m: chr(int(m.group(1), 8)),
+                                         fields[4]))
+    return points
+
+
 class Mounter(object):
     '''
     Handles all mountable overlays.
@@ -63,6 +91,116 @@ class Mounter(object):
         self.output = self.config['output']
         self.overlays = overlays
         self.storage = self.config['storage']
+        # (db, revision, installed, mountables) of the last lookup
+        self._memo = None
+        self._mount_points = None
+        # set by mount_all()/umount_all() while they use one mount table
+        self._batch = False
+        # Overlays get mounted from sync threads: guards _mount_points and
+        # the mount_state file.
+        self._lock = threading.Lock()
+
+
+    def _lookup(self):
+        '''
+        Returns the installed and mountable overlay maps, which are only
+        rebuilt once the installed db changed.
+        '''
+        db = self.database()
+        revision = getattr(db.overlays, 'revision', None)
+        if (self._memo is None or self._memo[0] is not db or
+            revision is None or self._memo[1] != revision):
+            installed_db = {}
+            for overlay in self.overlays():
+                installed_db[overlay] = db.select(overlay)
+
+            mountable_ovls = {}
+            for key in sorted(installed_db):
+                for ovl_type in installed_db[key].source_types():
+                    if ovl_type in MOUNT_TYPES:
+                        mountable_ovls[key] = ovl_type
+            self._memo = (db, revision, installed_db, mountable_ovls)
+        return self._memo[2:]
+
+
+    def _is_mounted(self, mdir):
+        '''
+        Looks mdir up in the mount table read at the start of the current
+        operation.
+
+        @rtype bool
+        '''
+        with self._lock:
+            mount_points = self._mount_points
+        if mount_points is None:
+            return is_mounted(mdir)
+        return os.path.realpath(mdir) in mount_points
+
+
+    def _read_mount_points(self):
+        '''
+        Rereads the mount table used by _is_mounted().
+        '''
+        mount_points = read_mount_points()
+        with self._lock:
+            self._mount_points = mount_points
+
+
+    def _run_mount_command(self, command, args, mdir):
+        '''
+        Runs mount or umount and keeps the cached mount table current.
+        '''
+        result = run_command(self.config, command, args, cmd=command)
+        with self._lock:
+            if not result and self._mount_points is not None:
+                if command == 'mount':
+                    self._mount_points.add(os.path.realpath(mdir))
+                else:
+                    self._mount_points.discard(os.path.realpath(mdir))
+        return result
+
+
+    def _read_state(self):
+        '''
+        Reads the overlays mounted by layman from the mount_state file.
+
+        @rtype dict {'ovl1': {'type': 'Squashfs', 'pkg': str, 'dest': str},}
+        '''
+        state_path = self.config['mount_state']
+        if not state_path or not os.path.exists(state_path):
+            return {}
+        try:
+            with open(state_path, 'rb') as state_file:
+                return json.loads(state_file.read().decode('UTF-8'))
+        except (IOError, OSError, ValueError) as error:
+            self.output.warn('Mounter; could not read %(path)s: %(err)s'
+                % {'path': state_path, 'err': error})
+            return {}
+
+
+    def _record(self, ovl, entry):
+        '''
+        Records a mounted overlay in the mount_state file, or forgets it
+        when entry is None.
+        '''
+        state_path = self.config['mount_state']
+        if not state_path:
+            return
+        with self._lock:
+            state = self._read_state()
+            if entry is None:
+                if ovl not in state:
+                    return
+                del state[ovl]
+            else:
+                state[ovl] = entry
+            try:
+                with atomic_open(state_path, 'w') as state_file:
+                    state_file.write(json.dumps(state, indent=1,
+                                                sort_keys=True))
+            except (IOError, OSError) as error:
+                self.output.warn('Mounter; could not write %(path)s: %(err)s'
+                    % {'path': state_path, 'err': error})
 
 
     @property
@@ -73,12 +211,7 @@ class Mounter(object):
 
         @rtype dict {'ovl1', <layman.overlays.Overlay object>,...}
         '''
-        installed_db = {}
-
-        for overlay in self.overlays():
-            ovl_db = self.database().select(overlay)
-            installed_db[overlay] = ovl_db
-        return installed_db
+        return dict(self._lookup()[0])
 
 
     @property
@@ -89,13 +222,7 @@ class Mounter(object):
 
         @rtype dict {'ovl1': 'Squashfs',...}
         '''
-        mountable_ovls = {}
-
-        for key in sorted(self.installed):
-            for ovl_type in self.installed[key].source_types():
-                if ovl_type in MOUNT_TYPES:
-                    mountable_ovls[key] = ovl_type
-        return mountable_ovls
+        return dict(self._lookup()[1])
 
 
     @property
@@ -108,9 +235,10 @@ class Mounter(object):
         '''
         mounted_ovls = {}
 
-        for ovl in self.mountables:
+        self._read_mount_points()
+        for ovl in self._lookup()[1]:
             mdir = path([self.storage, ovl])
-            mounted_ovls[ovl] = is_mounted(mdir)
+            mounted_ovls[ovl] = self._is_mounted(mdir)
         return mounted_ovls
 
 
@@ -121,7 +249,7 @@ class Mounter(object):
         @rtype tuple
         '''
         if 'ALL' in repos:
-            repos = sorted(self.mountables)
+            repos = sorted(self._lookup()[1])
         elif isinstance(repos, STR):
             repos = [repos]
 
@@ -142,12 +270,15 @@ class Mounter(object):
         '''
         result = 1
 
+        installed, mountables = self._lookup()
+        if not self._batch:
+            self._read_mount_points()
         selection = self._check_selection(repo)
 
         for i in selection:
             name = {'ovl': i}
 
-            if i not in self.mountables and not install:
+            if i not in mountables and not install:
                 self.output.error('Overlay "%(ovl)s" cannot be mounted!'\
                                     % name)
                 continue
@@ -156,23 +287,30 @@ class Mounter(object):
             else:
                 mdir = path([self.storage, i])
 
-            if not is_mounted(mdir):
+            if not self._is_mounted(mdir):
                 if install:
                     args = copy.deepcopy(MOUNT_ARGS[ovl_type])
                 else:
-                    args = copy.deepcopy(MOUNT_ARGS[self.mountables[i]])
+                    args = copy.deepcopy(MOUNT_ARGS[mountables[i]])
                 
-                if not pkg:
-                    source = self.installed[i].sources[0].src
+                ovl_pkg = pkg
+                if not ovl_pkg:
+                    source = installed[i].sources[0]
 
-                    if 'file://' in source:
-                        pkg = source.replace('file://', '')
+                    if 'file://' in source.src:
+                        ovl_pkg = source.src.replace('file://', '')
                     else:
-                        pkg = path([self.storage, i, source.get_extension()])
+                        ovl_pkg = path([self.storage,
+                                        i + source.get_extension()])
 
-                args.append(pkg)
+                args.append(ovl_pkg)
                 args.append(mdir)
-                result = run_command(self.config, 'mount', args, cmd='mount')
+                result = self._run_mount_command('mount', args, mdir)
+                if result == 0:
+                    self._record(i, {'type': ovl_type if install
+                                             else mountables[i],
+                                     'pkg': ovl_pkg,
+                                     'dest': mdir})
             else:
                 self.output.warn('Overlay "%(ovl)s" is already mounted!'\
                                     % name)
@@ -191,12 +329,15 @@ class Mounter(object):
         '''
         result = 1
 
+        mountables = self._lookup()[1]
+        if not self._batch:
+            self._read_mount_points()
         selection = self._check_selection(repo)
             
         for i in selection:
             name = {'ovl': i}
 
-            if i not in self.mountables and not sync:
+            if i not in mountables and not sync:
                 self.output.error('Overlay "%(ovl)s" cannot be mounted!'\
                                     % name)
                 continue
@@ -205,9 +346,11 @@ class Mounter(object):
             else:
                 mdir = path([self.storage, i])
 
-            if is_mounted(mdir):
+            if self._is_mounted(mdir):
                 args = ['-l', mdir]
-                result = run_command(self.config, 'umount', args, cmd='umount')
+                result = self._run_mount_command('umount', args, mdir)
+                if result == 0:
+                    self._record(i, None)
             else:
                 self.output.warn('Overlay "%(ovl)s" is already unmounted!'\
                                     % name)
@@ -215,6 +358,91 @@ class Mounter(object):
         return result
 
 
+    def mount_all(self):
+        '''
+        Mounts all mountable overlays which are not mounted yet.
+
+        @rtype int: 0 if all of them were mounted.
+        '''
+        mounted = self.mounted
+        failed = 0
+        self._batch = True
+        try:
+            for ovl in sorted(mounted):
+                if not mounted[ovl]:
+                    failed = self.mount([ovl]) or failed
+        finally:
+            self._batch = False
+        return failed
+
+
+    def umount_all(self):
+        '''
+        Unmounts all mounted mountable overlays.
+
+        @rtype int: 0 if all of them were unmounted.
+        '''
+        mounted = self.mounted
+        failed = 0
+        self._batch = True
+        try:
+            for ovl in sorted(mounted):
+                if mounted[ovl]:
+                    failed = self.umount([ovl]) or failed
+        finally:
+            self._batch = False
+        return failed
+
+
+    def restore(self, jobs=8):
+        '''
+        Mounts all overlays recorded as mounted in the mount_state file,
+        up to jobs of them at the same time, e.g. after a reboot.
+
+        @params jobs: int of the maximum number of concurrent mounts.
+        @rtype int: 0 if all of them were mounted.
+        '''
+        state = self._read_state()
+        self._read_mount_points()
+        failed = 0
+        todo = []
+        for ovl in sorted(state):
+            entry = state[ovl]
+            if self._is_mounted(entry['dest']):
+                self.output.info('Overlay "%(ovl)s" is already mounted.'
+                    % {'ovl': ovl}, 2)
+            elif entry.get('type') not in MOUNT_ARGS or \
+                not os.path.exists(entry['pkg']):
+                self.output.error('Overlay "%(ovl)s" cannot be restored, '
+                    '%(pkg)s is missing!' % {'ovl': ovl, 'pkg': entry['pkg']})
+                failed = 1
+            else:
+                todo.append((ovl, entry))
+        if not todo:
+            return failed
+
+        def restore_one(item):
+            ovl, entry = item
+            start = time.time()
+            if not os.path.isdir(entry['dest']):
+                os.makedirs(entry['dest'])
+            args = copy.deepcopy(MOUNT_ARGS[entry['type']])
+            args.extend([entry['pkg'], entry['dest']])
+            result = self._run_mount_command('mount', args, entry['dest'])
+            return (ovl, result, time.time() - start)
+
+        for ovl, result, elapsed in pool_map(restore_one, todo, jobs):
+            msg = {'ovl': ovl, 'time': elapsed}
+            if result:
+                failed = 1
+                self.output.error('Failed to mount overlay "%(ovl)s" '
+                    '(%(time).2fs)' % msg)
+            else:
+                self.output.info('Mounted overlay "%(ovl)s" in %(time).2fs'
+                    % msg, 2)
+        return failed
+
+
 class Interactive(object):
     '''
     Interactive CLI session for the Mounter class
@@ -225,7 +453,11 @@ class Interactive(object):
         self.output = config['output']
         self.storage = config['storage']
         self.mount = mounter
-        self.mountables = self.mount.mountables
+
+
+    @property
+    def mountables(self):
+        return self.mount.mountables
 
 
     def args_parser(self):
@@ -256,6 +488,17 @@ class Interactive(object):
                                  nargs='+',
                                  help='Unmounts the selected overlay. Specify'\
                                  ' "ALL" to unmount all possible overlays')
+        self.parser.add_argument('-r',
+                                 '--restore',
+                                 action='store_true',
+                                 help='Mounts all overlays which were mounted'
+                                 ' by layman before, e.g. at boot time')
+        self.parser.add_argument('-j',
+                                 '--jobs',
+                                 type=int,
+                                 default=8,
+                                 help='The number of overlays to restore at'
+                                 ' the same time (default: 8)')
         self.parser.add_argument('-V',
                                  '--version',
                                  action='version',
@@ -273,13 +516,18 @@ class Interactive(object):
         for key in vars(self.args):
             options[key] = vars(self.args)[key]
 
+        if options['restore']:
+            sys.exit(self.mount.restore(jobs=options['jobs']))
+
         for i in ('list_mountables', 'list_mounted'):
             if options[i]:
                 getattr(self, i)()
                 self.output.notice('')
 
         for i in ('umount', 'mount'):
-            if options[i]:
+            if options[i] and 'ALL' in options[i]:
+                getattr(self.mount, '%(action)s_all' % {'action': i})()
+            elif options[i]:
                 getattr(self.mount, '%(action)s' % {'action': i})(options[i])
 
 
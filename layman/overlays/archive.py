@@ -1,6 +1,8 @@
 #!/usr/bin/python
 from __future__ import unicode_literals
 
+import hashlib
+import json
 import os
 import sys
 import shutil
@@ -8,15 +10,24 @@ import tempfile
 
 import xml.etree.ElementTree as ET # Python 2.5
 
+#Py3
+try:
+    import urllib.request as urllib_request
+    from urllib.error import HTTPError
+except ImportError:
+    import urllib2 as urllib_request
+    from urllib2 import HTTPError
+
 from  layman.constants         import MOUNT_TYPES
-from  layman.compatibility     import fileopen
 from  layman.overlays.source   import OverlaySource, require_supported
-from  layman.utils             import path
+from  layman.utils             import atomic_open, path, sync_tree
 from  layman.version           import VERSION
-from  sslfetch.connections     import Connector
 
 USERAGENT = "Layman-" + VERSION
 
+# Size of the pieces archives are downloaded and hashed in.
+CHUNK_SIZE = 64 * 1024
+
 class ArchiveOverlay(OverlaySource):
 
     type = 'Archive'
@@ -34,50 +45,280 @@ class ArchiveOverlay(OverlaySource):
         self.mount_me = bool(self.type in MOUNT_TYPES)
 
 
-    def _fetch(self, base, archive_url, dest_dir):
+    def _fetch(self, base, archive_url, dest_dir, meta=None):
         '''
         Fetches overlay source archive.
 
         @params base: string of directory base for installed overlays.
         @params archive_url: string of URL where archive is located.
         @params dest_dir: string of destination of extracted archive.
-        @rtype tuple (str of package location, bool to clean_archive)
+        @params meta: dict of the archive's metadata from the last fetch,
+                      to only download it if it changed.
+        @rtype tuple (str of package location or None if unchanged,
+                      dict of the archive's HTTP validators)
         '''
         ext = self.get_extension()
  
         if 'file://' not in archive_url:
-            # set up ssl-fetch output map
-            connector_output = {
-                'info': self.output.debug,
-                'error': self.output.error,
-                'kwargs-info': {'level': 5},
-                'kwargs-debug': {'level': 2},
-                'kwargs-error': {'level': None},
-            }
-
-            fetcher = Connector(connector_output, self.proxies, USERAGENT)
-
-            success, archive, timestamp = fetcher.fetch_content(archive_url)
-
             pkg = path([base, self.parent.name + ext])
 
             try:
-                with fileopen(pkg, 'w+b') as out_file:
-                    out_file.write(archive)
-
+                validators = self._download(archive_url, pkg, meta)
             except Exception as error:
                 raise Exception('Failed to store archive package in '\
                                 '%(pkg)s\nError was: %(error)s'\
                                 % ({'pkg': pkg, 'error': error}))
+            if validators is None:
+                return (None, None)
         
         else:
             self.clean_archive = False
             pkg = archive_url.replace('file://', '')
+            validators = {}
+            self._verify(pkg)
 
-        return pkg
+        return (pkg, validators)
 
 
-    def _add_unchecked(self, base):
+    def _download(self, archive_url, pkg, meta=None):
+        '''
+        Streams the archive to pkg + ".partial", resuming a previously
+        interrupted download of it, verifies it and renames it to pkg.
+
+        A partial download is only resumed with an If-Range request
+        carrying the validator it was started with (kept in
+        pkg + ".partial.json"), so a newer archive is never appended to
+        an older one.
+
+        @params archive_url: string of URL where archive is located.
+        @params pkg: string of the archive's destination.
+        @params meta: dict of the archive's metadata from the last fetch,
+                      its validators make the request conditional.
+        @rtype dict of the ETag and Last-Modified validators, or None if
+               the server reported the archive as unchanged.
+        '''
+        partial = pkg + '.partial'
+        offset = 0
+        if_range = None
+        if os.path.exists(partial):
+            if_range = self._partial_validator(partial, archive_url)
+            if if_range:
+                offset = os.path.getsize(partial)
+            else:
+                self._remove_partial(partial)
+
+        opener = urllib_request.build_opener(
+            urllib_request.ProxyHandler(self.proxies or None))
+        request = urllib_request.Request(archive_url,
+                                         headers={'User-Agent': USERAGENT})
+        if offset:
+            request.add_header('Range', 'bytes=%d-' % offset)
+            request.add_header('If-Range', if_range)
+        elif meta:
+            if meta.get('etag'):
+                request.add_header('If-None-Match', meta['etag'])
+            if meta.get('last-modified'):
+                request.add_header('If-Modified-Since',
+                                   meta['last-modified'])
+
+        try:
+            response = opener.open(request, timeout=60)
+        except HTTPError as error:
+            if error.code == 304 and not offset:
+                return None
+            if error.code != 416 or not offset:
+                raise
+            # Whatever the partial file holds, it can not be completed
+            # by this server: start over.
+            self._remove_partial(partial)
+            return self._download(archive_url, pkg, meta)
+
+        validators = {}
+        info = response.info()
+        for key, header in (('etag', 'ETag'),
+                            ('last-modified', 'Last-Modified')):
+            if info.get(header):
+                validators[key] = info.get(header)
+        try:
+            # Servers ignoring the range or finding the archive changed
+            # send the whole archive again.
+            resumed = offset and response.getcode() == 206
+            if resumed:
+                self.output.info('Resuming download of %(url)s at byte '\
+                    '%(offset)d' % {'url': archive_url, 'offset': offset},
+                    2)
+            else:
+                self._remove_partial(partial)
+                self._write_partial_meta(partial, archive_url, validators)
+            with open(partial, 'ab' if resumed else 'wb') as out_file:
+                while True:
+                    chunk = response.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    out_file.write(chunk)
+        finally:
+            response.close()
+
+        try:
+            self._verify(partial)
+        except Exception:
+            # Corrupt or stale, do not resume from it.
+            self._remove_partial(partial)
+            raise
+        os.rename(partial, pkg)
+        self._remove_partial(partial)
+        return validators
+
+
+    @staticmethod
+    def _partial_validator(partial, archive_url):
+        '''
+        Returns the If-Range value for resuming partial: the strong ETag
+        or else the Last-Modified date the download started with, None if
+        it can not be resumed safely.
+        '''
+        try:
+            with open(partial + '.json', 'rb') as meta_file:
+                meta = json.loads(meta_file.read().decode('UTF-8'))
+        except (IOError, OSError, ValueError):
+            return None
+        if meta.get('url') != archive_url:
+            return None
+        etag = meta.get('etag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return meta.get('last-modified')
+
+
+    @staticmethod
+    def _write_partial_meta(partial, archive_url, validators):
+        '''
+        Records what a new partial download is a part of.  Without a
+        validator there is nothing to resume it with, so nothing is kept.
+        '''
+        if not validators:
+            return
+        meta = dict(validators, url=archive_url)
+        try:
+            with atomic_open(partial + '.json', 'w') as meta_file:
+                meta_file.write(json.dumps(meta, sort_keys=True))
+        except (IOError, OSError):
+            pass
+
+
+    @staticmethod
+    def _remove_partial(partial):
+        '''
+        Removes a partial download and its validators.
+        '''
+        for name in (partial, partial + '.json'):
+            if os.path.exists(name):
+                os.unlink(name)
+
+
+    def _meta_path(self, base):
+        '''
+        Returns the location of the overlay's archive metadata.
+
+        @params base: string of directory base for installed overlays.
+        '''
+        return path([base, '.%s.archive.json' % self.parent.name])
+
+
+    def _read_meta(self, base):
+        '''
+        Reads the metadata recorded by the last add or sync of the
+        overlay, if it was fetched from the current source.
+
+        @params base: string of directory base for installed overlays.
+        @rtype dict or None
+        '''
+        try:
+            with open(self._meta_path(base), 'rb') as meta_file:
+                meta = json.loads(meta_file.read().decode('UTF-8'))
+        except (IOError, OSError, ValueError):
+            return None
+        if meta.get('url') != self.src:
+            return None
+        return meta
+
+
+    def _write_meta(self, base, meta):
+        '''
+        Records the archive metadata, failures only cost a download.
+
+        @params base: string of directory base for installed overlays.
+        @params meta: dict of the archive's metadata.
+        '''
+        try:
+            with atomic_open(self._meta_path(base), 'w') as meta_file:
+                meta_file.write(json.dumps(meta, sort_keys=True))
+        except (IOError, OSError) as error:
+            self.output.debug('ArchiveOverlay._write_meta(); failed: %s'
+                % error, 4)
+
+
+    def _remove_meta(self, base):
+        '''
+        Forgets the archive metadata of a deleted overlay.
+
+        @params base: string of directory base for installed overlays.
+        '''
+        if os.path.exists(self._meta_path(base)):
+            os.unlink(self._meta_path(base))
+
+
+    @staticmethod
+    def _archive_info(pkg):
+        '''
+        @params pkg: string of the archive location.
+        @rtype tuple (size, sha256 hex digest)
+        '''
+        digest = hashlib.sha256()
+        with open(pkg, 'rb') as in_file:
+            for chunk in iter(lambda: in_file.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return (os.path.getsize(pkg), digest.hexdigest())
+
+
+    def _verify(self, pkg):
+        '''
+        Checks the archive against the size and sha256 attributes of the
+        overlay's source, if given.
+
+        @params pkg: string of the archive location.
+        '''
+        size = self.options.get('size')
+        if size and os.path.getsize(pkg) != int(size):
+            raise Exception('Archive %(pkg)s has %(got)d bytes, expected '\
+                '%(size)s' % {'pkg': pkg, 'got': os.path.getsize(pkg),
+                              'size': size})
+
+        sha256 = self.options.get('sha256')
+        if sha256:
+            if self._archive_info(pkg)[1] != sha256.lower():
+                raise Exception('Archive %(pkg)s does not match its sha256 '\
+                    'checksum' % {'pkg': pkg})
+
+
+    def _cleans_archive(self):
+        '''
+        Whether the downloaded archive is deleted once it is installed.
+        Mounted archives are kept, they are the overlay (and are deleted
+        together with it).
+        '''
+        return self.clean_archive and not self.mount_me
+
+
+    def _add_unchecked(self, base, meta=None):
+        '''
+        Fetches and installs the archive.
+
+        @params base: string of directory base for installed overlays.
+        @params meta: dict of the archive's metadata from the last fetch,
+                      nothing is installed again if it did not change.
+        @rtype int result of post_fetch(), or None if unchanged.
+        '''
         def try_to_wipe(folder):
             if not os.path.exists(folder):
                 return
@@ -92,25 +333,60 @@ class ArchiveOverlay(OverlaySource):
                     % ({'dir': folder, 'err': error}))
 
         final_path = path([base, self.parent.name])
+        # An installed archive which is not mounted (e.g. after a reboot)
+        # has to be mounted again even if it did not change.
+        remount = (self.mount_me and meta is not None and
+                   not os.path.ismount(final_path))
+        image = path([base, self.parent.name + self.get_extension()])
+        if remount and 'file://' not in self.src and \
+            not os.path.exists(image):
+            meta = None
+        temp_path = None
         try:
             if not self.mount_me:
                 temp_path = tempfile.mkdtemp(dir=base)
             else:
                 temp_path = final_path
+            pkg, validators = self._fetch(base=base, archive_url=self.src,
+                dest_dir=temp_path, meta=meta)
+            if pkg is not None:
+                size, sha256 = self._archive_info(pkg)
+            if pkg is None or (meta and meta.get('size') == size and
+                               meta.get('sha256') == sha256):
+                if not remount:
+                    if not self.mount_me:
+                        try_to_wipe(temp_path)
+                    if pkg is not None:
+                        # Same content under new validators, keep them so
+                        # the next fetch is conditional again.
+                        validators.update({'url': self.src, 'size': size,
+                                           'sha256': sha256})
+                        if validators != meta:
+                            self._write_meta(base, validators)
+                        if self._cleans_archive():
+                            os.unlink(pkg)
+                    return None
+                if pkg is None:
+                    pkg = image
+                    validators = dict((key, meta[key]) for key in
+                                      ('etag', 'last-modified') if key in meta)
+                    size, sha256 = meta.get('size'), meta.get('sha256')
+
+            if self.mount_me:
+                # An archive replaced by _fetch() stays mounted until here.
                 if not os.path.exists(temp_path):
                     os.mkdir(temp_path)
-                else:
-                    if os.path.ismount(temp_path):
-                      self.config['mounts'].umount([self.parent.name],
-                                                   dest=temp_path,
-                                                   sync=True)
-            pkg = self._fetch(base=base, archive_url=self.src,
-                dest_dir=temp_path)
+                elif os.path.ismount(temp_path):
+                    self.config['mounts'].umount([self.parent.name],
+                                                 dest=temp_path,
+                                                 sync=True)
             result = self.post_fetch(pkg, temp_path)
-            if self.clean_archive:
+            if self._cleans_archive():
                 os.unlink(pkg)
         except Exception as error:
-            try_to_wipe(temp_path)
+            # Never wipe a still mounted archive.
+            if temp_path is not None and not os.path.ismount(temp_path):
+                try_to_wipe(temp_path)
             raise error
 
         if result == 0 and not self.mount_me:
@@ -120,15 +396,33 @@ class ArchiveOverlay(OverlaySource):
                 source = temp_path
 
             if os.path.exists(source):
-                if os.path.exists(final_path):
-                    self.delete(base)
-
-                try:
-                    os.rename(source, final_path)
-                except Exception as error:
-                    raise Exception('Failed to rename archive subdirectory '\
-                        '%(src)s to %(path)s\nError was: %(err)s'\
-                        % ({'src': source, 'path': final_path, 'err': error}))
+                if (self.config['incremental_archive_sync'] and
+                    os.path.isdir(final_path) and
+                    not os.path.islink(final_path)):
+                    # Unchanged files keep their mtime, so the metadata
+                    # cache only has to regenerate what did change.
+                    try:
+                        changed, removed = sync_tree(source, final_path)
+                    except Exception as error:
+                        try_to_wipe(temp_path)
+                        raise Exception('Failed to update %(path)s from the '\
+                            'archive\nError was: %(err)s'\
+                            % ({'path': final_path, 'err': error}))
+                    self.output.info('Updated %(changed)d and removed '\
+                        '%(removed)d entries of %(path)s'\
+                        % ({'changed': changed, 'removed': removed,
+                            'path': final_path}), 2)
+                else:
+                    if os.path.exists(final_path):
+                        self.delete(base)
+
+                    try:
+                        os.rename(source, final_path)
+                    except Exception as error:
+                        raise Exception('Failed to rename archive '\
+                            'subdirectory %(src)s to %(path)s\nError was: '\
+                            '%(err)s' % ({'src': source, 'path': final_path,
+                                          'err': error}))
                 os.chmod(final_path, 0o755)
             else:
                 raise Exception('The given path (branch setting in the xml)\n'\
@@ -138,6 +432,11 @@ class ArchiveOverlay(OverlaySource):
         if not self.mount_me:
             try_to_wipe(temp_path)
 
+        if result == 0:
+            validators.update({'url': self.src, 'size': size,
+                               'sha256': sha256})
+            self._write_meta(base, validators)
+
         return result
 
 
@@ -163,6 +462,17 @@ class ArchiveOverlay(OverlaySource):
             cwd=target)
 
 
+    def delete(self, base):
+        '''
+        Delete overlay.
+
+        @params base: string location where overlays are installed.
+        @rtype bool
+        '''
+        self._remove_meta(base)
+        return super(ArchiveOverlay, self).delete(base)
+
+
     def sync(self, base):
         '''
         Sync overlay.
@@ -176,9 +486,16 @@ class ArchiveOverlay(OverlaySource):
 
         target = path([base, self.parent.name])
 
-        return self.postsync(
-            self._add_unchecked(base),
-            cwd=target)
+        meta = None
+        if os.path.exists(target):
+            meta = self._read_meta(base)
+        result = self._add_unchecked(base, meta=meta)
+        if result is None:
+            self.output.info('Archive of overlay %(name)s is unchanged.'
+                % {'name': self.parent.name}, 2)
+            return 0
+
+        return self.postsync(result, cwd=target)
 
 
     def supported(self):
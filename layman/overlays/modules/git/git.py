@@ -26,9 +26,26 @@ __version__ = "$Id: git.py 146 2006-05-27 09:52:36Z wrobel $"
 #
 #-------------------------------------------------------------------------------
 
+import errno
+import hashlib
+import os
+import threading
+
 from   layman.utils             import path, run_command
 from   layman.overlays.source   import OverlaySource, require_supported
 
+#===============================================================================
+#
+# Mirror cache state
+#
+#-------------------------------------------------------------------------------
+
+# Mirrors already cloned or updated by this process, and a lock per mirror
+# so parallel syncs of overlays sharing a source update it once.
+_updated_mirrors = set()
+_mirror_locks = {}
+_mirror_locks_lock = threading.Lock()
+
 #===============================================================================
 #
 # Class GitOverlay
@@ -59,6 +76,84 @@ class GitOverlay(OverlaySource):
                 return source + '/'
         return source
 
+    def _option(self, key):
+        '''
+        Returns the source's clone option or the global git_* default.
+
+        @param key: one of "depth", "filter" and "single-branch".
+        '''
+        value = self.options.get(key)
+        if value is None:
+            value = self.config['git_%s' % {'depth': 'clone_depth',
+                                             'filter': 'clone_filter',
+                                             'single-branch': 'single_branch',
+                                             }[key]]
+        if key == 'single-branch' and not isinstance(value, bool):
+            value = str(value).lower() in ['yes', 'true', 'y', 't']
+        return value
+
+    def _clone_args(self):
+        '''Shallow and partial clone arguments for git clone.'''
+        args = []
+        if self._option('depth'):
+            args.extend(['--depth', str(self._option('depth'))])
+        if self._option('filter'):
+            args.append('--filter=%s' % self._option('filter'))
+        if self._option('single-branch'):
+            args.append('--single-branch')
+        return args
+
+    def _mirror(self):
+        '''
+        Clones or updates the bare mirror of the source in the
+        git_mirror_dir, once per process.
+
+        @rtype str: path of the mirror, or None if there is none to use.
+        '''
+        mirror_dir = self.config['git_mirror_dir']
+        if not mirror_dir:
+            return None
+
+        source = self._fix_git_source(self.src)
+        mirror = os.path.join(mirror_dir,
+            hashlib.md5(source.encode('utf-8')).hexdigest() + '.git')
+
+        with _mirror_locks_lock:
+            lock = _mirror_locks.setdefault(mirror, threading.Lock())
+        with lock:
+            if mirror in _updated_mirrors:
+                return mirror
+
+            if os.path.isdir(mirror):
+                # git fetch [-q] --prune origin
+                args = ['fetch', '--prune', 'origin']
+                cwd = mirror
+            else:
+                try:
+                    os.makedirs(mirror_dir)
+                except OSError as error:
+                    # Another thread or process may have just created it
+                    if error.errno != errno.EEXIST or \
+                       not os.path.isdir(mirror_dir):
+                        self.output.warn('Could not create the git mirror '
+                            'directory "%s", not using it: %s'
+                            % (mirror_dir, error), 2)
+                        return None
+                # git clone [-q] --mirror SOURCE MIRROR
+                args = ['clone', '--mirror', source, mirror]
+                cwd = mirror_dir
+            if self.config['quiet']:
+                args.insert(1, '-q')
+
+            if run_command(self.config, self.command(), args, cwd=cwd,
+                           cmd=self.type):
+                self.output.warn('Could not update the git mirror "%s" of '
+                    '%s, not using it.' % (mirror, source), 2)
+                return None
+
+            _updated_mirrors.add(mirror)
+        return mirror
+
     def add(self, base):
         '''Add overlay.'''
 
@@ -74,6 +169,13 @@ class GitOverlay(OverlaySource):
             args.append('-q')
         if len(cfg_opts):
             args.extend(cfg_opts.split())
+        args.extend(self._clone_args())
+        mirror = self._mirror()
+        if mirror:
+            # Objects are copied from the mirror, the checkout does not
+            # keep an alternates link to it, which would not resolve in
+            # a chroot and break once the mirror is pruned or removed.
+            args.extend(['--reference', mirror, '--dissociate'])
         args.append(self._fix_git_source(self.src))
         args.append(target)
 
@@ -128,9 +230,17 @@ class GitOverlay(OverlaySource):
         if not self.supported():
             return 1
 
-        cfg_opts = self.config["git_syncopts"]
         target = path([base, self.parent.name])
 
+        if self._option('depth'):
+            return self.postsync(self._shallow_sync(target), cwd=target)
+
+        cfg_opts = self.config["git_syncopts"]
+
+        mirror = self._mirror()
+        if mirror:
+            self._fetch_mirror(target, mirror)
+
         args = ['pull']
         if self.config['quiet']:
             args.append('-q')
@@ -142,6 +252,47 @@ class GitOverlay(OverlaySource):
                         cmd=self.type),
             cwd=target)
 
+    def _fetch_mirror(self, target, mirror):
+        '''
+        Fetches the branches of the mirror into the remote tracking
+        branches of the checkout, so pulling from the source afterwards
+        only transfers what the mirror does not have yet.  Failures are
+        harmless, the pull then fetches everything from the source.
+        '''
+        # git fetch [-q] MIRROR +refs/heads/*:refs/remotes/origin/*
+        args = ['fetch']
+        if self.config['quiet']:
+            args.append('-q')
+        args.extend([mirror, '+refs/heads/*:refs/remotes/origin/*'])
+        if run_command(self.config, self.command(), args, cwd=target,
+                       cmd=self.type):
+            self.output.debug('git._fetch_mirror(); fetching from "%s" '
+                'failed' % mirror, 4)
+
+    def _shallow_sync(self, target):
+        '''
+        Fetches the tracked branch to the configured depth and resets the
+        checkout to it, so no more history than needed is kept.  The
+        git_syncopts are git pull options and not used here.
+        '''
+        # git fetch [-q] --depth N
+        args = ['fetch']
+        if self.config['quiet']:
+            args.append('-q')
+        args.extend(['--depth', str(self._option('depth'))])
+        failure = run_command(self.config, self.command(), args, cwd=target,
+                              cmd=self.type)
+        if failure:
+            return failure
+
+        # git reset [-q] --hard @{upstream}
+        args = ['reset']
+        if self.config['quiet']:
+            args.append('-q')
+        args.extend(['--hard', '@{upstream}'])
+        return run_command(self.config, self.command(), args, cwd=target,
+                           cmd=self.type)
+
     def supported(self):
         '''Overlay type supported?'''
 
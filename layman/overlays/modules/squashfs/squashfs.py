@@ -82,11 +82,13 @@ class SquashfsOverlay(ArchiveOverlay):
             pkg = path([self.config['storage'], pkg_name])
 
         if os.path.ismount(mdir):
-            result = self.mounter.umount([self.parent.name])
+            result = self.mounter.umount([self.parent.name], dest=mdir,
+                                         sync=True)
         else:
             result = 1
 
         shutil.rmtree(mdir)
+        self._remove_meta(base)
         if self.clean_archive:
             if os.path.exists(pkg):
                 os.unlink(pkg)
@@ -115,7 +117,8 @@ class SquashfsOverlay(ArchiveOverlay):
                                        'ovl': self.parent.name}
             warning_2 = 'Upon reboot the overlay will not be accessible until'\
                         ' you mount it either manually or via the'\
-                        ' layman-mounter tool.'
+                        ' layman-mounter tool, "layman-mounter --restore"'\
+                        ' mounts all of them again.'
 
             self.output.warn(warning_1)
             self.output.warn(warning_2)
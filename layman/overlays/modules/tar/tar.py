@@ -25,13 +25,18 @@ __version__ = "$Id: tar.py 310 2007-04-09 16:30:40Z wrobel $"
 # Dependencies
 #
 #-------------------------------------------------------------------------------
-
+import os
+import shutil
+import tarfile
 
 from   layman.constants        import FILE_EXTENSIONS
 from   layman.overlays.archive import ArchiveOverlay
 from   layman.overlays.source  import require_supported
 from   layman.utils            import run_command
 
+# Leading bytes of the compressions tarfile reads itself
+TARFILE_MAGIC = (b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00', b'\x5d\x00\x00')
+
 #===============================================================================
 #
 # Class TarOverlay
@@ -68,16 +73,127 @@ class TarOverlay(ArchiveOverlay):
         return ext
 
 
+    def _safe(self, member):
+        '''
+        Determines whether an archive member stays inside the destination
+        and is a plain file, directory or link.
+
+        @params member: tarfile.TarInfo
+        @rtype bool
+        '''
+        def escapes(name):
+            name = os.path.normpath(name)
+            return (os.path.isabs(name) or name == os.pardir or
+                    name.startswith(os.pardir + os.sep))
+
+        if escapes(member.name):
+            return False
+        if member.issym():
+            return not escapes(os.path.join(os.path.dirname(member.name),
+                                            member.linkname))
+        if member.islnk():
+            return not escapes(member.linkname)
+        return member.isfile() or member.isdir()
+
+
+    def _extract(self, pkg, dest_dir):
+        '''
+        Extracts the tar archive in process, reading it as a stream, and
+        only the branch subpath if one is set.
+
+        @params pkg: string location where tar archive is located.
+        @params dest_dir: string of destination of extracted archive.
+        '''
+        kwargs = {}
+        if hasattr(tarfile, 'data_filter'):
+            kwargs['filter'] = 'data'
+
+        branch = None
+        if self.branch:
+            branch = os.path.normpath(self.branch.strip('/'))
+
+        self.output.info('Extracting %(pkg)s to %(dir)s'
+            % {'pkg': pkg, 'dir': dest_dir}, 2)
+        # "r|*" decompresses gzip, bzip2 and xz on the fly
+        with tarfile.open(pkg, 'r|*') as archive:
+            for member in archive:
+                name = os.path.normpath(member.name)
+                if branch and name != branch and \
+                    not name.startswith(branch + os.sep):
+                    continue
+                if not self._safe(member):
+                    self.output.warn('Skipping unsafe archive member %s'
+                        % member.name, 2)
+                    continue
+                archive.extract(member, dest_dir, **kwargs)
+
+
+    @staticmethod
+    def _known_compression(pkg):
+        '''
+        Determines whether pkg is a plain tar archive or compressed in a
+        way tarfile reads.
+
+        @rtype bool
+        '''
+        with open(pkg, 'rb') as archive:
+            head = archive.read(512)
+        return (head.startswith(TARFILE_MAGIC) or
+                head[257:262] == b'ustar')
+
+
+    @staticmethod
+    def _wipe(dest_dir):
+        '''
+        Removes whatever an extraction left in dest_dir.
+        '''
+        for name in os.listdir(dest_dir):
+            entry = os.path.join(dest_dir, name)
+            if os.path.isdir(entry) and not os.path.islink(entry):
+                shutil.rmtree(entry)
+            else:
+                os.unlink(entry)
+
+
     def post_fetch(self, pkg, dest_dir):
         '''
-        Extracts tar archive.
+        Extracts tar archive.  Only archives compressed in a way tarfile
+        does not know (e.g. .tar.Z) are handed to the tar
+        command, anything tarfile rejects is an error.
 
         @params pkg: string location where tar archive is located.
         @params dest_dir: string of destination of extracted archive.
         @rtype bool
         '''
-        # tar -v -x -f SOURCE -C TARGET
-        args = ['-v', '-x', '-f', pkg, '-C', dest_dir]
+        try:
+            self._extract(pkg, dest_dir)
+            return 0
+        except (tarfile.CompressionError, tarfile.ReadError) as error:
+            msg = 'Failed to extract %(pkg)s: %(err)s'\
+                  % {'pkg': pkg, 'err': error}
+            if (isinstance(error, tarfile.ReadError) and
+                self._known_compression(pkg)):
+                # Truncated or corrupt
+                self.output.error(msg)
+                return 1
+        except (tarfile.TarError, EOFError, IOError, OSError) as error:
+            # Includes members refused by the data filter
+            self.output.error('Failed to extract %(pkg)s: %(err)s'
+                % {'pkg': pkg, 'err': error})
+            return 1
+
+        if not require_supported(
+            [(self.command(),  'tar', 'app-arch/tar'), ],
+            self.output.warn):
+            self.output.error(msg)
+            return 1
+        self.output.warn(msg + '\nTrying %s...' % self.command(), 2)
+        self._wipe(dest_dir)
+
+        # tar -x -f SOURCE -C TARGET [BRANCH]
+        args = ['-x', '-f', pkg, '-C', dest_dir]
+        if self.branch:
+            args.append(self.branch.strip('/'))
         result = run_command(self.config, self.command(), args, cmd=self.type)
 
         return result
@@ -85,11 +201,11 @@ class TarOverlay(ArchiveOverlay):
 
     def is_supported(self):
         '''
-        Determines if overlay type is supported.
+        Determines if overlay type is supported.  Archives are extracted
+        in process, the tar command is only needed for compressions
+        tarfile does not know and is checked for when one is found.
 
         @rtype bool
         '''
 
-        return require_supported(
-            [(self.command(),  'tar', 'app-arch/tar'), ],
-            self.output.warn)
+        return True
@@ -53,7 +53,13 @@ MOD_PATH = path = os.path.join(os.path.dirname(__file__), 'modules')
 
 QUALITY_LEVELS = 'core|stable|testing|experimental|graveyard'.split('|')
 
+# Optional source attributes besides "type" and "branch", handed to the
+# overlay type as OverlaySource.options.
+SOURCE_OPTIONS = ('depth', 'filter', 'single-branch', 'size', 'sha256')
+
 WHITESPACE_REGEX = re.compile('\s+')
+SPACES_REGEX = re.compile(' +')
+INDENT_REGEX = re.compile('\n ')
 
 
 class Overlay(object):
@@ -173,7 +179,7 @@ class Overlay(object):
             raise Exception(msg)
 
         def create_dict_overlay_source(source_):
-            _src, _type, _sub = source_
+            _src, _type, _sub = source_[:3]
             self.ovl_type = _type
             try:
                 _class = self.module_controller.get_class(_type)
@@ -186,8 +192,12 @@ class Overlay(object):
             else:
                 self.branch = None
 
-            return _class(parent=self, config=self.config,
+            _source = _class(parent=self, config=self.config,
                 _location=_location, ignore=ignore)
+            if len(source_) > 3:
+                _source.options = dict((k, encode(v))
+                                       for (k, v) in source_[3].items())
+            return _source
 
         self.sources = [create_dict_overlay_source(e) for e in _sources]
 
@@ -313,8 +323,12 @@ class Overlay(object):
             else:
                 self.branch = None
 
-            return _class(parent=self, config=self.config,
+            _source = _class(parent=self, config=self.config,
                 _location=_location, ignore=ignore)
+            _source.options = dict((k, encode(source_['@' + k]))
+                                   for k in SOURCE_OPTIONS
+                                   if '@' + k in source_)
+            return _source
 
         self.sources = [create_json_overlay_source(e) for e in _sources]
 
@@ -441,8 +455,12 @@ class Overlay(object):
             _location = encode(strip_text(source_elem))
             self.branch = _branch
 
-            return _class(parent=self, config=self.config,
+            _source = _class(parent=self, config=self.config,
                 _location=_location, ignore=ignore)
+            _source.options = dict((k, encode(source_elem.attrib[k]))
+                                   for k in SOURCE_OPTIONS
+                                   if k in source_elem.attrib)
+            return _source
 
         if not len(_sources):
             msg = 'Overlay from_xml(), "%(name)" is missing a "source" entry!'\
@@ -583,16 +601,16 @@ class Overlay(object):
 
 
         for description in self.descriptions:
-            description = re.compile(' +').sub(' ', description)
-            description = re.compile('\n ').sub('\n', description)
+            description = SPACES_REGEX.sub(' ', description)
+            description = INDENT_REGEX.sub('\n', description)
             result += '\nDescription:'
             result += '\n  '.join(('\n' + description).split('\n'))
             result += '\n'
 
         if self.homepage != None:
             link = self.homepage
-            link = re.compile(' +').sub(' ', link)
-            link = re.compile('\n ').sub('\n', link)
+            link = SPACES_REGEX.sub(' ', link)
+            link = INDENT_REGEX.sub('\n', link)
             result += '\nLink:'
             result += '\n  '.join(('\n' + link).split('\n'))
             result += '\n'
@@ -675,6 +693,36 @@ class Overlay(object):
         return self.sources[0].sync(base)
 
 
+    def to_dict(self):
+        '''
+        Convert to a dictionary as understood by from_dict().
+        '''
+        repo = {}
+
+        repo['name'] = self.name
+        repo['description'] = [i for i in self.descriptions]
+        repo['quality'] = self.quality
+        repo['priority'] = self.priority
+        for key, value in (('status', self.status),
+                           ('license', self.license),
+                           ('homepage', self.homepage),
+                           ('irc', self.irc)):
+            if value != None:
+                repo[key] = value
+        repo['owner'] = [dict((k, v) for (k, v) in i.items() if v != None)
+                         for i in self.owners]
+        repo['source'] = []
+        for i in self.sources:
+            source = (i.src, i.__class__.type_key, i.branch)
+            if i.options:
+                source += (dict(i.options),)
+            repo['source'].append(source)
+        if self.feeds != None:
+            repo['feed'] = [i for i in self.feeds]
+
+        return repo
+
+
     def to_json(self):
         '''
         Convert to json.
@@ -699,6 +747,8 @@ class Overlay(object):
             source = {'@type': i.__class__.type_key}
             if i.branch:
                 source['@branch'] = i.branch
+            for key, value in sorted(i.options.items()):
+                source['@' + key] = value
             source['#text'] = i.src
             repo['source'].append(source)
         if self.feeds != None:
@@ -751,6 +801,8 @@ class Overlay(object):
                 source = ET.Element('source', type=i.__class__.type_key)
             else:
                 source = ET.Element('source', type=i.__class__.type_key, branch=i.branch)
+            for key, value in sorted(i.options.items()):
+                source.attrib[key] = value
             source.text = i.src
             repo.append(source)
             del source
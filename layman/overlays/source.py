@@ -56,6 +56,8 @@ class OverlaySource(object):
         self.src = _location
         self.config = config
         self.ignore = ignore
+        # optional source attributes, see overlay.SOURCE_OPTIONS
+        self.options = {}
 
         self.output = config['output']
 
@@ -90,6 +92,22 @@ class OverlaySource(object):
         '''Sync the overlay.'''
         pass
 
+    def async_add(self, base, timeout=None):
+        '''
+        Coroutine adding the overlay from an asyncio event loop, see
+        layman.asyncutils.run_with_commands() for timeout and cancellation.
+        '''
+        from layman.asyncutils import run_with_commands
+        return run_with_commands(self.add, base, timeout=timeout)
+
+    def async_sync(self, base, timeout=None):
+        '''
+        Coroutine syncing the overlay from an asyncio event loop, see
+        layman.asyncutils.run_with_commands() for timeout and cancellation.
+        '''
+        from layman.asyncutils import run_with_commands
+        return run_with_commands(self.sync, base, timeout=timeout)
+
     def delete(self, base):
         '''Delete the overlay.'''
         mdir = path([base, self.parent.name])
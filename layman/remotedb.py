@@ -29,6 +29,8 @@ __version__ = "$Id: db.py 309 2007-04-09 16:23:38Z wrobel $"
 import os, os.path
 import sys
 import hashlib
+import json
+import time
 
 GPG_ENABLED = False
 try:
@@ -39,8 +41,10 @@ except ImportError:
     pass
 
 
-from   layman.utils             import encoder
+from   layman.utils             import atomic_open, encoder, get_jobs, \
+                                       pool_map
 from   layman.dbbase            import DbBase
+from   layman.search            import SearchIndex
 from   layman.version           import VERSION
 from   layman.compatibility     import fileopen
 from   sslfetch.connections     import Connector
@@ -89,11 +93,15 @@ class RemoteDB(DbBase):
 
         #quiet = int(config['quietness']) < 3
 
+        # Without checking there is no need to build every overlay of the
+        # lists up front, most callers only look at a few of them.
         DbBase.__init__(self, config, paths=paths, ignore=ignore,
-            ignore_init_read_errors=ignore_init_read_errors)
+            ignore_init_read_errors=ignore_init_read_errors,
+            lazy=(ignore == 2))
 
         self.gpg = None
         self.gpg_config = None
+        self._search_index = None
 
 
     # overrider
@@ -105,6 +113,11 @@ class RemoteDB(DbBase):
         '''
         Copy the remote overlay list to the local cache.
 
+        The lists and their detached signatures are downloaded in
+        parallel, up to "fetch_jobs" connections at a time.  Verification
+        and parsing of each list happens in this thread as soon as its
+        download completes.
+
         @rtype tuple: reflects whether the cache has updates and whether or not
         the cache retrieval was successful.
         '''
@@ -114,6 +127,254 @@ class RemoteDB(DbBase):
         succeeded = True
         url_lists = [self.urls, self.detached_urls, self.signed_urls]
         need_gpg = [False, True, True]
+        jobs = []
+
+        for index in range(0, 3):
+            self.output.debug("RemoteDB.cache() index = %s" %str(index), 2)
+            urls = url_lists[index]
+            if need_gpg[index] and len(urls) and self.gpg is None:
+                #initialize our gpg instance
+                self.init_gpg()
+            jobs.extend([(url, need_gpg[index]) for url in urls])
+
+        for url, gpg, result in self._fetch_all(jobs):
+            filepath, mpath, tpath, sig = self._paths(url)
+            success, olist, timestamp, etag, sigtext = result
+            if not success:
+                #succeeded = False
+                continue
+
+            self.output.debug("RemoteDB.cache() len(olist) = %s"
+                % str(len(olist)), 2)
+            # GPG handling
+            if gpg:
+                olist, verified = self.verify_gpg(url, sig, olist, sigtext)
+                if not verified:
+                    self.output.debug("RemoteDB.cache() gpg returned "
+                        "verified = %s" %str(verified), 2)
+                    succeeded = False
+                    filename = os.path.join(self.config['storage'],
+                                            "Failed-to-verify-sig")
+                    self.write_cache(olist, filename)
+                    continue
+
+            # Before we overwrite the old cache, check that the downloaded
+            # file is intact and can be parsed
+            if isinstance(url, tuple):
+                olist = self._check_download(olist, url[0])
+            else:
+                olist = self._check_download(olist, url)
+
+            # Ok, now we can overwrite the old cache, unless the list
+            # came back byte for byte identical
+            if self._is_cached(olist, mpath):
+                self.output.info('Remote list unchanged: %s'
+                    % self._url_str(url), 4)
+                self.write_cache(None, None, tpath, timestamp)
+            else:
+                has_updates = max(has_updates,
+                    self.write_cache(olist, mpath, tpath, timestamp))
+            self._write_etag(filepath + '.etag', etag)
+
+        self.output.debug("RemoteDB.cache() self.urls:  has_updates, "
+            "succeeded %s, %s" % (str(has_updates), str(succeeded)), 4)
+        return has_updates, succeeded
+
+
+    def search_index(self, rebuild=False):
+        '''
+        Returns the layman.search.SearchIndex of the cached lists, reading
+        it from disk unless the lists changed since it was built.
+
+        @param rebuild: build the index again in any case.
+        '''
+        if self._search_index is None or rebuild:
+            index = SearchIndex(self.config['cache'] + '_search.json',
+                                self.output)
+            sources = index.list_stats(self.paths)
+            if rebuild or not index.load(sources):
+                index.build(self.overlays, sources)
+                index.save()
+            self._search_index = index
+        return self._search_index
+
+
+    def update_search_index(self):
+        '''
+        Rebuilds the search index after the lists were updated, if one
+        has been built before.
+        '''
+        if os.path.exists(self.config['cache'] + '_search.json'):
+            self.search_index(rebuild=True)
+
+
+    def save_changes(self, diff):
+        '''
+        Stores the layman.catalog.Catalog.diff() of the last update of the
+        lists next to the list cache.  Failures are only logged.
+        '''
+        path = self.config['cache'] + '_changes.json'
+        try:
+            with atomic_open(path, 'w') as changes:
+                changes.write(json.dumps({'time': time.time(),
+                                          'changes': diff}))
+        except (IOError, OSError) as error:
+            self.output.debug('RemoteDB.save_changes(); failed to write '
+                '"%s": %s' % (path, error), 4)
+
+
+    def last_changes(self):
+        '''
+        Returns the changes stored by save_changes() as a dict with the
+        "time" of the update and the "changes", None if there are none.
+        '''
+        path = self.config['cache'] + '_changes.json'
+        if not os.path.exists(path):
+            return None
+        try:
+            with fileopen(path, 'r') as changes:
+                return json.load(changes)
+        except (IOError, OSError, ValueError) as error:
+            self.output.debug('RemoteDB.last_changes(); ignoring "%s": %s'
+                % (path, error), 4)
+            return None
+
+
+    def _fetch_all(self, jobs):
+        '''
+        Downloads the lists described by jobs using a pool of threads.
+
+        @param jobs: list of (url, need_gpg) tuples
+        @rtype generator of (url, need_gpg, (success, olist, timestamp,
+        etag, sigtext)) tuples in the order the downloads complete, see
+        _fetch_list().
+        '''
+        def fetch(job):
+            url, gpg = job
+            return url, gpg, self._fetch_list(url)
+
+        workers = min(get_jobs(self.config, 'fetch_jobs'), len(jobs))
+        if workers > 1:
+            self.output.debug("RemoteDB._fetch_all() fetching %d lists using "
+                "%d connections" % (len(jobs), workers), 2)
+        return pool_map(fetch, jobs, workers, ordered=False)
+
+
+    def _fetch_list(self, url):
+        '''
+        Downloads a single list and, for detach-signed lists, its signature.
+        Runs in a worker thread, so it must not touch shared state.
+
+        @rtype tuple: (success, olist, timestamp, etag, sigtext)
+        '''
+        self.output.debug("RemoteDB._fetch_list() url = %s is a tuple=%s"
+            %(str(url), str(isinstance(url, tuple))), 2)
+        filepath, mpath, tpath, sig = self._paths(url)
+        sigtext = None
+        if 'file://' in url:
+            success, olist, timestamp = self._fetch_file(url, mpath, tpath)
+            return success, olist, timestamp, None, sigtext
+
+        fetcher = self._get_connector()
+        success, olist, timestamp, etag = self._fetch_url(fetcher,
+            self._url_str(url), mpath, tpath, filepath + '.etag')
+        # only bother with the signature if the list has changed
+        if sig and success:
+            sig_success, sigtext, sig_timestamp = fetcher.fetch_content(
+                url[1], climit=60)
+            if not sig_success:
+                sigtext = None
+        return success, olist, timestamp, etag, sigtext
+
+
+    def _fetch_url(self, fetcher, url, mpath, tpath, epath):
+        '''
+        Conditionally downloads a list, sending the validators (ETag and
+        Last-Modified) stored by the previous fetch so an unchanged list is
+        answered with a "304 Not Modified" and not transferred again.
+
+        @rtype tuple: (success, olist, timestamp, etag), success is False
+        when the list is unchanged or could not be fetched.
+        '''
+        if not hasattr(fetcher, 'connect_url'):
+            # older ssl-fetch, Last-Modified handling only
+            success, olist, timestamp = fetcher.fetch_content(url, tpath,
+                climit=60)
+            return success, olist, timestamp, None
+
+        headers = {'Accept-Charset': 'utf-8', 'User-Agent': USERAGENT}
+        # without a cached copy there is nothing to validate
+        if os.path.exists(mpath):
+            for path, header in ((tpath, 'If-Modified-Since'),
+                                 (epath, 'If-None-Match')):
+                if os.path.exists(path):
+                    with fileopen(path, 'r') as f:
+                        value = f.read().strip()
+                    if value:
+                        headers[header] = value
+
+        self.output.info('Fetching new list... %s' % url, 5)
+        connection = fetcher.connect_url(url, headers, timeout=60)
+        if connection is None:
+            return False, '', '', None
+
+        if connection.status_code == 304:
+            self.output.info('Remote list already up to date: %s' % url, 4)
+            if 'If-Modified-Since' in headers:
+                self.output.info('Last-modified: %s'
+                    % headers['If-Modified-Since'], 4)
+            return False, '', '', None
+
+        if connection.status_code != 200:
+            self.output.error('RemoteDB._fetch_url(); Failed to update the '
+                'overlay list from: %(url)s\nHTTP status was: %(status)s'
+                % {'url': url, 'status': connection.status_code})
+            return False, '', '', None
+
+        timestamp = connection.headers.get('last-modified', '')
+        etag = connection.headers.get('etag')
+        self.output.debug('RemoteDB._fetch_url(), Last-modified: %s, '
+            'ETag: %s' % (timestamp, etag), 2)
+        return True, connection.text, timestamp, etag
+
+
+    @staticmethod
+    def _url_str(url):
+        '''Returns the list url of a plain or (url, sig-url) entry.'''
+        if isinstance(url, tuple):
+            return url[0]
+        return url
+
+
+    @staticmethod
+    def _is_cached(olist, mpath):
+        '''
+        Compares the content hash of the fetched list with the cached copy.
+
+        @rtype bool: True if mpath already holds exactly olist.
+        '''
+        if not os.path.exists(mpath):
+            return False
+        new = hashlib.sha256(encoder(olist, "UTF-8")).hexdigest()
+        old = hashlib.sha256()
+        with open(mpath, 'rb') as cached:
+            for chunk in iter(lambda: cached.read(65536), b''):
+                old.update(chunk)
+        return new == old.hexdigest()
+
+
+    @staticmethod
+    def _write_etag(epath, etag):
+        '''Stores the ETag of a list, dropping a stale one.'''
+        if etag:
+            with fileopen(epath, 'w') as out_file:
+                out_file.write(etag)
+        elif etag is None and os.path.exists(epath):
+            os.unlink(epath)
+
+
+    def _get_connector(self):
+        '''Returns a new ssl-fetch Connector using our output map.'''
         # setup the ssl-fetch output map
         connector_output = {
             'info':  self.output.info,
@@ -129,61 +390,7 @@ class RemoteDB(DbBase):
             'kwargs-error':{'level': None},
             'kwargs-warning': {'level': 2},
         }
-        fetcher = Connector(connector_output, self.proxies, USERAGENT)
-
-        for index in range(0, 3):
-            self.output.debug("RemoteDB.cache() index = %s" %str(index), 2)
-            urls = url_lists[index]
-            if need_gpg[index] and len(urls) and self.gpg is None:
-                #initialize our gpg instance
-                self.init_gpg()
-            # main working loop
-            for url in urls:
-                sig = ''
-                self.output.debug("RemoteDB.cache() url = %s is a tuple=%s"
-                    %(str(url), str(isinstance(url, tuple))), 2)
-                filepath, mpath, tpath, sig = self._paths(url)
-                if 'file://' in url:
-                    success, olist, timestamp = self._fetch_file(
-                        url, mpath, tpath)
-                elif sig:
-                    success, olist, timestamp = fetcher.fetch_content(
-                        url[0], tpath, climit=60)
-                else:
-                    success, olist, timestamp = fetcher.fetch_content(
-                        url, tpath, climit=60)
-                if not success:
-                    #succeeded = False
-                    continue
-
-                self.output.debug("RemoteDB.cache() len(olist) = %s"
-                    % str(len(olist)), 2)
-                # GPG handling
-                if need_gpg[index]:
-                    olist, verified = self.verify_gpg(url, sig, olist)
-                    if not verified:
-                        self.output.debug("RemoteDB.cache() gpg returned "
-                            "verified = %s" %str(verified), 2)
-                        succeeded = False
-                        filename = os.path.join(self.config['storage'],
-                                                "Failed-to-verify-sig")
-                        self.write_cache(olist, filename)
-                        continue
-
-                # Before we overwrite the old cache, check that the downloaded
-                # file is intact and can be parsed
-                if isinstance(url, tuple):
-                    olist = self._check_download(olist, url[0])
-                else:
-                    olist = self._check_download(olist, url)
-
-                # Ok, now we can overwrite the old cache
-                has_updates = max(has_updates,
-                    self.write_cache(olist, mpath, tpath, timestamp))
-
-            self.output.debug("RemoteDB.cache() self.urls:  has_updates, "
-                "succeeded %s, %s" % (str(has_updates), str(succeeded)), 4)
-        return has_updates, succeeded
+        return Connector(connector_output, self.proxies, USERAGENT)
 
 
     def _paths(self, url):
@@ -240,7 +447,7 @@ class RemoteDB(DbBase):
 
         try:
             url_timestamp = os.stat(filepath).st_mtime
-            if url_timestamp != timestamp:
+            if str(url_timestamp) != timestamp:
                 self.output.debug('RemoteDB._fetch_file() opening file', 2)
                 # Fetch the remote list
                 with fileopen(filepath) as connection:
@@ -250,7 +457,8 @@ class RemoteDB(DbBase):
                 self.output.info('Remote list already up to date: %s'
                     % url, 4)
                 self.output.info('Last-modified: %s' % timestamp, 4)
-        except IOError as error:
+                return (False, '', '')
+        except (IOError, OSError) as error:
             self.output.error('RemoteDB._fetch_file(); Failed to update the '
                 'overlay list from: %s\nIOError was:%s\n'
                 % (url, str(error)))
@@ -307,22 +515,28 @@ class RemoteDB(DbBase):
     def write_cache(olist, mpath, tpath=None, timestamp=None):
         has_updates = False
         try:
-            with fileopen(mpath, 'w') as out_file:
-                out_file.write(olist)
+            if mpath is not None:
+                with fileopen(mpath, 'w') as out_file:
+                    out_file.write(olist)
 
             if timestamp is not None and tpath is not None:
                 with fileopen(tpath, 'w') as out_file:
                     out_file.write(str(timestamp))
 
-            has_updates = True
+            has_updates = mpath is not None
 
         except Exception as error:
             raise IOError('Failed to temporarily cache overlays list in'
-                          ' ' + mpath + '\nError was:\n' + str(error))
+                          ' ' + str(mpath or tpath) + '\nError was:\n'
+                          + str(error))
         return has_updates
 
-    def verify_gpg(self, url, sig, olist):
-        '''Verify and decode it.'''
+    def verify_gpg(self, url, sig, olist, sigtext=None):
+        '''Verify and decode it.
+
+        @param sigtext: the already downloaded detached signature, it is
+        fetched from url[1] when None.
+        '''
         self.output.debug("RemoteDB: verify_gpg(), verify & decrypt olist: "
             " %s, type(olist)=%s" % (str(url),str(type(olist))), 2)
         #self.output.debug(olist, 2)
@@ -330,7 +544,10 @@ class RemoteDB(DbBase):
         # detached sig
         if sig:
             self.output.debug("RemoteDB.verify_gpg(), detached sig", 2)
-            self.dl_sig(url[1], sig)
+            if sigtext is None:
+                self.dl_sig(url[1], sig)
+            else:
+                self.write_cache(sigtext, sig)
             gpg_result = self.gpg.verify(
                 inputtxt=olist,
                 inputfile=sig)
@@ -355,7 +572,8 @@ class RemoteDB(DbBase):
 
     def dl_sig(self, url, sig):
         self.output.debug("RemoteDB.dl_sig() url=%s, sig=%s" % (url, sig), 2)
-        success, newsig, timestamp = self._fetch_url(url, sig)
+        success, newsig, timestamp = self._get_connector().fetch_content(
+            url, climit=60)
         if success:
             success = self.write_cache(newsig, sig)
         return success
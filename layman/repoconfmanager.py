@@ -39,6 +39,11 @@ class RepoConfManager:
         self.module_controller = Modules(path=MOD_PATH,
                                          namepath='layman.config_modules',
                                          output=self.output)
+        # config handlers kept for the lifetime of the manager,
+        # {conf_type: handler}
+        self._handlers = {}
+        # config handlers used while batching, {conf_type: handler}
+        self._batch = None
 
         if isinstance(self.conf_types, STR):
             self.conf_types = [x.strip() for x in self.conf_types.split(',')]
@@ -48,6 +53,51 @@ class RepoConfManager:
                 + '\nis required in order to continue...')
 
 
+    def _get_handler(self, types):
+        '''
+        Returns the config handler for the given config type. Handlers
+        marked cacheable are created once and reused, re-reading their
+        file only if it was changed from outside. While batching their
+        writes are deferred.
+
+        @param types: config type module name, e.g. "reposconf".
+        '''
+        if self._batch is not None and types in self._batch:
+            return self._batch[types]
+        conf = self._handlers.get(types)
+        if conf is None:
+            conf = self.module_controller.get_class(types)\
+                                  (self.config, self.overlays)
+            if getattr(conf, 'cacheable', False):
+                self._handlers[types] = conf
+        else:
+            conf.refresh()
+        if self._batch is not None:
+            conf.defer_write = True
+            self._batch[types] = conf
+        return conf
+
+
+    def begin_batch(self):
+        '''
+        Starts deferring all config writes until commit_batch().
+        '''
+        if self._batch is None:
+            self._batch = {}
+
+
+    def commit_batch(self):
+        '''
+        Writes every config changed since begin_batch() once.
+
+        @return list of booleans: represents success or failure per config.
+        '''
+        batch, self._batch = self._batch, None
+        if not batch:
+            return [True]
+        return [batch[types].flush() for types in sorted(batch)]
+
+
     def add(self, overlay):
         '''
         Adds overlay information to the specified config type(s).
@@ -59,8 +109,7 @@ class RepoConfManager:
             results = []
             for types in self.conf_types:
                 types = types.replace('.', '')
-                conf = self.module_controller.get_class(types)\
-                                  (self.config, self.overlays)
+                conf = self._get_handler(types)
                 conf_ok = conf.add(overlay)
                 results.append(conf_ok)
             return results
@@ -79,8 +128,7 @@ class RepoConfManager:
             results = []
             for types in self.conf_types:
                 types = types.replace('.', '')
-                conf = self.module_controller.get_class(types)\
-                                  (self.config, self.overlays)
+                conf = self._get_handler(types)
                 conf_ok = conf.delete(overlay)
                 results.append(conf_ok)
             return results
@@ -98,8 +146,7 @@ class RepoConfManager:
         if self.config['require_repoconfig']:
             for types in self.conf_types:
                 types = types.replace('.', '')
-                conf = self.module_controller.get_class(types)\
-                                  (self.config, self.overlays)
+                conf = self._get_handler(types)
                 conf_ok = conf.disable(overlay)
             return conf_ok
         return True
@@ -116,8 +163,7 @@ class RepoConfManager:
         if self.config['require_repoconfig']:
             for types in self.conf_types:
                 types = types.replace('.', '')
-                conf = self.module_controller.get_class(types)\
-                                  (self.config, self.overlays)
+                conf = self._get_handler(types)
                 conf_ok = conf.enable(overlay)
             return conf_ok
         return True
@@ -134,8 +180,7 @@ class RepoConfManager:
             results = []
             for types in self.conf_types:
                 types = types.replace('.', '')
-                conf = self.module_controller.get_class(types)\
-                                  (self.config, self.overlays)
+                conf = self._get_handler(types)
                 conf_ok = conf.update(overlay)
                 results.append(conf_ok)
             return results
@@ -0,0 +1,226 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#################################################################################
+# LAYMAN SEARCH INDEX
+#################################################################################
+# File:       search.py
+#
+#             Inverted index over the overlays of the remote lists.
+#
+# Copyright:
+#             Distributed under the terms of the GNU General Public License v2
+#
+'''Full text search over the overlays of the remote lists.'''
+
+from __future__ import unicode_literals
+
+#===============================================================================
+#
+# Dependencies
+#
+#-------------------------------------------------------------------------------
+
+import bisect
+import json
+import os
+import re
+
+from  layman.compatibility  import fileopen
+from  layman.utils          import atomic_open
+
+#===============================================================================
+#
+# Constants
+#
+#-------------------------------------------------------------------------------
+
+INDEX_VERSION = 1
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# How much a token found in a field counts towards the rank of a result.
+FIELD_WEIGHTS = (('name', 4), ('description', 2), ('owner', 1),
+                 ('homepage', 1), ('feed', 1))
+
+#===============================================================================
+#
+# Helper functions
+#
+#-------------------------------------------------------------------------------
+
+def tokenize(text):
+    '''
+    Splits text into lower case words.  Text containing separators also
+    yields itself as a whole, so "wrobel-stable" finds that overlay first.
+
+    >>> sorted(tokenize('Gunnar-Wrobel overlay'))
+    ['gunnar', 'gunnar-wrobel', 'overlay', 'wrobel']
+    '''
+    text = text.lower()
+    tokens = set(TOKEN_RE.findall(text))
+    for word in text.split():
+        tokens.add(word.strip('.,;:()[]<>"\''))
+    tokens.discard('')
+    return tokens
+
+
+def _record(overlay):
+    '''
+    Returns the overlay as a dict like Overlay.to_dict(), without building
+    overlays which have not been built yet (see dbbase.LazyOverlay).
+    '''
+    definition = overlay.__dict__.get('_definition')
+    record = definition and definition.get('ovl_dict')
+    if record is not None:
+        return record
+    return overlay.to_dict()
+
+
+def _field_texts(record, field):
+    value = record.get(field)
+    if not value:
+        return []
+    if field == 'owner':
+        return [v for owner in value for v in owner.values() if v]
+    if isinstance(value, (list, tuple)):
+        return value
+    return [value]
+
+#===============================================================================
+#
+# Class SearchIndex
+#
+#-------------------------------------------------------------------------------
+
+class SearchIndex(object):
+    '''
+    Maps the words of the names, descriptions, owners, homepages and feeds
+    of overlays to the overlays containing them.  The index is stored as
+    JSON at path together with the size and mtime of the overlay lists it
+    was built from, so it is only rebuilt after those changed.
+    '''
+
+    def __init__(self, path, output):
+        self.path = path
+        self.output = output
+        self.sources = {}
+        # {token: {overlay name: weight}}
+        self.tokens = {}
+        self._sorted_tokens = []
+
+
+    @staticmethod
+    def list_stats(paths):
+        '''
+        Returns {path: [size, mtime]} of the existing overlay lists.
+        '''
+        stats = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            stats[path] = [stat.st_size, stat.st_mtime]
+        return stats
+
+
+    def build(self, overlays, sources):
+        '''
+        Indexes overlays, a dict {name: overlay}, built from the lists
+        described by sources, see list_stats().
+        '''
+        tokens = {}
+        for name in overlays:
+            record = _record(overlays[name])
+            for field, weight in FIELD_WEIGHTS:
+                for text in _field_texts(record, field):
+                    for token in tokenize(text):
+                        names = tokens.setdefault(token, {})
+                        if names.get(name, 0) < weight:
+                            names[name] = weight
+        self.tokens = tokens
+        self.sources = sources
+        self._sorted_tokens = sorted(tokens)
+        self.output.debug('SearchIndex.build(); %d overlays, %d tokens'
+            % (len(overlays), len(tokens)), 6)
+
+
+    def load(self, sources):
+        '''
+        Reads the stored index if it was built from sources.
+
+        @rtype bool: whether the stored index could be used.
+        '''
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with fileopen(self.path, 'r') as index_file:
+                stored = json.load(index_file)
+        except (IOError, OSError, ValueError) as error:
+            self.output.debug('SearchIndex.load(); ignoring "%s": %s'
+                % (self.path, error), 4)
+            return False
+        if (stored.get('version') != INDEX_VERSION or
+            stored.get('sources') != sources):
+            return False
+        self.tokens = stored['tokens']
+        self.sources = sources
+        self._sorted_tokens = sorted(self.tokens)
+        return True
+
+
+    def save(self):
+        '''
+        Atomically writes the index.  Failures are not fatal, the index
+        will just be built again.
+        '''
+        try:
+            with atomic_open(self.path, 'w') as index_file:
+                index_file.write(json.dumps({'version': INDEX_VERSION,
+                                             'sources': self.sources,
+                                             'tokens': self.tokens}))
+        except (IOError, OSError) as error:
+            self.output.debug('SearchIndex.save(); failed to write "%s": %s'
+                % (self.path, error), 4)
+
+
+    def _matches(self, term):
+        '''
+        Returns {overlay name: weight} of the tokens starting with term,
+        a complete token weighing twice as much.
+        '''
+        found = {}
+        start = bisect.bisect_left(self._sorted_tokens, term)
+        for token in self._sorted_tokens[start:]:
+            if not token.startswith(term):
+                break
+            factor = 2 if token == term else 1
+            for name, weight in self.tokens[token].items():
+                weight *= factor
+                if found.get(name, 0) < weight:
+                    found[name] = weight
+        return found
+
+
+    def search(self, text):
+        '''
+        Returns the names of the overlays containing words starting with
+        every word of text, best matches first.
+
+        @rtype list of strings
+        '''
+        terms = sorted(tokenize(text))
+        if not terms:
+            return []
+        scores = None
+        for term in terms:
+            found = self._matches(term)
+            if scores is None:
+                scores = found
+            else:
+                scores = dict((name, score + found[name])
+                              for name, score in scores.items()
+                              if name in found)
+            if not scores:
+                return []
+        return sorted(scores, key=lambda name: (-scores[name], name))
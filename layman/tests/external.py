@@ -19,9 +19,11 @@ from __future__ import unicode_literals
 
 '''Runs external (non-doctest) test cases.'''
 
+import io
 import os
 import sys
 import shutil
+import subprocess
 import tempfile
 import unittest
 import xml.etree.ElementTree as ET # Python 2.5
@@ -33,8 +35,10 @@ except ImportError:
 
 from  layman.argsparser       import ArgsParser
 from  layman.api              import LaymanAPI
+from  layman.catalog          import Catalog
+from  layman.cli              import ListPrinter
 from  layman.db               import DB
-from  layman.dbbase           import DbBase
+from  layman.dbbase           import DbBase, LazyOverlay
 from  layman.compatibility    import fileopen
 from  layman.config           import BareConfig, OptionConfig
 from  layman.maker            import Interactive
@@ -42,7 +46,9 @@ from  layman.output           import Message
 from  layman.overlays.overlay import Overlay
 from  layman.remotedb         import RemoteDB
 from  layman.repoconfmanager  import RepoConfManager
-from  layman.utils            import path
+from  layman.search           import SearchIndex
+from  layman.utils            import clear_command_cache, get_jobs, path, \
+                                    pool_map, resolve_command
 from  warnings import filterwarnings, resetwarnings
 
 encoding = sys.getdefaultencoding()
@@ -203,6 +209,24 @@ class AddDeleteDB(unittest.TestCase):
         conf = RepoConfManager(config, b.overlays)
         self.assertEqual(conf.overlays, {})
 
+        # Batched changes are only written out once the batch ends.
+        with b.batch():
+            b.add(a.select(repo_name))
+            c = DbBase(config, paths=[db_file,])
+            self.assertEqual(c.overlays, {})
+            with fileopen(repo_conf, 'r') as f:
+                self.assertFalse(repo_name in f.read())
+
+        c = DbBase(config, paths=[db_file,])
+        self.assertEqual(list(c.overlays), ['tar_test_overlay'])
+        with fileopen(repo_conf, 'r') as f:
+            self.assertTrue(repo_name in f.read())
+
+        with b.batch():
+            b.delete(b.select(repo_name))
+        c = DbBase(config, paths=[db_file,])
+        self.assertEqual(c.overlays, {})
+
         # Clean up.
         os.unlink(temp_xml_path)
         os.unlink(temp_tarball_path)
@@ -307,9 +331,19 @@ class ArchiveAddRemoveSync(unittest.TestCase):
             # Actual testcase
             o.add(temp_dir_path)
             self.assertTrue(os.path.exists(specific_overlay_path))
+            meta_path = os.path.join(temp_dir_path,
+                                     '.%s.archive.json' % repo_name)
+            self.assertTrue(os.path.exists(meta_path))
+            if archive == 'tar':
+                # An unchanged archive is not extracted again.
+                marker = os.path.join(specific_overlay_path, 'marker')
+                with fileopen(marker, 'w') as f:
+                    f.write('unchanged')
             # (1/2) Sync with source available
             o.sync(temp_dir_path)
             self.assertTrue(os.path.exists(specific_overlay_path))
+            if archive == 'tar':
+                self.assertTrue(os.path.exists(marker))
             os.unlink(temp_archive_path)
             try:
                 # (2/2) Sync with source _not_ available
@@ -319,12 +353,339 @@ class ArchiveAddRemoveSync(unittest.TestCase):
             self.assertTrue(os.path.exists(specific_overlay_path))
             o.delete(temp_dir_path)
             self.assertFalse(os.path.exists(specific_overlay_path))
+            self.assertFalse(os.path.exists(meta_path))
 
             # Cleanup
             os.unlink(temp_collection_path)
             os.rmdir(temp_dir_path)
 
 
+    def test_downloaded_image(self):
+        try:
+            from layman.overlays.modules.squashfs.squashfs import SquashfsOverlay
+        except ImportError:
+            return
+        image = os.path.join(HERE, 'testfiles', 'layman-test.squashfs')
+        repo = ET.fromstring(
+            '<repo><name>download</name><description>Test</description>'
+            '<owner><email>foo@example.org</email></owner>'
+            '<source type="squashfs">https://example.org/download.squashfs'
+            '</source></repo>')
+        source = Overlay(BareConfig(), xml=repo).sources[0]
+        self.assertTrue(source.clean_archive)
+        requests = []
+        def download(url, pkg, meta):
+            requests.append(meta)
+            if meta:
+                # Not modified
+                return None
+            shutil.copyfile(image, pkg)
+            return {'etag': '"v1"'}
+        source._download = download
+        mounted = []
+        source.post_fetch = lambda pkg, dest: mounted.append(pkg) or 0
+        tmpdir = tempfile.mkdtemp(prefix='laymantmp_')
+        pkg = os.path.join(tmpdir, 'download.squashfs')
+        try:
+            # The downloaded image is what gets mounted, now and on
+            # --restore, so it is kept.
+            self.assertEqual(source._add_unchecked(tmpdir), 0)
+            self.assertEqual(mounted, [pkg])
+            self.assertTrue(os.path.exists(pkg))
+
+            # An unchanged image is mounted again if it is not mounted.
+            meta = source._read_meta(tmpdir)
+            self.assertEqual(meta['etag'], '"v1"')
+            self.assertEqual(source._add_unchecked(tmpdir, meta=meta), 0)
+            self.assertEqual(mounted, [pkg, pkg])
+            self.assertEqual(source._read_meta(tmpdir), meta)
+            # and downloaded again if it is gone.
+            os.unlink(pkg)
+            self.assertEqual(source._add_unchecked(tmpdir, meta=meta), 0)
+            self.assertEqual(requests, [None, meta, None])
+            self.assertEqual(mounted, [pkg, pkg, pkg])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class ArchiveDownload(unittest.TestCase):
+
+    def test(self):
+        import hashlib
+        tarball = os.path.join(HERE, 'testfiles', 'layman-test.tar.bz2')
+        with open(tarball, 'rb') as f:
+            sha256 = hashlib.sha256(f.read()).hexdigest()
+        url = 'file://' + urllib.pathname2url(tarball)
+        tmpdir = tempfile.mkdtemp(prefix='laymantmp_')
+        pkg = os.path.join(tmpdir, 'download.tar.bz2')
+
+        def source(attrs):
+            repo = ET.fromstring(
+                '<repo><name>download</name><description>Test</description>'
+                '<owner><email>foo@example.org</email></owner>'
+                '<source type="tar"%s>%s</source></repo>' % (attrs, url))
+            return Overlay(BareConfig(), xml=repo).sources[0]
+
+        # A stale partial download is replaced when the server does not
+        # resume it.
+        with open(pkg + '.partial', 'wb') as f:
+            f.write(b'stale')
+        source(' sha256="%s" size="%d"' % (sha256, os.path.getsize(tarball))
+               )._download(url, pkg)
+        self.assertFalse(os.path.exists(pkg + '.partial'))
+        with open(pkg, 'rb') as f:
+            self.assertEqual(hashlib.sha256(f.read()).hexdigest(), sha256)
+        os.unlink(pkg)
+
+        self.assertRaises(Exception, source(' sha256="%s"' % ('0' * 64))
+                          ._download, url, pkg)
+        self.assertFalse(os.path.exists(pkg))
+        self.assertFalse(os.path.exists(pkg + '.partial'))
+
+        shutil.rmtree(tmpdir)
+
+
+    def test_new_validators(self):
+        tarball = os.path.join(HERE, 'testfiles', 'layman-test.tar.bz2')
+        repo = ET.fromstring(
+            '<repo><name>download</name><description>Test</description>'
+            '<owner><email>foo@example.org</email></owner>'
+            '<source type="tar">https://example.org/download.tar.bz2'
+            '</source></repo>')
+        source = Overlay(BareConfig(), xml=repo).sources[0]
+        etags = ['"v1"', '"v2"']
+        requests = []
+        def download(url, pkg, meta):
+            # The server rotates its ETag, the archive stays the same.
+            requests.append(meta and meta.get('etag'))
+            shutil.copyfile(tarball, pkg)
+            return {'etag': etags.pop(0)}
+        source._download = download
+        tmpdir = tempfile.mkdtemp(prefix='laymantmp_')
+        try:
+            self.assertEqual(source._add_unchecked(tmpdir), 0)
+            meta = source._read_meta(tmpdir)
+            marker = os.path.join(tmpdir, 'download', 'marker')
+            with open(marker, 'w') as f:
+                f.write('unchanged')
+            self.assertEqual(source._add_unchecked(tmpdir, meta=meta), None)
+            self.assertTrue(os.path.exists(marker))
+            self.assertEqual(requests, [None, '"v1"'])
+            # The new ETag is sent next time.
+            new_meta = source._read_meta(tmpdir)
+            self.assertEqual(new_meta, dict(meta, etag='"v2"'))
+            self.assertFalse(os.path.exists(
+                os.path.join(tmpdir, 'download.tar.bz2')))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+    @unittest.skipIf(sys.hexversion < 0x30000f0, 'needs http.server')
+    def test_resume(self):
+        import json
+        import threading
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        tarball = os.path.join(HERE, 'testfiles', 'layman-test.tar.bz2')
+        with open(tarball, 'rb') as f:
+            body = f.read()
+        served = {'etag': '"v1"', 'statuses': []}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                start = 0
+                if (self.headers.get('Range') and
+                    self.headers.get('If-Range') == served['etag']):
+                    start = int(self.headers['Range'][6:-1])
+                    status = 206 if start < len(body) else 416
+                else:
+                    status = 200
+                served['statuses'].append(status)
+                self.send_response(status)
+                self.send_header('ETag', served['etag'])
+                self.send_header('Content-Length',
+                                 str(max(len(body) - start, 0)))
+                self.end_headers()
+                if status != 416:
+                    self.wfile.write(body[start:])
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        url = 'http://127.0.0.1:%d/layman-test.tar.bz2' % server.server_port
+        tmpdir = tempfile.mkdtemp(prefix='laymantmp_')
+        pkg = os.path.join(tmpdir, 'download.tar.bz2')
+        partial = pkg + '.partial'
+        repo = ET.fromstring(
+            '<repo><name>download</name><description>Test</description>'
+            '<owner><email>foo@example.org</email></owner>'
+            '<source type="tar">%s</source></repo>' % url)
+        source = Overlay(BareConfig(), xml=repo).sources[0]
+
+        def download(data, etag):
+            with open(partial, 'wb') as f:
+                f.write(data)
+            if etag:
+                with open(partial + '.json', 'w') as f:
+                    f.write(json.dumps({'url': url, 'etag': etag}))
+            del served['statuses'][:]
+            self.assertEqual(source._download(url, pkg), {'etag': '"v1"'})
+            self.assertFalse(os.path.exists(partial))
+            self.assertFalse(os.path.exists(partial + '.json'))
+            with open(pkg, 'rb') as f:
+                self.assertEqual(f.read(), body)
+            os.unlink(pkg)
+            return served['statuses']
+
+        try:
+            # Resumed from the same version of the archive
+            self.assertEqual(download(body[:100], '"v1"'), [206])
+            # Started from another version: downloaded again
+            self.assertEqual(download(b'stale', '"v0"'), [200])
+            # Nothing to validate the partial with: not resumed
+            self.assertEqual(download(body[:100], None), [200])
+            # Range not satisfiable: started over
+            self.assertEqual(download(body + b'junk', '"v1"'), [416, 200])
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            shutil.rmtree(tmpdir)
+
+
+class AsyncRunCommand(unittest.TestCase):
+
+    @unittest.skipIf(sys.hexversion < 0x30700f0, 'needs asyncio.run()')
+    def test(self):
+        import asyncio
+        from layman.asyncutils import async_run_command
+        from layman.overlays.source import OverlaySource
+        from layman.utils import run_command
+
+        config = {'output': Message(), 'quiet': True, 'stderr': None}
+
+        result = asyncio.run(async_run_command(config, 'echo', ['layman'],
+                                               capture=True))
+        self.assertEqual((result.returncode, result.stdout),
+                         (0, b'layman\n'))
+
+        result = asyncio.run(async_run_command(config, 'sleep', ['10'],
+                                               timeout=0.2))
+        self.assertTrue(result.timed_out)
+        self.assertNotEqual(result.returncode, 0)
+
+        # run_command() calls made by the overlay types go through the loop.
+        class Parent(object):
+            name = 'async-test'
+
+        class Source(OverlaySource):
+            def add(self, base):
+                OverlaySource.add(self, base)
+                return run_command(self.config, 'sh', ['-c', 'exit 3'])
+
+        tmpdir = tempfile.mkdtemp(prefix='laymantmp_')
+        source = Source(Parent(), config, 'async-test')
+        self.assertEqual(asyncio.run(source.async_add(tmpdir)), 3)
+        self.assertTrue(os.path.isdir(os.path.join(tmpdir, 'async-test')))
+        shutil.rmtree(tmpdir)
+
+
+class CatalogDiff(unittest.TestCase):
+
+    def test(self):
+        config = {'output': Message(),
+                  'db_type': 'xml',
+                  'svn_command': '/usr/bin/svn',
+                  'rsync_command':'/usr/bin/rsync'}
+        db = DbBase(config, [HERE + '/testfiles/global-overlays.xml', ])
+        records = dict((name, db.select(name).to_dict())
+                       for name in db.list_ids())
+
+        def catalog(records):
+            return Catalog(dict((name, LazyOverlay(config, ovl_dict=record))
+                                for name, record in records.items()))
+
+        old = catalog(records)
+        self.assertEqual(old.diff(old), {'added': [], 'removed': [],
+            'renamed': {}, 'source_changed': {}, 'type_changed': {}})
+
+        changed = {}
+        changed['wrobel'] = dict(records['wrobel'],
+            source=[('git://example.org/wrobel.git', 'git', '')])
+        changed['wrobel-next'] = dict(records['wrobel-stable'],
+                                      name='wrobel-next')
+        changed['fresh'] = dict(records['wrobel-stable'], name='fresh',
+            source=[('rsync://example.org/fresh', 'rsync', '')])
+        new = catalog(changed)
+
+        diff = old.diff(new)
+        self.assertEqual(diff['added'], ['fresh'])
+        self.assertEqual(diff['removed'], [])
+        self.assertEqual(diff['renamed'], {'wrobel-stable': 'wrobel-next'})
+        self.assertEqual(diff['source_changed'], {'wrobel': [
+            ['https://overlays.gentoo.org/svn/dev/wrobel'],
+            ['git://example.org/wrobel.git']]})
+        self.assertEqual(diff['type_changed'],
+                         {'wrobel': [['svn'], ['git']]})
+
+        # What sync() has to look at, compared to the installed overlays.
+        self.assertEqual(old.drift(new), {'wrobel': (True, True)})
+        self.assertEqual(old.drift(old), {})
+
+
+class CatalogQuery(unittest.TestCase):
+
+    def test(self):
+        config = {'output': Message(),
+                  'db_type': 'xml',
+                  'svn_command': '/usr/bin/svn',
+                  'rsync_command':'/usr/bin/rsync'}
+        db = DbBase(config, [HERE + '/testfiles/global-overlays.xml', ])
+        catalog = db.catalog()
+
+        self.assertEqual(catalog.names, ['wrobel', 'wrobel-stable'])
+        self.assertEqual(catalog.types, [('svn',), ('rsync',)])
+        self.assertEqual(catalog.select_names(type='rsync'),
+                         ['wrobel-stable'])
+        self.assertEqual(catalog.select_names(official=True, type='svn'),
+                         ['wrobel'])
+        self.assertEqual(catalog.select_names(sort='priority', reverse=True),
+                         ['wrobel-stable', 'wrobel'])
+        self.assertEqual(catalog.select_names(
+            priority=lambda p: p > 20), ['wrobel-stable'])
+        self.assertEqual(catalog.select_names(
+            status=None, quality=['experimental', 'core']),
+            ['wrobel', 'wrobel-stable'])
+        self.assertRaises(ValueError, catalog.select, colour='blue')
+
+        # Only the selected rows get formatted.
+        listed = db.list(rows=catalog.select(type='svn'), width=80)
+        self.assertEqual(len(listed), 1)
+        self.assertTrue(listed[0][0].startswith(b'wrobel '))
+        self.assertEqual(listed[0][2], True)
+
+        # The catalog is kept until the overlays change.
+        self.assertTrue(db.catalog() is catalog)
+        db.overlays.pop('wrobel')
+        self.assertEqual(db.catalog().names, ['wrobel-stable'])
+        # or one of them is changed in place.
+        db.select('wrobel-stable').set_priority(5)
+        db.overlays.touch()
+        self.assertEqual(db.catalog().priorities, [5])
+
+        # Overlays not built yet are read from their definition.
+        record = DbBase(config, [HERE + '/testfiles/global-overlays.xml', ])\
+            .select('wrobel').to_dict()
+        lazy = LazyOverlay(config, ovl_dict=record)
+        lazy_catalog = Catalog({'wrobel': lazy})
+        self.assertEqual(lazy_catalog.select_names(official=True,
+                                                   type='svn'), ['wrobel'])
+        self.assertEqual(lazy_catalog.priorities, [10])
+        self.assertTrue(lazy.__dict__['_overlay'] is None)
+
+
 class CLIArgs(unittest.TestCase):
 
     def test(self):
@@ -346,22 +707,26 @@ class CLIArgs(unittest.TestCase):
                      'custom_news_pkg', 'cvs_addopts', 'cvs_command',
                      'cvs_postsync', 'cvs_syncopts', 'darcs_addopts',
                      'darcs_command', 'darcs_postsync', 'darcs_syncopts',
-                     'db_type', 'g-common_command', 'g-common_generateopts',
-                     'g-common_postsync', 'g-common_syncopts',
+                     'db_type', 'fetch_jobs', 'g-common_command',
+                     'g-common_generateopts', 'g-common_postsync',
+                     'g-common_syncopts',
                      'g-sorcery_command', 'g-sorcery_generateopts',
                      'g-sorcery_postsync', 'g-sorcery_syncopts', 'git_addopts',
-                     'git_command', 'git_email', 'git_postsync', 'git_syncopts',
-                     'git_user', 'gpg_detached_lists', 'gpg_signed_lists',
-                     'http_proxy', 'https_proxy', 'installed', 'local_list',
+                     'git_clone_depth', 'git_clone_filter', 'git_command',
+                     'git_email', 'git_mirror_dir', 'git_postsync',
+                     'git_single_branch',
+                     'git_syncopts', 'git_user', 'gpg_detached_lists', 'gpg_signed_lists',
+                     'http_proxy', 'https_proxy', 'incremental_archive_sync',
+                     'installed', 'local_list',
                      'make_conf', 'mercurial_addopts', 'mercurial_command',
-                     'mercurial_postsync', 'mercurial_syncopts',
+                     'mercurial_postsync', 'mercurial_syncopts', 'mount_state',
                      'news_reporter', 'nocheck', 'overlay_defs', 'overlays',
                      'protocol_filter', 'quietness', 'repos_conf',
                      'require_repoconfig', 'rsync_command', 'rsync_postsync',
                      'rsync_syncopts', 'squashfs_addopts', 'squashfs_command',
                      'squashfs_postsync', 'squashfs_syncopts', 'storage',
                      'support_url_updates', 'svn_addopts', 'svn_command',
-                     'svn_postsync', 'svn_syncopts', 't/f_options',
+                     'svn_postsync', 'svn_syncopts', 'sync_jobs', 't/f_options',
                      'tar_command', 'tar_postsync', 'umask', 'width']
         # Due to this not being a dict object, the keys() invocation is needed.
         self.assertEqual(sorted(a.keys()), test_keys)
@@ -467,6 +832,93 @@ class FetchRemoteList(unittest.TestCase):
         shutil.rmtree(tmpdir)
 
 
+    @unittest.skipIf(sys.hexversion < 0x30000f0, 'needs http.server')
+    def test_http(self):
+        import threading
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+        from urllib.error import HTTPError
+        from urllib.request import Request, urlopen
+        with open(HERE + '/testfiles/global-overlays.xml', 'rb') as f:
+            body = f.read()
+        requests = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                requests.append(dict(self.headers))
+                if self.headers.get('If-None-Match') == '"v1"':
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/xml; charset=utf-8')
+                self.send_header('ETag', '"v1"')
+                self.send_header('Last-Modified',
+                                 'Sat, 01 Jan 2000 00:00:00 GMT')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Response(object):
+            # The parts of a requests.Response used by _fetch_url()
+            def __init__(self, status_code, headers, content):
+                self.status_code = status_code
+                self.headers = dict((k.lower(), v) for k, v in headers)
+                self.content = content
+                self.text = content.decode('UTF-8')
+
+        class Fetcher(object):
+            # ssl-fetch Connector talking to the test server
+            timeouts = []
+            def connect_url(self, url, headers, timeout=None):
+                self.timeouts.append(timeout)
+                try:
+                    reply = urlopen(Request(url, headers=headers),
+                                    timeout=timeout)
+                except HTTPError as error:
+                    return Response(error.code, error.headers.items(), b'')
+                with reply:
+                    return Response(reply.status, reply.headers.items(),
+                                    reply.read())
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        url = 'http://127.0.0.1:%d/repositories.xml' % server.server_port
+        tmpdir = tempfile.mkdtemp(prefix='laymantmp_')
+        config = OptionConfig({'overlays': [url],
+                               'cache': os.path.join(tmpdir, 'cache'),
+                               'nocheck': 'yes', 'proxy': None})
+        try:
+            db = RemoteDB(config, ignore_init_read_errors=True)
+            filepath, mpath, tpath, sig = db._paths(url)
+            epath = filepath + '.etag'
+
+            success, olist, timestamp, etag = db._fetch_url(Fetcher(), url,
+                mpath, tpath, epath)
+            self.assertTrue(success)
+            self.assertEqual(olist, body.decode('UTF-8'))
+            self.assertEqual((timestamp, etag),
+                             ('Sat, 01 Jan 2000 00:00:00 GMT', '"v1"'))
+            self.assertFalse(db._is_cached(olist, mpath))
+            db.write_cache(olist, mpath, tpath, timestamp)
+            db._write_etag(epath, etag)
+            self.assertTrue(db._is_cached(olist, mpath))
+
+            # The stored validators make the next fetch conditional.
+            self.assertEqual(db._fetch_url(Fetcher(), url, mpath, tpath,
+                                           epath), (False, '', '', None))
+            self.assertEqual(requests[-1].get('If-None-Match'), '"v1"')
+            self.assertEqual(Fetcher.timeouts, [60, 60])
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            shutil.rmtree(tmpdir)
+
+
 class FormatBranchCategory(unittest.TestCase):
     def _run(self, number):
         #config = {'output': Message()}
@@ -496,6 +948,151 @@ class FormatBranchCategory(unittest.TestCase):
         self.assertTrue(os1 == os2)
 
 
+class GitShallowClone(unittest.TestCase):
+
+    def _git(self, cwd, *args):
+        env = dict(os.environ, GIT_AUTHOR_NAME='layman',
+                   GIT_AUTHOR_EMAIL='layman@localhost',
+                   GIT_COMMITTER_NAME='layman',
+                   GIT_COMMITTER_EMAIL='layman@localhost')
+        return subprocess.check_output(['git'] + list(args), cwd=cwd,
+                                       env=env).decode('utf-8').strip()
+
+    def _commit(self, text):
+        with fileopen(os.path.join(self.upstream, 'file'), 'w') as f:
+            f.write(text)
+        self._git(self.upstream, 'add', 'file')
+        self._git(self.upstream, 'commit', '-q', '-m', text)
+
+    def _overlay(self, config, attrs=''):
+        repo = ET.fromstring(
+            '<repo quality="experimental" status="unofficial">'
+            '<name>shallow</name><description>Test</description>'
+            '<owner><email>foo@example.org</email></owner>'
+            '<source type="git"%s>file://%s</source></repo>'
+            % (attrs, urllib.pathname2url(self.upstream)))
+        return Overlay(config, xml=repo)
+
+    def setUp(self):
+        try:
+            self._git(None, '--version')
+        except (OSError, subprocess.CalledProcessError):
+            self.skipTest('git is not available')
+        self.tmpdir = tempfile.mkdtemp(prefix='laymantmp_')
+        self.upstream = os.path.join(self.tmpdir, 'upstream')
+        os.mkdir(self.upstream)
+        self._git(self.upstream, 'init', '-q')
+        for text in ('one', 'two', 'three'):
+            self._commit(text)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test(self):
+        config = BareConfig(quiet=True)
+        ovl = self._overlay(config, ' depth="1"')
+        self.assertEqual(ovl.sources[0].options, {'depth': '1'})
+        self.assertEqual(ovl.to_xml().find('source').attrib['depth'], '1')
+        self.assertEqual(Overlay(config, ovl_dict=ovl.to_dict())
+                         .sources[0].options, {'depth': '1'})
+
+        self.assertEqual(ovl.add(self.tmpdir), 0)
+        target = os.path.join(self.tmpdir, 'shallow')
+        self.assertEqual(self._git(target, 'rev-list', '--count', 'HEAD'), '1')
+
+        self._commit('four')
+        # git pull options do not get passed to the fetch.
+        config.set_option('git_syncopts', '--ff-only')
+        self.assertEqual(ovl.sync(self.tmpdir), 0)
+        self.assertEqual(self._git(target, 'rev-parse', 'HEAD'),
+                         self._git(self.upstream, 'rev-parse', 'HEAD'))
+        self.assertEqual(self._git(target, 'rev-list', '--count', 'HEAD'), '1')
+        self.assertEqual(self._git(target, 'config', 'user.name'), '"layman"')
+
+    def test_mirror(self):
+        mirrors = os.path.join(self.tmpdir, 'mirrors')
+        config = BareConfig(quiet=True)
+        config.set_option('git_mirror_dir', mirrors)
+
+        for base in ('a', 'b'):
+            base = os.path.join(self.tmpdir, base)
+            os.mkdir(base)
+            self.assertEqual(self._overlay(config).add(base), 0)
+            # The checkout does not depend on the mirror.
+            alternates = os.path.join(base, 'shallow', '.git', 'objects',
+                                      'info', 'alternates')
+            self.assertFalse(os.path.exists(alternates))
+        self.assertEqual(len(os.listdir(mirrors)), 1)
+
+        self._commit('four')
+        for base in ('b', 'a'):
+            if base == 'a':
+                # Nor does syncing it once the mirror is gone.
+                shutil.rmtree(mirrors)
+            target = os.path.join(self.tmpdir, base, 'shallow')
+            self.assertEqual(self._overlay(config).sync(
+                os.path.join(self.tmpdir, base)), 0)
+            self.assertEqual(self._git(target, 'log', '--format=%s', '-1'),
+                             'four')
+        self.assertEqual(self._git(target, 'fsck', '--no-progress'), '')
+
+        # An unusable mirror dir falls back to cloning from the source.
+        blocker = os.path.join(self.tmpdir, 'blocker')
+        with fileopen(blocker, 'w') as f:
+            f.write('')
+        config.set_option('git_mirror_dir', os.path.join(blocker, 'mirrors'))
+        base = os.path.join(self.tmpdir, 'c')
+        os.mkdir(base)
+        self.assertEqual(self._overlay(config).add(base), 0)
+        self.assertEqual(self._git(os.path.join(base, 'shallow'), 'log',
+                                   '--format=%s', '-1'), 'four')
+
+
+class LazyDbBase(unittest.TestCase):
+
+    def test(self):
+        config = {'output': Message(),
+                  'db_type': 'xml',
+                  'svn_command': '/usr/bin/svn',
+                  'rsync_command':'/usr/bin/rsync'}
+        eager = DbBase(config, [HERE + '/testfiles/global-overlays.xml', ])
+        lazy = DbBase(config, [HERE + '/testfiles/global-overlays.xml', ],
+                      lazy=True)
+
+        self.assertEqual(lazy.list_ids(), eager.list_ids())
+        ovl = lazy.select('wrobel-stable')
+        # Nothing but the name is known until the overlay is used.
+        self.assertEqual(ovl.name, 'wrobel-stable')
+        self.assertTrue(ovl.__dict__['_overlay'] is None)
+
+        url = ['rsync://gunnarwrobel.de/wrobel-stable']
+        self.assertEqual(list(ovl.source_uris()), url)
+        self.assertFalse(ovl.__dict__['_overlay'] is None)
+        self.assertEqual(lazy.list(verbose=True), eager.list(verbose=True))
+        self.assertTrue(lazy == eager)
+
+
+class ListPrinterStream(unittest.TestCase):
+
+    def test(self):
+        config = {'output': Message(),
+                  'db_type': 'xml',
+                  'svn_command': '/usr/bin/svn',
+                  'rsync_command':'/usr/bin/rsync'}
+        db = DbBase(config, [HERE + '/testfiles/global-overlays.xml', ])
+        out = io.StringIO()
+        printer = ListPrinter({'output': Message(out=out, err=out, col=False),
+                               'width': 70, 'verbose': False})
+
+        rows = db.iter_list(width=printer.width)
+        self.assertEqual(next(rows)[0], db.list(width=70)[0][0])
+        # The generator is printed as it goes, one line per overlay.
+        self.assertEqual(printer.print_shortlist(rows, complain=True), 1)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].endswith('(rsync://gunnarwrobel.de/...)'))
+
+
 class MakeOverlayXML(unittest.TestCase):
 
     def test(self):
@@ -589,6 +1186,136 @@ class OverlayObjTest(unittest.TestCase):
         self.getshortlist()
 
 
+class ModuleRegistry(unittest.TestCase):
+
+    def test(self):
+        from multiprocessing.pool import ThreadPool
+        import layman.module
+        from layman.dbbase import MOD_PATH as db_path
+        from layman.module import Modules
+        from layman.overlays.overlay import MOD_PATH
+
+        first = Modules(path=MOD_PATH, namepath='layman.overlays.modules')
+        # Same directory, spelled differently
+        second = Modules(path=os.path.join(MOD_PATH, '.'),
+                         namepath='layman.overlays.modules')
+        self.assertTrue(first._modules is second._modules)
+        self.assertTrue(first._modules['tar'] is second._modules['tar'])
+        self.assertTrue(first.get_class('tar') is second.get_class('tar'))
+
+        other = Modules(path=db_path, namepath='layman.db_modules')
+        self.assertFalse(other._modules is first._modules)
+        self.assertTrue('xml_db' in other.module_names)
+        self.assertFalse('tar' in other.module_names)
+
+        # Concurrently created instances still share one scan.
+        key = (os.path.realpath(db_path), 'layman.db_modules')
+        del layman.module._registry[key]
+        pool = ThreadPool(8)
+        try:
+            created = pool.map(lambda i: Modules(path=db_path,
+                namepath='layman.db_modules'), range(16))
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(len(set(id(m._modules) for m in created)), 1)
+        self.assertTrue(layman.module._registry[key] is created[0]._modules)
+
+
+class MounterLookup(unittest.TestCase):
+
+    def test(self):
+        from layman.mounter import Mounter, read_mount_points
+        config = {'output': Message(),
+                  'db_type': 'xml',
+                  'storage': HERE,
+                  'svn_command': '/usr/bin/svn',
+                  'rsync_command':'/usr/bin/rsync'}
+        db = DbBase(config, [HERE + '/testfiles/global-overlays.xml', ])
+        mounter = Mounter(lambda: db, db.list_ids, config=config)
+
+        installed = mounter._lookup()[0]
+        self.assertEqual(sorted(installed), ['wrobel', 'wrobel-stable'])
+        self.assertEqual(mounter.mountables, {})
+        # Nothing is selected again until the db changes.
+        self.assertTrue(mounter._lookup()[0] is installed)
+        db.overlays['wrobel-testing'] = db.overlays['wrobel-stable']
+        self.assertEqual(sorted(mounter.installed),
+                         ['wrobel', 'wrobel-stable', 'wrobel-testing'])
+
+        (fd, mountinfo) = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.write('22 1 8:1 / / rw,relatime - ext4 /dev/sda1 rw\n'
+                    '36 22 7:0 / /var/lib/layman/my\\040overlay ro - '
+                    'squashfs /dev/loop0 ro\n')
+        self.assertEqual(read_mount_points(mountinfo),
+                         set(['/', '/var/lib/layman/my overlay']))
+        os.unlink(mountinfo)
+        self.assertEqual(read_mount_points(mountinfo), None)
+
+        # Recorded mounts are restored, missing images are reported.
+        tmpdir = tempfile.mkdtemp(prefix='laymantmp_')
+        config = BareConfig(output=Message(), read_configfile=False)
+        config.set_option('storage', tmpdir)
+        config.set_option('mount_state', os.path.join(tmpdir, 'state.json'))
+        mounter = Mounter(lambda: db, db.list_ids, config=config)
+        mounted = []
+        mounter._run_mount_command = lambda command, args, mdir: \
+            mounted.append((command, args)) or 0
+        image = os.path.join(tmpdir, 'a.squashfs')
+        with open(image, 'wb') as f:
+            f.write(b'hsqs')
+        mounter._record('a', {'type': 'Squashfs', 'pkg': image,
+                              'dest': os.path.join(tmpdir, 'a')})
+        mounter._record('b', {'type': 'Squashfs', 'pkg': image + '.gone',
+                              'dest': os.path.join(tmpdir, 'b')})
+        self.assertEqual(sorted(mounter._read_state()), ['a', 'b'])
+
+        self.assertEqual(mounter.restore(), 1)
+        self.assertEqual(mounted, [('mount', ['-o', 'loop', '-t', 'squashfs',
+                                    image, os.path.join(tmpdir, 'a')])])
+        mounter._record('b', None)
+        self.assertEqual(sorted(mounter._read_state()), ['a'])
+
+        # Overlays mounted by concurrent syncs are all recorded.
+        from multiprocessing.pool import ThreadPool
+        names = ['ovl%d' % i for i in range(32)]
+        pool = ThreadPool(8)
+        try:
+            pool.map(lambda ovl: mounter._record(ovl, {'type': 'Squashfs',
+                'pkg': image, 'dest': os.path.join(tmpdir, ovl)}), names)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(sorted(mounter._read_state()), sorted(names + ['a']))
+        shutil.rmtree(tmpdir)
+
+
+class OverlayDictIds(unittest.TestCase):
+
+    def test(self):
+        config = {'output': Message(),
+                  'db_type': 'xml',
+                  'svn_command': '/usr/bin/svn',
+                  'rsync_command':'/usr/bin/rsync'}
+        db = DbBase(config, [HERE + '/testfiles/global-overlays.xml', ])
+        ids = db.list_ids()
+        revision = db.overlays.revision
+
+        self.assertEqual(ids, ['wrobel', 'wrobel-stable'])
+        self.assertTrue('wrobel' in db)
+        self.assertFalse('unknown' in db)
+        # Callers get their own copy of the cached names.
+        ids.append('unknown')
+        self.assertEqual(db.list_ids(), ['wrobel', 'wrobel-stable'])
+
+        ovl = db.overlays.pop('wrobel')
+        self.assertEqual(db.list_ids(), ['wrobel-stable'])
+        db.overlays['a-first'] = ovl
+        self.assertEqual(db.list_ids(), ['a-first', 'wrobel-stable'])
+        self.assertEqual(db.overlays.revision, revision + 2)
+
+
 class PathUtil(unittest.TestCase):
 
     def test(self):
@@ -603,6 +1330,31 @@ class PathUtil(unittest.TestCase):
         self.assertEqual(path(['/a/','/b','c/']), '/a/b/c')
 
 
+class PoolMap(unittest.TestCase):
+
+    def test(self):
+        import threading
+        config = {'output': Message(), 'sync_jobs': '4'}
+        self.assertEqual(get_jobs(config, 'sync_jobs'), 4)
+        for jobs in ('0', '-2', 'many', None):
+            config['sync_jobs'] = jobs
+            self.assertEqual(get_jobs(config, 'sync_jobs'), 1)
+
+        threads = set()
+        def square(i):
+            threads.add(threading.current_thread())
+            return i * i
+        self.assertEqual(list(pool_map(square, range(20), 4)),
+                         [i * i for i in range(20)])
+        self.assertEqual(sorted(pool_map(square, range(20), 4,
+                                         ordered=False)),
+                         [i * i for i in range(20)])
+        # A single job runs in the calling thread.
+        threads.clear()
+        self.assertEqual(list(pool_map(square, [3], 4)), [9])
+        self.assertEqual(threads, set([threading.current_thread()]))
+
+
 class Unicode(unittest.TestCase):
     def _overlays_bug(self, number):
         config = BareConfig()
@@ -699,6 +1451,7 @@ class ReadWriteSelectListDbBase(unittest.TestCase):
         tmpdir = tempfile.mkdtemp(prefix='laymantmp_')
         test_xml = os.path.join(tmpdir, 'test.xml')
         test_json = os.path.join(tmpdir, 'test.json')
+        test_sqlite = os.path.join(tmpdir, 'test.db')
         config = BareConfig()
 
         a = DbBase(config, [HERE + '/testfiles/global-overlays.xml', ])
@@ -722,6 +1475,28 @@ class ReadWriteSelectListDbBase(unittest.TestCase):
         keys = sorted(c.overlays)
         self.assertEqual(keys, ['twitch153'])
 
+        config.set_option('db_type', 'xml')
+        a = DbBase(config, [HERE + '/testfiles/global-overlays.xml', ])
+        sqlite_cfg = {'output': Message(), 'db_type': 'sqlite',
+                      'svn_command': '/usr/bin/svn',
+                      'rsync_command':'/usr/bin/rsync'}
+        b = DbBase(sqlite_cfg, [test_sqlite,], ignore_init_read_errors=True)
+
+        b.overlays.update(a.overlays)
+        b.write(test_sqlite)
+
+        c = DbBase(sqlite_cfg, [test_sqlite,])
+        self.assertEqual(c.list(verbose=True), a.list(verbose=True))
+
+        # Changes and removals are written incrementally.
+        c.overlays['wrobel'].priority = 20
+        del c.overlays['wrobel-stable']
+        c.write(test_sqlite)
+
+        d = DbBase(sqlite_cfg, [test_sqlite,])
+        self.assertEqual(d.list_ids(), ['wrobel'])
+        self.assertEqual(d.overlays['wrobel'].priority, 20)
+
         # Clean up:
         os.unlink(test_xml)
         os.unlink(test_json)
@@ -763,6 +1538,347 @@ class RemoteDBCache(unittest.TestCase):
         keys = sorted(db.overlays)
         self.assertEqual(keys, ['wrobel', 'wrobel-stable'])
 
+        # An unmodified list is neither fetched nor rewritten again.
+        self.assertEqual(db.cache(), (False, True))
+
+        # A refetched list with unchanged content is not an update either.
+        with fileopen(db.filepath(config['overlays']) + '.timestamp',
+                      'w') as f:
+            f.write('0')
+        self.assertEqual(db.cache(), (False, True))
+
+        shutil.rmtree(tmpdir)
+
+
+class RemoteDBSnapshot(unittest.TestCase):
+    def test(self):
+        tmpdir = tempfile.mkdtemp(prefix='laymantmp_')
+        cache = os.path.join(tmpdir, 'cache')
+        my_opts = {
+                   'overlays' :
+                   ['file://' + HERE + '/testfiles/global-overlays.xml'],
+                   'cache' : cache,
+                   'nocheck'    : 'yes',
+                   'proxy' : None
+                  }
+        config = OptionConfig(my_opts)
+        db = RemoteDB(config)
+        self.assertEqual(db.cache(), (True, True))
+
+        filepath = db.filepath(config['overlays'])
+        snapshot = filepath + '.snapshot.json'
+        with open(filepath + '.pickle', 'wb') as f:
+            f.write(b'old')
+
+        # The first read parses the XML and creates the snapshot.
+        parsed = RemoteDB(config)
+        self.assertTrue(os.path.exists(snapshot))
+        self.assertFalse(os.path.exists(filepath + '.pickle'))
+
+        # Later reads are served from the snapshot.
+        cached = RemoteDB(config)
+        self.assertEqual(sorted(cached.overlays), ['wrobel', 'wrobel-stable'])
+        for name in parsed.overlays:
+            self.assertEqual(cached.overlays[name], parsed.overlays[name])
+            self.assertEqual(cached.overlays[name].get_infostr(),
+                             parsed.overlays[name].get_infostr())
+
+        # A broken snapshot is ignored.
+        with open(snapshot, 'wb') as f:
+            f.write(b'\x80\x04garbage')
+        self.assertEqual(sorted(RemoteDB(config).overlays),
+                         ['wrobel', 'wrobel-stable'])
+
+        # A changed list invalidates the snapshot.
+        with fileopen(filepath + '.xml', 'r') as f:
+            text = f.read()
+        with fileopen(filepath + '.xml', 'w') as f:
+            f.write(text.replace('wrobel-stable', 'wrobel-testing'))
+        changed = RemoteDB(config)
+        self.assertEqual(sorted(changed.overlays), ['wrobel', 'wrobel-testing'])
+
+        shutil.rmtree(tmpdir)
+
+
+class RemoteSearch(unittest.TestCase):
+
+    def test(self):
+        tmpdir = tempfile.mkdtemp(prefix='laymantmp_')
+        overlays = os.path.join(tmpdir, 'overlays.xml')
+        shutil.copy(HERE + '/testfiles/global-overlays.xml', overlays)
+        config = {'output': Message(),
+                  'db_type': 'xml',
+                  'svn_command': '/usr/bin/svn',
+                  'rsync_command':'/usr/bin/rsync'}
+        db = DbBase(config, [overlays, ])
+        path = os.path.join(tmpdir, 'cache_search.json')
+
+        index = SearchIndex(path, config['output'])
+        sources = index.list_stats([overlays])
+        self.assertFalse(index.load(sources))
+        index.build(db.overlays, sources)
+        index.save()
+
+        # Names weigh more than descriptions, words match by prefix.
+        self.assertEqual(index.search('wrobel'),
+                         ['wrobel', 'wrobel-stable'])
+        self.assertEqual(index.search('Gunnar ebuild'), ['wrobel-stable'])
+        self.assertEqual(index.search('wrobel-stable'), ['wrobel-stable'])
+        self.assertEqual(index.search('nobody@gentoo.org test'), ['wrobel'])
+        self.assertEqual(index.search('missing'), [])
+        self.assertEqual(index.search(''), [])
+
+        stored = SearchIndex(path, config['output'])
+        self.assertTrue(stored.load(sources))
+        self.assertEqual(stored.search('coll'), ['wrobel-stable'])
+
+        # A changed list invalidates the stored index.
+        with fileopen(overlays, 'a') as f:
+            f.write('\n')
+        self.assertFalse(stored.load(index.list_stats([overlays])))
+
+        shutil.rmtree(tmpdir)
+
+
+class ReposConfCache(unittest.TestCase):
+    def test(self):
+        tmpdir = tempfile.mkdtemp(prefix='laymantmp_')
+        reposconf = os.path.join(tmpdir, 'repos.conf')
+        with fileopen(reposconf, 'w') as f:
+            f.write('')
+
+        my_opts = {
+                   'installed' :
+                   HERE + '/testfiles/global-overlays.xml',
+                   'nocheck'    : 'yes',
+                   'storage'   : tmpdir,
+                   'repos_conf' : reposconf,
+                   'conf_type' : ['repos.conf'],
+                   }
+        config = OptionConfig(my_opts)
+        config.set_option('quietness', 3)
+
+        a = DB(config)
+        conf = RepoConfManager(config, a.overlays)
+
+        self.assertEqual(conf.add(a.overlays['wrobel']), [True])
+        handler = conf._handlers['reposconf']
+        written = os.stat(reposconf).st_ino
+
+        # A batch ending where it started does not touch the file.
+        conf.begin_batch()
+        conf.add(a.overlays['wrobel-stable'])
+        conf.delete(a.overlays['wrobel-stable'])
+        self.assertEqual(conf.commit_batch(), [True])
+        self.assertEqual(os.stat(reposconf).st_ino, written)
+        self.assertFalse(handler.defer_write)
+
+        # Outside edits are picked up by the cached handler.
+        with fileopen(reposconf, 'a') as f:
+            f.write('[other]\nlocation = /tmp/other\n\n')
+        self.assertEqual(conf.add(a.overlays['wrobel-stable']), [True])
+        self.assertTrue(conf._handlers['reposconf'] is handler)
+        with fileopen(reposconf, 'r') as f:
+            content = f.read()
+        for name in ('[other]', '[wrobel]', '[wrobel-stable]'):
+            self.assertTrue(name in content)
+
+        shutil.rmtree(tmpdir)
+
+
+class ResolveCommand(unittest.TestCase):
+    def test(self):
+        tmpdir = tempfile.mkdtemp(prefix='laymantmp_')
+        tool = os.path.join(tmpdir, 'laymantool')
+        with fileopen(tool, 'w') as f:
+            f.write('#!/bin/sh\n')
+        errors = []
+        old_path = os.environ.get('PATH', '')
+        os.environ['PATH'] = tmpdir
+        try:
+            self.assertEqual(resolve_command('laymantool', errors.append),
+                             ('Command', tool))
+
+            # The lookup is done once per command and PATH.
+            os.unlink(tool)
+            self.assertEqual(resolve_command('laymantool', errors.append),
+                             ('Command', tool))
+            os.environ['PATH'] = tmpdir + os.pathsep + tmpdir
+            self.assertEqual(resolve_command('laymantool', errors.append),
+                             ('Command', None))
+            self.assertEqual(len(errors), 1)
+
+            os.environ['PATH'] = tmpdir
+            clear_command_cache()
+            self.assertEqual(resolve_command('laymantool', errors.append),
+                             ('Command', None))
+            self.assertEqual(resolve_command(tool, errors.append),
+                             ('File', None))
+            self.assertEqual(len(errors), 3)
+        finally:
+            os.environ['PATH'] = old_path
+            clear_command_cache()
+            shutil.rmtree(tmpdir)
+
+
+class SyncTree(unittest.TestCase):
+
+    def test(self):
+        from layman.utils import sync_tree
+        tmpdir = tempfile.mkdtemp(prefix='laymantmp_')
+        source = os.path.join(tmpdir, 'source')
+        target = os.path.join(tmpdir, 'target')
+
+        def write(tree, files):
+            for name, text in files.items():
+                name = os.path.join(tree, name)
+                if not os.path.isdir(os.path.dirname(name)):
+                    os.makedirs(os.path.dirname(name))
+                with fileopen(name, 'w') as f:
+                    f.write(text)
+                os.utime(name, (1000000000, 1000000000))
+
+        write(target, {'cat/pkg/same': 'same', 'cat/pkg/changed': 'old',
+                       'cat/gone/file': 'gone', 'removed': 'x'})
+        write(source, {'cat/pkg/same': 'same', 'cat/pkg/changed': 'new',
+                       'cat/pkg/added': 'added'})
+        # Same contents with another mtime are left alone as well.
+        write(source, {'touched': 'same'})
+        write(target, {'touched': 'same'})
+        os.utime(os.path.join(source, 'touched'), (1, 1))
+        os.utime(os.path.join(source, 'cat/pkg/changed'), (1, 1))
+
+        self.assertEqual(sync_tree(source, target), (2, 3))
+
+        found = {}
+        for root, dirs, files in os.walk(target):
+            for name in files:
+                name = os.path.join(root, name)
+                with fileopen(name) as f:
+                    found[os.path.relpath(name, target)] = f.read()
+        self.assertEqual(found, {'cat/pkg/same': 'same',
+                                 'cat/pkg/changed': 'new',
+                                 'cat/pkg/added': 'added',
+                                 'touched': 'same'})
+        self.assertEqual(os.stat(os.path.join(target, 'touched')).st_mtime,
+                         1000000000)
+
+        shutil.rmtree(tmpdir)
+
+
+class TarExtraction(unittest.TestCase):
+
+    def test(self):
+        import io
+        import tarfile
+        tmpdir = tempfile.mkdtemp(prefix='laymantmp_')
+        pkg = os.path.join(tmpdir, 'overlay.tar.xz')
+        with tarfile.open(pkg, 'w:xz') as archive:
+            for name in ('top/sub/file', 'top/other', '../evil'):
+                info = tarfile.TarInfo(name)
+                info.size = len(name)
+                archive.addfile(info, io.BytesIO(name.encode('utf-8')))
+            link = tarfile.TarInfo('top/sub/passwd')
+            link.type = tarfile.SYMTYPE
+            link.linkname = '../../../etc/passwd'
+            archive.addfile(link)
+
+        repo = ET.fromstring(
+            '<repo><name>extract</name><description>Test</description>'
+            '<owner><email>foo@example.org</email></owner>'
+            '<source type="tar" branch="top/sub">file://%s</source></repo>'
+            % urllib.pathname2url(pkg))
+        source = Overlay(BareConfig(), xml=repo).sources[0]
+        dest = os.path.join(tmpdir, 'dest')
+        os.mkdir(dest)
+
+        self.assertEqual(source.post_fetch(pkg, dest), 0)
+        found = []
+        for root, dirs, files in os.walk(tmpdir):
+            found.extend(os.path.relpath(os.path.join(root, i), tmpdir)
+                         for i in files + dirs)
+        self.assertEqual(sorted(found), ['dest', 'dest/top', 'dest/top/sub',
+                                         'dest/top/sub/file',
+                                         'overlay.tar.xz'])
+
+        # Broken archives are not handed to the tar command, only those
+        # compressed in a way tarfile does not know.
+        import layman.overlays.modules.tar.tar as tar_module
+        commands = []
+        run_command = tar_module.run_command
+        require_supported = tar_module.require_supported
+        tar_module.run_command = lambda config, command, args, **kwargs: \
+            commands.append(args) or 0
+        try:
+            with open(pkg, 'rb') as f:
+                data = f.read()
+            with open(pkg, 'wb') as f:
+                f.write(data[:len(data) // 2])
+            self.assertEqual(source.post_fetch(pkg, dest), 1)
+            self.assertEqual(commands, [])
+
+            # compress(1) output
+            with open(pkg, 'wb') as f:
+                f.write(b'\x1f\x9d\x90' + data[3:])
+            source.command = lambda: 'tar'
+            tar_module.require_supported = lambda *args: True
+            self.assertEqual(source.post_fetch(pkg, dest), 0)
+            self.assertEqual(commands, [['-x', '-f', pkg, '-C', dest,
+                                         'top/sub']])
+            # Whatever tarfile extracted before failing is gone.
+            self.assertEqual(os.listdir(dest), [])
+        finally:
+            tar_module.run_command = run_command
+            tar_module.require_supported = require_supported
+
+        shutil.rmtree(tmpdir)
+
+
+class XmlStreamRead(unittest.TestCase):
+
+    def test(self):
+        config = {'output': Message(),
+                  'db_type': 'xml',
+                  'svn_command': '/usr/bin/svn',
+                  'rsync_command':'/usr/bin/rsync'}
+        tmpdir = tempfile.mkdtemp(prefix='laymantmp_')
+        path = os.path.join(tmpdir, 'repositories.xml')
+        with fileopen(path, 'w') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    '<repositories version="1.0">\n')
+            for i in range(2000):
+                f.write('<repo quality="experimental" status="unofficial">'
+                        '<name>overlay-%d</name><description>Overlay %d'
+                        '</description><owner><email>foo@example.org'
+                        '</email></owner><source type="git">'
+                        'https://example.org/%d.git</source></repo>\n'
+                        % (i, i, i))
+            f.write('</repositories>\n')
+
+        db = DbBase(config, [path])
+        self.assertEqual(len(db.overlays), 2000)
+        self.assertEqual(db.select('overlay-1999').descriptions,
+                         ['Overlay 1999'])
+
+        # Lazy overlays keep their whole element.
+        lazy = DbBase(config, [path], lazy=True)
+        ovl = lazy.select('overlay-7')
+        self.assertTrue(ovl.__dict__['_overlay'] is None)
+        self.assertEqual(ovl.__dict__['_definition']['xml']
+                         .find('description').text, 'Overlay 7')
+        self.assertEqual(lazy.select('overlay-1999').descriptions,
+                         ['Overlay 1999'])
+
+        # A truncated list adds none of the overlays before the error.
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(data[:len(data) // 2])
+        db = DbBase(config, [], allow_missing=True)
+        db.overlays['kept'] = lazy.select('overlay-7')
+        self.assertFalse(db._get_dbctl('xml_db').read_db(path))
+        self.assertEqual(list(db.overlays), ['kept'])
+
         shutil.rmtree(tmpdir)
 
 
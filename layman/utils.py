@@ -33,13 +33,21 @@ __version__ = '$Id: utils.py 236 2006-09-05 20:39:37Z wrobel $'
 
 import codecs
 import copy
+import filecmp
 import locale
 import os
 import re
+import shutil
 import subprocess
 import sys
+import tempfile
+import threading
 import types
 
+from  contextlib            import contextmanager
+from  multiprocessing.pool  import ThreadPool
+
+from  layman.compatibility  import fileopen
 from  layman.output         import Message
 
 if sys.hexversion >= 0x30200f0:
@@ -69,11 +77,15 @@ def decode_selection(selection):
     return selection
 
 
+# The preferred locale encoding, looked up once, see get_encoding().
+_preferred_encoding = []
+
+
 def get_encoding(output):
     if hasattr(output, 'encoding') \
             and output.encoding != None:
         return output.encoding
-    else:
+    if not _preferred_encoding:
         encoding = locale.getpreferredencoding()
         # Make sure that python knows the encoding. Bug 350156
         try:
@@ -83,7 +95,8 @@ def get_encoding(output):
         except LookupError:
             # Python does not know the encoding, so use utf-8.
             encoding = 'utf_8'
-        return encoding
+        _preferred_encoding.append(encoding)
+    return _preferred_encoding[0]
 
 
 def get_ans(msg, color='green'):
@@ -202,28 +215,73 @@ def reload_config(config):
     config.read_config(defaults)
 
 
+# Resolved commands, {(command, PATH): path or None}, see resolve_command().
+_resolved_commands = {}
+
+
+def clear_command_cache():
+    '''
+    Forgets the commands resolved so far, e.g. after installing a tool.
+    '''
+    _resolved_commands.clear()
+
+
+def _find_command(command, env_path):
+    if os.path.isabs(command):
+        if os.path.exists(command):
+            return command
+        return None
+    for d in env_path.split(os.pathsep):
+        f = os.path.join(d, command)
+        if os.path.exists(f):
+            return f
+    return None
+
+
 def resolve_command(command, output):
+    '''
+    Looks up command, an absolute path or a name searched for in PATH.
+    The result is cached for the process per command and PATH value.
+
+    @rtype tuple: ('File' or 'Command', path or None)
+    '''
+    env_path = os.environ.get('PATH', '')
+    key = (command, env_path)
+    if key in _resolved_commands:
+        found = _resolved_commands[key]
+    else:
+        found = _resolved_commands[key] = _find_command(command, env_path)
+
     if os.path.isabs(command):
-        if not os.path.exists(command):
+        if not found:
             output('Program "%s" not found' % command)
-            return ('File', None)
-        return ('File', command)
-    else:
-        kind = 'Command'
-        env_path = os.environ['PATH']
-        for d in env_path.split(os.pathsep):
-            f = os.path.join(d, command)
-            if os.path.exists(f):
-                return ('Command', f)
+        return ('File', found)
+    if not found:
         output('Cound not resolve command ' +\
             '"%s" based on PATH "%s"' % (command, env_path))
-        return ('Command', None)
+    return ('Command', found)
 
 
-def run_command(config, command, args, **kwargs):
-    output = config['output']
-    output.debug("Utils.run_command(): " + command, 6)
+# Per thread replacement for run_command(), see set_command_runner().
+_command_runner = threading.local()
+
+
+def set_command_runner(runner):
+    '''
+    Makes run_command() calls from the current thread go to runner, which
+    takes the same arguments and returns the exit status.  None restores
+    the blocking default.
+    '''
+    _command_runner.run = runner
+
+
+def prepare_command(config, command, args, **kwargs):
+    '''
+    Resolves the command and builds what is needed to run it.
 
+    @rtype tuple: (argument list, cwd, environment, printable command)
+    '''
+    output = config['output']
     file_to_run = resolve_command(command, output.error)[1]
     args = [file_to_run] + args
     assert('pwd' not in kwargs)  # Bug detector
@@ -245,6 +303,20 @@ def run_command(config, command, args, **kwargs):
     if cwd is not None:
         command_repr = '( cd %s  && %s )' % (cwd, command_repr)
 
+    return (args, cwd, env, command_repr)
+
+
+def run_command(config, command, args, **kwargs):
+    runner = getattr(_command_runner, 'run', None)
+    if runner is not None:
+        return runner(config, command, args, **kwargs)
+
+    output = config['output']
+    output.debug("Utils.run_command(): " + command, 6)
+
+    args, cwd, env, command_repr = prepare_command(config, command, args,
+                                                   **kwargs)
+
     cmd = kwargs.get('cmd', '')
     output.info('Running %s... # %s' % (cmd, command_repr), 2)
 
@@ -325,6 +397,149 @@ def delete_empty_directory(mdir, output=None):
                 output.warn('Hint: You are not root.')
 
 
+@contextmanager
+def atomic_open(filename, mode='w'):
+    '''
+    Opens a temporary file next to filename which replaces filename only
+    once it has been written and closed without errors, so readers never
+    see a partially written file.  Symlinks are followed and the mode of
+    an existing file is kept.
+    '''
+    target = os.path.realpath(filename)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target),
+                               prefix='.%s.' % os.path.basename(target))
+    os.close(fd)
+    try:
+        with fileopen(tmp, mode) as f:
+            yield f
+        if os.path.exists(target):
+            shutil.copymode(target, tmp)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp, 0o666 & ~umask)
+        os.rename(tmp, target)
+    except:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def _same_entry(source, target):
+    '''
+    Determines whether target already equals source, comparing sizes,
+    then mtimes and only then contents.  Fixes up a differing mode.
+    '''
+    if os.path.islink(source) or os.path.islink(target):
+        return (os.path.islink(source) and os.path.islink(target) and
+                os.readlink(source) == os.readlink(target))
+    if not os.path.isfile(target):
+        return False
+    src_stat = os.stat(source)
+    dst_stat = os.stat(target)
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if (int(src_stat.st_mtime) != int(dst_stat.st_mtime) and
+        not filecmp.cmp(source, target, shallow=False)):
+        return False
+    if src_stat.st_mode != dst_stat.st_mode:
+        os.chmod(target, src_stat.st_mode & 0o7777)
+    return True
+
+
+def sync_tree(source, target):
+    '''
+    Makes the directory tree target equal to source while only touching
+    what differs, so unchanged files keep their mtime.  Changed files are
+    moved out of source.
+
+    @rtype tuple (number of changed or added entries, number of removed
+                  entries)
+    '''
+    def is_dir(entry):
+        return os.path.isdir(entry) and not os.path.islink(entry)
+
+    changed = removed = 0
+
+    # Remove what source lacks, or has as another kind of entry.
+    for root, dirs, files in os.walk(target, topdown=False):
+        src_root = os.path.join(source, os.path.relpath(root, target))
+        for name in dirs + files:
+            src = os.path.join(src_root, name)
+            dst = os.path.join(root, name)
+            if os.path.lexists(src) and is_dir(src) == is_dir(dst):
+                continue
+            if is_dir(dst):
+                shutil.rmtree(dst)
+            else:
+                os.unlink(dst)
+            removed += 1
+
+    for root, dirs, files in os.walk(source):
+        dst_root = os.path.join(target, os.path.relpath(root, source))
+        for name in dirs + files:
+            src = os.path.join(root, name)
+            dst = os.path.join(dst_root, name)
+            if is_dir(src):
+                if not os.path.isdir(dst):
+                    os.mkdir(dst)
+                    changed += 1
+                if os.stat(src).st_mode != os.stat(dst).st_mode:
+                    os.chmod(dst, os.stat(src).st_mode & 0o7777)
+            elif not _same_entry(src, dst):
+                # Replaces dst atomically.
+                os.rename(src, dst)
+                changed += 1
+
+    return (changed, removed)
+
+
+def get_jobs(config, option):
+    '''
+    Returns the number of concurrent jobs set by the config option, at
+    least 1.  Invalid values warn and fall back to a single job.
+
+    @rtype int
+    '''
+    jobs = config[option]
+    try:
+        jobs = int(jobs)
+    except (TypeError, ValueError):
+        config['output'].warn('Invalid %(option)s value "%(jobs)s", running '
+            'one job at a time' % {'option': option, 'jobs': jobs}, 2)
+        return 1
+    return max(jobs, 1)
+
+
+def pool_map(function, items, jobs, ordered=True):
+    '''
+    Calls function for every one of items, using up to jobs threads.  A
+    single job runs in the calling thread.
+
+    @param ordered: bool, whether to yield the results in the order of
+    items instead of as they complete.
+    @rtype generator of the results of function
+    '''
+    items = list(items)
+    workers = min(jobs, len(items))
+    if workers <= 1:
+        for item in items:
+            yield function(item)
+        return
+
+    pool = ThreadPool(workers)
+    try:
+        if ordered:
+            results = pool.imap(function, items, chunksize=1)
+        else:
+            results = pool.imap_unordered(function, items)
+        for result in results:
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
 def create_overlay_dict(**kwargs):
     """Creates a complete empty reository definition.
     Then fills it with values passed in